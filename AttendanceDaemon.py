@@ -0,0 +1,277 @@
+"""Headless attendance service: recognize faces and record attendance without a GUI.
+
+Usage: python AttendanceDaemon.py ["spec|class_id|fps;..."] [--workers N]
+
+Meant for unattended machines (a mini PC per building wing) that run the
+recognize-and-record loop of the desktop app from boot, with no display and
+without PyQt5 installed. Everything comes from config/setting.py and its
+FACE_* environment variables:
+
+* the sources are FRAME_SOURCES (FACE_SOURCES), each tagged with the class
+  whose attendance it records, e.g. ``FACE_SOURCES="0|1|10;1|2|10"``.
+  Untagged sources recognize every enrolled user but only log decisions;
+* recognition, voting and the attendance writer use the same settings as
+  the app, and newly published models are picked up while running;
+* class rosters are reloaded every ROSTER_REFRESH_INTERVAL seconds, after a
+  day rollover and on SIGHUP.
+
+SIGTERM and SIGINT stop the sources, write out the queued attendance and
+exit with status 0. When every source has failed the service exits with
+status 1, so a supervisor restarts it, e.g. a systemd unit with::
+
+    [Service]
+    WorkingDirectory=/opt/face-attendance
+    Environment=FACE_SOURCES=0|1|10
+    ExecStart=/usr/bin/python3 AttendanceDaemon.py
+    Restart=on-failure
+"""
+import argparse
+import datetime
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from config.setting import (ANN_INDEX, ANN_NPROBE, ANN_RERANK, ATTENDANCE_BATCH_SIZE, ATTENDANCE_FLUSH_INTERVAL,
+                            CASCADE_FILE, CONFIDENCE_THRESHOLD, DAEMON_LOG_LEVEL, DETECT_EVERY_N_FRAMES,
+                            DETECT_SCALE, FRAME_SOURCES, MODEL_POLL_INTERVAL, RECOGNITION_WORKERS, REPLAY_FAST,
+                            ROSTER_REFRESH_INTERVAL, TRAINER_DIR, TRAINER_FILE, VOTE_MIN_RATIO, VOTE_MIN_VOTES,
+                            VOTE_WINDOW)
+from recognition.ann_index import load_recognizer
+from recognition.attendance_writer import AttendanceWriter
+from recognition.database import DatabaseManager
+from recognition.galleries import ClassGalleries
+from recognition.model_store import ModelStore
+from recognition.multi_source import MultiSourceScheduler, assign_galleries, parse_sources
+from recognition.sources import open_source
+from recognition.tracking import TrackingDetector
+from recognition.voting import IdentityVoter
+
+_logger = logging.getLogger('attendance_daemon')
+
+# Seconds before rosters that could not be loaded are tried again
+ROSTER_RETRY_INTERVAL = 10.0
+
+
+class AttendanceDaemon:
+    """Runs the sources on a MultiSourceScheduler and records the attendance they recognize"""
+
+    def __init__(self, specs, workers=None):
+        self.specs = specs
+        self.class_ids = {spec.class_id for spec in specs if spec.class_id is not None}
+        self.db = DatabaseManager()
+        self.attendance_writer = AttendanceWriter(
+            self.db.connect,
+            batch_size=ATTENDANCE_BATCH_SIZE,
+            flush_interval=ATTENDANCE_FLUSH_INTERVAL,
+            on_failed=self.on_attendance_failed,
+        )
+        self.store = ModelStore(os.path.join(TRAINER_DIR, TRAINER_FILE))
+        self.model = None
+        self.model_version = None
+        self.galleries = None
+        self.rosters = {}
+        self.voters = {spec.name: IdentityVoter(VOTE_WINDOW, VOTE_MIN_VOTES, VOTE_MIN_RATIO, 100 - CONFIDENCE_THRESHOLD) for spec in specs}
+        # Day each voter's session started; a voter decides on every person once per day
+        self.voter_dates = {spec.name: datetime.date.today() for spec in specs}
+        self.sources = {}
+        self.scheduler = None
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._reload = threading.Event()
+
+    def stop(self):
+        """Ask ``run`` to return; safe to call from a signal handler"""
+        self._stop_event.set()
+
+    def reload_rosters(self):
+        """Ask ``run`` to reload the class rosters; safe to call from a signal handler"""
+        self._reload.set()
+
+    def on_attendance_failed(self, rows):
+        """Called from the writer for records the database rejected; they may be recorded again"""
+        with self._lock:
+            for class_id, student_id, attendance_date, *_ in rows:
+                roster = self.rosters.get(class_id)
+                if roster is not None and roster.date == attendance_date:
+                    roster.unmark_recorded(student_id)
+
+    def open(self):
+        for spec in self.specs:
+            source = open_source(spec.spec, realtime=not REPLAY_FAST)
+            if not source.isOpened():
+                raise RuntimeError(f"Cannot open source {spec.spec}")
+            self.sources[spec] = source
+        self.scheduler = MultiSourceScheduler(
+            self.sources,
+            lambda: TrackingDetector(cv2.CascadeClassifier(CASCADE_FILE), DETECT_EVERY_N_FRAMES, DETECT_SCALE, 1.3, 5),
+            self.on_result,
+            on_error=lambda spec, message: _logger.error(f"{spec.name}: {message}"),
+            workers=self.workers,
+        )
+        self.attendance_writer.start()
+
+    def close(self):
+        if self.scheduler is not None:
+            self.scheduler.stop()
+        for source in self.sources.values():
+            source.release()
+        self.attendance_writer.close()
+        self.db.close()
+
+    def run(self):
+        """Serve the sources until ``stop`` is called or every source failed; return the exit status"""
+        try:
+            self.open()
+            self.load_model()
+            self.refresh_rosters()
+            self.assign()
+            self.scheduler.start()
+            _logger.info(f"Serving {len(self.specs)} sources: {', '.join(spec.name for spec in self.specs)}")
+            next_model_check = time.monotonic() + MODEL_POLL_INTERVAL
+            next_refresh = time.monotonic() + (ROSTER_REFRESH_INTERVAL if self.rosters_loaded()
+                                               else ROSTER_RETRY_INTERVAL)
+            while not self._stop_event.wait(min(MODEL_POLL_INTERVAL, 0.5)):
+                if not self.scheduler.is_running():
+                    _logger.error("Every frame source has stopped")
+                    return 1
+                changed = False
+                if time.monotonic() >= next_model_check:
+                    next_model_check = time.monotonic() + MODEL_POLL_INTERVAL
+                    changed = self.load_model()
+                if self._reload.is_set() or time.monotonic() >= next_refresh:
+                    self._reload.clear()
+                    changed = self.refresh_rosters() or changed
+                    next_refresh = time.monotonic() + (ROSTER_REFRESH_INTERVAL if self.rosters_loaded()
+                                                       else ROSTER_RETRY_INTERVAL)
+                if changed:
+                    self.assign()
+            _logger.info("Stopping")
+            return 0
+        finally:
+            self.close()
+            if self.scheduler is not None:
+                for name, stats in self.scheduler.stats().items():
+                    _logger.info(f"{name}: {stats['processed']} frames processed, {stats['dropped']} dropped")
+
+    def load_model(self):
+        """Load the published model if it is newer than the one in use; return whether it was"""
+        version, model_path = self.store.current()
+        if model_path is None or version == self.model_version:
+            return False
+        try:
+            model = load_recognizer(model_path, ANN_INDEX, ANN_NPROBE, ANN_RERANK)
+        except Exception as e:
+            _logger.error(f"Failed to load model {model_path}: {str(e)}")
+            return False
+        self.model, self.model_version, self.galleries = model, version, ClassGalleries(model)
+        _logger.info(f"Loaded model version {version} from {model_path}")
+        return True
+
+    def rosters_loaded(self):
+        return self.class_ids <= set(self.rosters)
+
+    def refresh_rosters(self):
+        """Reload the roster of every tagged class; return whether any was loaded.
+
+        Attendance recorded today by this process is kept, as the writer may
+        not have committed it yet.
+        """
+        loaded = {}
+        for class_id in self.class_ids:
+            try:
+                loaded[class_id] = self.db.load_class_roster(class_id)
+            except Exception as e:
+                _logger.error(f"Failed to load roster of class {class_id}: {str(e)}")
+        with self._lock:
+            for class_id, roster in loaded.items():
+                previous = self.rosters.get(class_id)
+                if previous is not None and previous.date == roster.date:
+                    roster.recorded |= previous.recorded
+                self.rosters[class_id] = roster
+        return bool(loaded)
+
+    def assign(self):
+        with self._lock:
+            rosters = dict(self.rosters)
+        assign_galleries(self.scheduler, self.specs, self.galleries, self.model, rosters)
+
+    def on_result(self, spec, packet):
+        # Frames of one source never overlap, so its voter needs no lock
+        voter = self.voters[spec.name]
+        today = datetime.date.today()
+        if self.voter_dates[spec.name] != today:
+            # Everyone recognized yesterday must be recognized (and recorded) again
+            voter.reset()
+            self.voter_dates[spec.name] = today
+        for track_id, _, id_, confidence in packet.results:
+            decision = voter.add(track_id, id_, confidence)
+            if decision:
+                self.record(spec, *decision)
+        voter.retain(packet.track_ids)
+
+    def record(self, spec, user_id, confidence):
+        """Record a recognized student as present once per class and day"""
+        # Convert OpenCV confidence (lower is better) to percentage (higher is better)
+        confidence_score = max(0, min(100, 100 - confidence))
+        if spec.class_id is None:
+            _logger.info(f"[{spec.name}] recognized user {user_id} ({confidence_score:.2f}%)")
+            return
+        if confidence_score <= CONFIDENCE_THRESHOLD:
+            return
+        student_id = int(user_id)
+        with self._lock:
+            roster = self.rosters.get(spec.class_id)
+            if roster is None:
+                _logger.warning(f"[{spec.name}] roster of class {spec.class_id} not loaded, "
+                                f"student {student_id} not recorded")
+                return
+            if not roster.is_current():
+                roster.start_new_day()
+                self.reload_rosters()
+            if not roster.is_registered(student_id):
+                _logger.info(f"[{spec.name}] student {student_id} not registered for class {spec.class_id}")
+                return
+            if roster.is_recorded(student_id):
+                return
+            self.attendance_writer.submit(spec.class_id, student_id, 'Có mặt', confidence_score)
+            roster.mark_recorded(student_id)
+            student_name = roster.name(student_id)
+        _logger.info(f"[{spec.name}] Điểm danh: {student_name} ({student_id}), class {spec.class_id} "
+                     f"(Độ chính xác: {confidence_score:.2f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless face recognition attendance service")
+    parser.add_argument('sources', nargs='?', default=FRAME_SOURCES, help='"spec|class_id|fps" entries separated by ";"')
+    parser.add_argument('--workers', type=int, default=RECOGNITION_WORKERS, help="shared workers (0 = one per core)")
+    args = parser.parse_args()
+    logging.basicConfig(level=DAEMON_LOG_LEVEL, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    specs = parse_sources(args.sources)
+    if not specs:
+        sys.exit(" [ERROR] No frame sources, set FACE_SOURCES (see config/setting.py)")
+    if all(spec.class_id is None for spec in specs):
+        _logger.warning("No source is tagged with a class, recognized faces are only logged")
+
+    daemon = AttendanceDaemon(specs, args.workers or None)
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: daemon.stop())
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda signum, frame: daemon.reload_rosters())
+    try:
+        status = daemon.run()
+    except Exception as e:
+        _logger.error(f"Attendance service failed: {str(e)}")
+        status = 1
+    sys.exit(status)
+
+
+if __name__ == '__main__':
+    main()
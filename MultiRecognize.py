@@ -0,0 +1,153 @@
+"""Recognize faces on several cameras at once with one shared model.
+
+Usage: python MultiRecognize.py ["spec|class_id|fps;..."] [--workers N] [--no-preview]
+
+Sources default to FRAME_SOURCES (see config/setting.py). Sources tagged
+with a class only search the students of that class, loaded from the
+database; untagged ones search every enrolled user. Decisions are printed
+per source, and newly published models are picked up while running.
+"""
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from config.setting import (ANN_INDEX, ANN_NPROBE, ANN_RERANK, CASCADE_FILE, CONFIDENCE_THRESHOLD,
+                            DETECT_EVERY_N_FRAMES, DETECT_SCALE, FRAME_SOURCES, MODEL_POLL_INTERVAL,
+                            RECOGNITION_WORKERS, REPLAY_FAST, TRAINER_DIR, TRAINER_FILE, VOTE_MIN_RATIO,
+                            VOTE_MIN_VOTES, VOTE_WINDOW)
+from recognition.ann_index import load_recognizer
+from recognition.galleries import ClassGalleries
+from recognition.model_store import ModelStore
+from recognition.multi_source import MultiSourceScheduler, assign_galleries, parse_sources
+from recognition.sources import open_source
+from recognition.tracking import TrackingDetector
+from recognition.voting import IdentityVoter
+
+_logger = logging.getLogger(__name__)
+
+# Width of each source in the preview grid
+TILE_WIDTH = 480
+
+
+def load_rosters(specs):
+    """Class rosters of the tagged sources, or {} if the database is unavailable"""
+    class_ids = {spec.class_id for spec in specs if spec.class_id is not None}
+    if not class_ids:
+        return {}
+    try:
+        from recognition.database import DatabaseManager
+        db = DatabaseManager()
+        try:
+            return {class_id: db.load_class_roster(class_id) for class_id in class_ids}
+        finally:
+            db.close()
+    except Exception as e:
+        _logger.warning(f"Could not load class rosters, searching every enrolled user: {str(e)}")
+        return {}
+
+
+def tile(frames):
+    """Frames side by side in rows of up to three, scaled to TILE_WIDTH"""
+    tiles = [cv2.resize(frame, (TILE_WIDTH, TILE_WIDTH * frame.shape[0] // frame.shape[1])) for frame in frames]
+    height = max(t.shape[0] for t in tiles)
+    tiles = [cv2.copyMakeBorder(t, 0, height - t.shape[0], 0, 0, cv2.BORDER_CONSTANT) for t in tiles]
+    tiles += [np.zeros_like(tiles[0])] * (-len(tiles) % 3 if len(tiles) > 3 else 0)
+    rows = [np.hstack(tiles[i:i + 3]) for i in range(0, len(tiles), 3)]
+    return np.vstack(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-camera face recognition")
+    parser.add_argument('sources', nargs='?', default=FRAME_SOURCES, help='"spec|class_id|fps" entries separated by ";"')
+    parser.add_argument('--workers', type=int, default=RECOGNITION_WORKERS, help="shared workers (0 = one per core)")
+    parser.add_argument('--no-preview', action='store_true')
+    parser.add_argument('--seconds', type=float, default=None, help="stop after this long")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    specs = parse_sources(args.sources or '0')
+    store = ModelStore(os.path.join(TRAINER_DIR, TRAINER_FILE))
+    version, model_path = store.current()
+    if model_path is None:
+        sys.exit(" [ERROR] No trained model, enroll faces first")
+    # One model in memory for every source
+    model = load_recognizer(model_path, ANN_INDEX, ANN_NPROBE, ANN_RERANK)
+    rosters = load_rosters(specs)
+
+    sources = {}
+    for spec in specs:
+        source = open_source(spec.spec, realtime=not REPLAY_FAST)
+        if not source.isOpened():
+            sys.exit(f" [ERROR] Cannot open source {spec.spec}")
+        sources[spec] = source
+
+    voters = {spec.name: IdentityVoter(VOTE_WINDOW, VOTE_MIN_VOTES, VOTE_MIN_RATIO, 100 - CONFIDENCE_THRESHOLD) for spec in specs}
+    latest = {}
+    lock = threading.Lock()
+
+    def on_result(spec, packet):
+        # Frames of one source never overlap, so its voter needs no lock
+        voter = voters[spec.name]
+        for track_id, (x, y, w, h), id_, confidence in packet.results:
+            cv2.rectangle(packet.frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
+            decision = voter.add(track_id, id_, confidence)
+            if decision:
+                roster = rosters.get(spec.class_id)
+                name = roster.name(decision[0]) if roster else decision[0]
+                print(f" [{spec.name}] class {spec.class_id}: {name} ({round(100 - decision[1])}%)", flush=True)
+        voter.retain(packet.track_ids)
+        with lock:
+            latest[spec.name] = packet.frame
+
+    scheduler = MultiSourceScheduler(
+        sources,
+        lambda: TrackingDetector(cv2.CascadeClassifier(CASCADE_FILE), DETECT_EVERY_N_FRAMES, DETECT_SCALE, 1.3, 5),
+        on_result,
+        on_error=lambda spec, message: print(f" [ERROR] {spec.name}: {message}", flush=True),
+        workers=args.workers or None,
+    )
+    assign_galleries(scheduler, specs, ClassGalleries(model), model, rosters)
+    scheduler.start()
+    start = last_check = time.monotonic()
+    try:
+        while scheduler.is_running():
+            if args.seconds is not None and time.monotonic() - start > args.seconds:
+                break
+            if time.monotonic() - last_check >= MODEL_POLL_INTERVAL:
+                last_check = time.monotonic()
+                new_version, new_path = store.current()
+                if new_version != version:
+                    version, model = new_version, load_recognizer(new_path, ANN_INDEX, ANN_NPROBE, ANN_RERANK)
+                    assign_galleries(scheduler, specs, ClassGalleries(model), model, rosters)
+                    _logger.info(f"Loaded model version {version}")
+            if args.no_preview:
+                time.sleep(0.05)
+                continue
+            with lock:
+                frames = [latest[spec.name] for spec in specs if spec.name in latest]
+            if frames:
+                cv2.imshow('cameras', tile(frames))
+            if cv2.waitKey(30) & 0xff == 27:  # ESC
+                break
+    finally:
+        scheduler.stop()
+        for source in sources.values():
+            source.release()
+        if not args.no_preview:
+            cv2.destroyAllWindows()
+
+    elapsed = time.monotonic() - start
+    for name, stats in scheduler.stats().items():
+        print(f" [INFO] {name}: {stats['processed']} frames processed ({stats['processed'] / elapsed:.1f} fps), "
+              f"{stats['dropped']} dropped")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,18 @@
 import cv2
 import numpy as np
 import os
+import sys
+import time
 
-recognizer = cv2.face.LBPHFaceRecognizer_create()
-recognizer.read('trainer/trainer.yml')
+from config.setting import FRAME_SOURCE, REPLAY_FAST
+from recognition.lbph_model import load_model
+from recognition.model_store import ModelStore
+from recognition.preprocess import normalize_face
+from recognition.sources import open_source
+
+# Latest model published by training; an OpenCV trainer.yml also works but loads slowly
+model_path = ModelStore('trainer/trainer.lbph').current()[1] or 'trainer/trainer.yml'
+recognizer = load_model(model_path)
 cascadePath = "haarcascade_frontalface_default.xml"
 faceCascade = cv2.CascadeClassifier(cascadePath)
 
@@ -15,17 +24,23 @@ id = 0
 # names related to ids: example ==> Marcelo: id=1,  etc
 names = ['None', 'Marcelo', 'Paula', 'Ilza', 'Z', 'W']
 
-# Initialize and start realtime video capture
-cam = cv2.VideoCapture(0)
-cam.set(3,640) # set video widht
-cam.set(4,480) # set video height
+# Initialize and start video capture: camera, video file, image folder or synthetic frames
+# Usage: python Recognize.py [source]
+cam = open_source(sys.argv[1] if len(sys.argv) > 1 else FRAME_SOURCE,
+                  realtime=not REPLAY_FAST, width=640, height=480)
 
 # Define min window size to be recognized as a face
-minW = 0.1*cam.get(3)
-minH = 0.1*cam.get(4)
+minW = 0.1*cam.width
+minH = 0.1*cam.height
+
+frame_count = 0
+start_time = time.monotonic()
 
 while True:
     ret, img = cam.read()
+    if not ret:
+        break
+    frame_count += 1
     img = cv2.flip(img, 1) # Flip vertically
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
     
@@ -36,9 +51,16 @@ while True:
         minSize=(int(minW), int(minH))
     )
 
-    for(x, y, w, h) in faces:
+    # All faces of the frame are recognized in one call, normalized like the
+    # training crops when the model records their size
+    crops = [gray[y:y+h, x:x+w] for (x, y, w, h) in faces]
+    if recognizer.face_size:
+        crops = [normalize_face(face, recognizer.face_size) for face in crops]
+    predictions = recognizer.predict_batch(crops)
+
+    for (x, y, w, h), matches in zip(faces, predictions):
         cv2.rectangle(img, (x, y), (x+w, y+h), (0, 255, 0), 2)
-        id, confidence = recognizer.predict(gray[y:y+h, x:x+w])
+        id, confidence = matches[0]
 
         # Check if confidence is less them 100 ==> "0" is perfect match
         if (confidence < 100):
@@ -57,6 +79,8 @@ while True:
         break
 
 
+elapsed = time.monotonic() - start_time
+print("\n [INFO] {0} frames in {1:.1f}s ({2:.1f} fps)".format(frame_count, elapsed, frame_count / max(elapsed, 1e-6)))
 print("\n [INFO] Exiting Program and cleanup stuff")
 cam.release()
 cv2.destroyAllWindows()
@@ -0,0 +1,82 @@
+"""Recall and latency of the gallery index against the exact LBPH search.
+
+Builds synthetic galleries of increasing size (every user is a random
+smooth "face" photographed with small shifts, contrast changes and noise),
+then recognizes fresh samples of random users both ways.
+
+    python benchmarks/ann_index.py --users 250,500,1000 --samples 5
+
+Recall is the share of faces for which the index returns the same label as
+the exact search; accuracy is measured against the true user.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.synthetic import make_sample, synthetic_gallery
+from recognition.ann_index import NPROBE, RERANK, GalleryIndex, IndexedRecognizer
+from recognition.lbph_model import LBPHModel
+
+
+def per_face_ms(recognizer, faces, repeat=3):
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = recognizer.predict_batch(faces)
+        best = min(best, time.perf_counter() - start)
+    return 1000 * best / len(faces), [matches[0][0] for matches in results]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gallery index recall/latency benchmark")
+    parser.add_argument('--users', default='250,500,1000', help="comma-separated gallery sizes in users")
+    parser.add_argument('--samples', type=int, default=5, help="enrolled samples per user")
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--nprobe', type=int, default=NPROBE)
+    parser.add_argument('--rerank', type=int, default=RERANK)
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    sizes = sorted(int(users) for users in args.users.split(','))
+    print(f" [INFO] Generating {sizes[-1]} users x {args.samples} samples ...")
+    histograms, labels, bases = synthetic_gallery(sizes[-1], args.samples)
+
+    rng = np.random.default_rng(1)
+    results = []
+    print(f"{'users':>7} {'samples':>8} {'build s':>8} {'exact ms':>9} {'index ms':>9} {'recall':>7} {'acc exact':>9} {'acc index':>9}")
+    for users in sizes:
+        rows = users * args.samples
+        model = LBPHModel(histograms[:rows], labels[:rows])
+        truth = rng.integers(0, users, args.queries)
+        faces = [make_sample(rng, bases[user]) for user in truth]
+
+        start = time.perf_counter()
+        index = GalleryIndex.build(model.histograms)
+        build = time.perf_counter() - start
+        model.predict_batch(faces[:1])  # square roots of the gallery are cached on first use
+        exact_ms, exact = per_face_ms(model, faces)
+        index_ms, approx = per_face_ms(IndexedRecognizer(model, index, args.nprobe, args.rerank), faces)
+
+        result = {
+            'users': users, 'samples': rows, 'build_s': build,
+            'exact_ms_per_face': exact_ms, 'index_ms_per_face': index_ms,
+            'recall_at_1': float(np.mean(np.array(approx) == np.array(exact))),
+            'accuracy_exact': float(np.mean(np.array(exact) == truth)),
+            'accuracy_index': float(np.mean(np.array(approx) == truth)),
+        }
+        results.append(result)
+        print(f"{users:>7} {rows:>8} {build:>8.2f} {exact_ms:>9.2f} {index_ms:>9.2f} "
+              f"{result['recall_at_1']:>7.3f} {result['accuracy_exact']:>9.3f} {result['accuracy_index']:>9.3f}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'nprobe': args.nprobe, 'rerank': args.rerank, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
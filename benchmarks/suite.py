@@ -0,0 +1,296 @@
+"""Benchmark suite for the detection, recognition, training, model loading and database paths.
+
+Runs a fixed set of measurements on deterministic synthetic data (see
+``benchmarks/synthetic.py``) and writes them as JSON, so runs on different
+commits can be compared::
+
+    python benchmarks/suite.py --output before.json
+    python benchmarks/suite.py --output after.json --compare before.json
+    python benchmarks/suite.py --only detect --scale-factor 1.1 --min-neighbors 3
+
+* ``detect``: Haar ``detectMultiScale`` per frame at several resolutions;
+* ``predict``: ``predict`` and ``predict_batch`` latency against gallery size;
+* ``train``: ``train_model`` on a USERS x SAMPLES dataset, cold, with the
+  feature cache warm, incrementally after one more user, and unchanged;
+* ``load``: model (and gallery index) load time against gallery size;
+* ``db``: ``DatabaseManager`` and ``AttendanceWriter`` write throughput. Only
+  run with ``--db``: it adds a class and students to the database of
+  DB_CONFIG and deletes them again afterwards.
+
+Results are a flat ``{"benchmark.case.metric": value}`` dict. Metrics
+ending in ``_ms`` or ``_s`` are better when lower, ``_per_s`` when higher.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from benchmarks.synthetic import FACE, make_frame, make_sample, make_user, synthetic_gallery, write_dataset
+from config.setting import ATTENDANCE_BATCH_SIZE, ATTENDANCE_FLUSH_INTERVAL, CASCADE_FILE, ENROLL_SAMPLES
+from recognition.ann_index import load_recognizer, update_index
+from recognition.lbph_model import LBPHModel, load_model
+from recognition.training import train_model
+
+BENCHMARKS = ('detect', 'predict', 'train', 'load', 'db')
+RESOLUTIONS = ((320, 240), (640, 480), (1280, 720), (1920, 1080))
+
+
+def timings_ms(func, repeat, warmup=1):
+    """Median and 95th percentile of ``repeat`` calls of ``func``, in milliseconds"""
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(1000 * (time.perf_counter() - start))
+    return float(np.median(samples)), float(np.percentile(samples, 95))
+
+
+def timed(func):
+    """(result, seconds) of one call"""
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def bench_detect(results, args):
+    cascade = cv2.CascadeClassifier(os.path.join(ROOT, CASCADE_FILE))
+    for width, height in RESOLUTIONS:
+        gray = cv2.cvtColor(make_frame(width, height), cv2.COLOR_BGR2GRAY)
+
+        def detect():
+            return cascade.detectMultiScale(gray, args.scale_factor, args.min_neighbors)
+
+        median, p95 = timings_ms(detect, args.repeat)
+        key = f'detect.{width}x{height}'
+        results[f'{key}.median_ms'], results[f'{key}.p95_ms'] = median, p95
+        results[f'{key}.faces'] = len(detect())
+        print(f"  detect {width}x{height}: {median:.1f} ms (p95 {p95:.1f})")
+
+
+def bench_predict(results, args):
+    sizes = sorted(args.users)
+    histograms, labels, bases = synthetic_gallery(sizes[-1], args.samples)
+    rng = np.random.default_rng(1)
+    for users in sizes:
+        rows = users * args.samples
+        model = LBPHModel(histograms[:rows], labels[:rows], face_size=(FACE, FACE))
+        model.prepare()
+        truth = rng.integers(0, users, args.queries)
+        faces = [make_sample(rng, bases[user]) for user in truth]
+        queries = iter(range(10 ** 9))
+
+        single, single_p95 = timings_ms(lambda: model.predict(faces[next(queries) % len(faces)]), args.queries)
+        batch, _ = timings_ms(lambda: model.predict_batch(faces), max(1, args.repeat // 4))
+        predicted = np.array([matches[0][0] for matches in model.predict_batch(faces)])
+        key = f'predict.{rows}'
+        results[f'{key}.median_ms'], results[f'{key}.p95_ms'] = single, single_p95
+        results[f'{key}.batch_per_face_ms'] = batch / len(faces)
+        results[f'{key}.accuracy'] = float(np.mean(predicted == truth))
+        print(f"  predict {rows} samples: {single:.2f} ms (p95 {single_p95:.2f}), "
+              f"batched {batch / len(faces):.2f} ms per face")
+
+
+def bench_train(results, args):
+    users, samples = args.train_users, args.train_samples
+    work_dir = tempfile.mkdtemp(prefix='face-bench-')
+    try:
+        dataset_dir = os.path.join(work_dir, 'dataset')
+        trainer_dir = os.path.join(work_dir, 'trainer')
+        model_path = os.path.join(trainer_dir, 'trainer.lbph')
+        write_dataset(dataset_dir, users, samples)
+        os.makedirs(trainer_dir)
+        count = users * samples
+
+        def train():
+            return train_model(dataset_dir, model_path, processes=args.processes)
+
+        (mode, _), cold = timed(train)
+        # Same dataset without a model, so only the feature cache is warm
+        shutil.rmtree(trainer_dir)
+        os.makedirs(trainer_dir)
+        _, cached = timed(train)
+        write_dataset(dataset_dir, 1, samples, seed=1, first_user=users + 1)
+        (incremental_mode, _), incremental = timed(train)
+        (unchanged_mode, _), unchanged = timed(train)
+        assert (mode, incremental_mode, unchanged_mode) == ('full', 'incremental', 'unchanged')
+
+        key = f'train.{users}x{samples}'
+        results[f'{key}.full_cold_s'] = cold
+        results[f'{key}.full_cold_per_s'] = count / cold
+        results[f'{key}.full_cached_s'] = cached
+        results[f'{key}.incremental_s'] = incremental
+        results[f'{key}.unchanged_s'] = unchanged
+        print(f"  train {users}x{samples}: cold {cold:.2f} s ({count / cold:.0f} samples/s), cached {cached:.2f} s, "
+              f"+1 user {incremental:.2f} s, unchanged {unchanged:.2f} s")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def bench_load(results, args):
+    sizes = sorted(args.users)
+    histograms, labels, _ = synthetic_gallery(sizes[-1], args.samples)
+    work_dir = tempfile.mkdtemp(prefix='face-bench-')
+    try:
+        for users in sizes:
+            rows = users * args.samples
+            model_path = os.path.join(work_dir, f'{rows}.lbph')
+            LBPHModel(histograms[:rows], labels[:rows], face_size=(FACE, FACE)).save(model_path)
+            update_index(model_path, rebuild=True)
+            model_ms, _ = timings_ms(lambda: load_model(model_path), args.repeat)
+            indexed_ms, _ = timings_ms(lambda: load_recognizer(model_path, use_index=True), args.repeat)
+            key = f'load.{rows}'
+            results[f'{key}.model_ms'], results[f'{key}.with_index_ms'] = model_ms, indexed_ms
+            print(f"  load {rows} samples: {model_ms:.1f} ms, with index {indexed_ms:.1f} ms")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def bench_db(results, args):
+    from recognition.attendance_writer import AttendanceWriter
+    from recognition.database import DatabaseManager
+
+    db = DatabaseManager()
+    tag = uuid.uuid4().hex[:8]
+    class_id, student_ids = None, []
+    try:
+        class_id = db.add_class(f'benchmark-{tag}', None, 'benchmark')
+        _, added = timed(lambda: student_ids.extend(
+            db.add_user(f'Benchmark {i}', f'benchmark-{tag}-{i}@example.invalid', 'Học sinh', class_id)
+            for i in range(args.db_students)))
+
+        _, recorded = timed(lambda: [db.record_attendance(class_id, student_id, 'Có mặt', 90)
+                                     for student_id in student_ids])
+
+        # A past week per student, so every submitted record is written
+        writer = AttendanceWriter(db.connect, ATTENDANCE_BATCH_SIZE, ATTENDANCE_FLUSH_INTERVAL)
+        writer.start()
+        days = [datetime.datetime(2000, 1, 3) + datetime.timedelta(days=day) for day in range(7)]
+
+        def submit_all():
+            for when in days:
+                for student_id in student_ids:
+                    writer.submit(class_id, student_id, 'Có mặt', 90, when)
+            writer.close()
+
+        _, written = timed(submit_all)
+
+        rng = np.random.default_rng(0)
+        faces = [make_sample(rng, make_user(rng)) for _ in range(args.samples)]
+        _, saved = timed(lambda: [db.save_face_samples(student_id, [(face, None) for face in faces])
+                                  for student_id in student_ids[:20]])
+        roster_ms, _ = timings_ms(lambda: db.load_class_roster(class_id), args.repeat)
+
+        students = len(student_ids)
+        results['db.add_user_per_s'] = students / added
+        results['db.record_attendance_per_s'] = students / recorded
+        results['db.attendance_writer_per_s'] = students * len(days) / written
+        results['db.save_face_samples_per_s'] = min(students, 20) * len(faces) / saved
+        results['db.load_class_roster_ms'] = roster_ms
+        print(f"  db: record_attendance {students / recorded:.0f}/s, "
+              f"AttendanceWriter {students * len(days) / written:.0f}/s, "
+              f"face samples {min(students, 20) * len(faces) / saved:.0f}/s, roster {roster_ms:.1f} ms")
+    finally:
+        # Attendance, registrations and face samples go with them
+        if class_id is not None:
+            db.delete_class(class_id)
+        db.delete_users(student_ids)
+        db.close()
+
+
+def git_commit():
+    """(commit, whether tracked files have uncommitted changes), or (None, None) outside a git checkout"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                                capture_output=True, text=True, check=True).stdout
+        return commit, bool(status.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def compare(results, baseline, threshold):
+    """Print the relative change of every timing shared with ``baseline``"""
+    print(f" [INFO] Compared with {baseline.get('commit') or 'baseline'}:")
+    for key in sorted(set(results) & set(baseline['results'])):
+        before, after = baseline['results'][key], results[key]
+        if key.endswith('_per_s'):
+            change = before / after - 1 if after else np.inf
+        elif key.endswith(('_ms', '_s')):
+            change = after / before - 1 if before else np.inf
+        else:
+            continue
+        flag = '  slower' if change > threshold else '  faster' if change < -threshold else ''
+        print(f"  {key:<45} {before:>10.3f} -> {after:>10.3f} ({100 * change:+.1f}% time){flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Face recognition benchmark suite")
+    parser.add_argument('--only', default=','.join(name for name in BENCHMARKS if name != 'db'),
+                        help=f"comma-separated benchmarks of {', '.join(BENCHMARKS)}")
+    parser.add_argument('--db', action='store_true', help="also run the database benchmark")
+    parser.add_argument('--users', default='50,200,1000', help="gallery sizes in users (predict, load)")
+    parser.add_argument('--samples', type=int, default=10, help="samples per user (predict, load, db)")
+    parser.add_argument('--queries', type=int, default=50, help="faces recognized per gallery size")
+    parser.add_argument('--train-users', type=int, default=50)
+    parser.add_argument('--train-samples', type=int, default=ENROLL_SAMPLES, help="samples kept per enrolled user")
+    parser.add_argument('--processes', type=int, default=None, help="training decode processes")
+    parser.add_argument('--db-students', type=int, default=200)
+    parser.add_argument('--scale-factor', type=float, default=1.3, help="detectMultiScale scaleFactor")
+    parser.add_argument('--min-neighbors', type=int, default=5, help="detectMultiScale minNeighbors")
+    parser.add_argument('--repeat', type=int, default=20, help="timed calls per measurement")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--compare', help="JSON results of an earlier run to compare with")
+    parser.add_argument('--threshold', type=float, default=0.1, help="relative change reported as a difference")
+    args = parser.parse_args()
+    args.users = [int(users) for users in args.users.split(',')]
+
+    selected = [name for name in args.only.split(',') if name]
+    if args.db and 'db' not in selected:
+        selected.append('db')
+    unknown = set(selected) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    commit, dirty = git_commit()
+    report = {
+        'commit': commit,
+        'dirty': dirty,
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'platform': {'python': platform.python_version(), 'opencv': cv2.__version__, 'numpy': np.__version__,
+                     'machine': platform.machine(), 'cpus': os.cpu_count()},
+        'params': {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'threshold')},
+        'results': {},
+    }
+    benchmarks = {'detect': bench_detect, 'predict': bench_predict, 'train': bench_train,
+                  'load': bench_load, 'db': bench_db}
+    for name in BENCHMARKS:
+        if name in selected:
+            print(f" [INFO] {name}")
+            benchmarks[name](report['results'], args)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f" [INFO] Results written to {args.output}")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(report['results'], json.load(f), args.threshold)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Deterministic synthetic faces, datasets and frames for the benchmarks.
+
+Every user is a random smooth "face" texture; its samples are crops of it
+with small shifts, contrast changes and noise. The same seed always gives
+the same pixels, so results of different commits are measured on the same
+data.
+"""
+import os
+
+import cv2
+import numpy as np
+
+from recognition.lbph_model import LBPHModel
+
+FACE = 100
+
+
+def make_user(rng):
+    return cv2.GaussianBlur(rng.integers(0, 256, (FACE + 12, FACE + 12), dtype=np.uint8), (9, 9), 0)
+
+
+def make_sample(rng, base):
+    dx, dy = rng.integers(0, 12, 2)
+    face = base[dy:dy + FACE, dx:dx + FACE].astype(np.float32) * rng.uniform(0.8, 1.2)
+    return np.clip(face + rng.normal(0, 3, face.shape), 0, 255).astype(np.uint8)
+
+
+def synthetic_gallery(users, samples, seed=0, batch=500):
+    """(histograms, labels, user base images) of ``users`` x ``samples`` synthetic faces"""
+    rng = np.random.default_rng(seed)
+    model = LBPHModel(np.zeros((0, 0), np.float32), np.zeros(0, np.int32))
+    bases = [make_user(rng) for _ in range(users)]
+    labels = np.repeat(np.arange(users, dtype=np.int32), samples)
+    histograms = np.empty((len(labels), model.bins), np.float32)
+    for start in range(0, len(labels), batch):
+        faces = [make_sample(rng, bases[label]) for label in labels[start:start + batch]]
+        histograms[start:start + len(faces)] = model.histograms_of(faces)
+    return histograms, labels, bases
+
+
+def write_dataset(dataset_dir, users, samples, seed=0, first_user=1):
+    """Write ``users`` x ``samples`` face crops as ``<dataset_dir>/User_<id>/<n>.jpg``"""
+    from recognition.training import USER_DIR_PREFIX
+
+    rng = np.random.default_rng(seed)
+    for user_id in range(first_user, first_user + users):
+        base = make_user(rng)
+        user_dir = os.path.join(dataset_dir, f"{USER_DIR_PREFIX}{user_id}")
+        os.makedirs(user_dir, exist_ok=True)
+        for n in range(1, samples + 1):
+            cv2.imwrite(os.path.join(user_dir, f"{n}.jpg"), make_sample(rng, base))
+
+
+def make_frame(width, height, faces=3, seed=0):
+    """BGR camera-like frame: a textured background with ``faces`` face-sized patches"""
+    rng = np.random.default_rng(seed)
+    frame = cv2.GaussianBlur(rng.integers(0, 256, (height, width), dtype=np.uint8), (15, 15), 0)
+    size = max(24, min(width, height) // 4)
+    for _ in range(faces):
+        x, y = rng.integers(0, width - size), rng.integers(0, height - size)
+        frame[y:y + size, x:x + size] = cv2.resize(make_sample(rng, make_user(rng)), (size, size))
+    return cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
@@ -10,15 +10,96 @@ DB_CONFIG = {
     "port": "5432"
 }
 
+# Attendance write-behind: flush after this many records or seconds, whichever comes first
+ATTENDANCE_BATCH_SIZE = 100
+ATTENDANCE_FLUSH_INTERVAL = 0.5
+
 # Constants
-CONFIDENCE_THRESHOLD = 20
+# A match counts when its score (100 - LBPH distance) is above this, i.e. distance below 50;
+# shared by the app and the attendance daemon
+CONFIDENCE_THRESHOLD = 50
 REQUIRED_FACE_SAMPLES = 30
 
+# Frame source: camera index, video file, image directory or "synthetic[:N]"
+FRAME_SOURCE = os.environ.get('FACE_FRAME_SOURCE', '0')
+# Replay recorded sources as fast as possible instead of at their native frame rate
+REPLAY_FAST = os.environ.get('FACE_REPLAY_FAST', '0') == '1'
+
+# Several sources served by one process (recognition/multi_source.py): "spec|class_id|fps"
+# entries separated by ";", e.g. "0|1|10;1|2|10", and the workers shared by all of them
+# (0 = one per CPU core)
+FRAME_SOURCES = os.environ.get('FACE_SOURCES', '')
+RECOGNITION_WORKERS = int(os.environ.get('FACE_WORKERS', '0'))
+
+# Detect-then-track: run the Haar cascade every N frames (1 = every frame),
+# on a frame downscaled by DETECT_SCALE, and track faces in between
+DETECT_EVERY_N_FRAMES = int(os.environ.get('FACE_DETECT_EVERY', '5'))
+DETECT_SCALE = float(os.environ.get('FACE_DETECT_SCALE', '1.0'))
+
+# Identity voting: a tracked face is recognized once a label wins VOTE_MIN_VOTES
+# of the last VOTE_WINDOW predictions and at least VOTE_MIN_RATIO of them
+VOTE_WINDOW = 15
+VOTE_MIN_VOTES = 8
+VOTE_MIN_RATIO = 0.6
+
+# Approximate nearest-neighbour gallery index (recognition/ann_index.py), built next to
+# the model at training time; recommended from a few thousand enrolled samples on
+ANN_INDEX = os.environ.get('FACE_ANN_INDEX', '0') == '1'
+# Class galleries (recognition/galleries.py) with fewer samples are searched exactly
+ANN_CLASS_MIN_SAMPLES = int(os.environ.get('FACE_ANN_CLASS_MIN_SAMPLES', '5000'))
+# Inverted lists probed per face and samples compared exactly per face
+ANN_NPROBE = int(os.environ.get('FACE_ANN_NPROBE', '16'))
+ANN_RERANK = int(os.environ.get('FACE_ANN_RERANK', '256'))
+
+# Seconds between checks of a running recognition for a newly published model
+MODEL_POLL_INTERVAL = 1.0
+
+# Headless attendance service (AttendanceDaemon.py): seconds between class roster reloads
+# (students added to a class while it runs) and the log level it writes to stderr
+ROSTER_REFRESH_INTERVAL = int(os.environ.get('FACE_ROSTER_REFRESH', '300'))
+DAEMON_LOG_LEVEL = os.environ.get('FACE_LOG_LEVEL', 'INFO')
+
+# Local batch recognition API (recognition/batch_api.py): listens on API_HOST:API_PORT, or
+# on the Unix socket API_SOCKET when set, and accepts at most API_MAX_BATCH images per request
+API_HOST = os.environ.get('FACE_API_HOST', '127.0.0.1')
+API_PORT = int(os.environ.get('FACE_API_PORT', '8765'))
+API_SOCKET = os.environ.get('FACE_API_SOCKET', '')
+API_MAX_BATCH = int(os.environ.get('FACE_API_MAX_BATCH', '64'))
+
+# Pipeline metrics (recognition/metrics.py), summarized over the last METRICS_WINDOW seconds.
+# Served in the Prometheus text format on 127.0.0.1:METRICS_PORT (0 = off) and logged as a
+# JSON line every METRICS_LOG_INTERVAL seconds (0 = off), to METRICS_LOG_FILE when set;
+# METRICS_OVERLAY shows them on the camera preview from the start
+METRICS_WINDOW = 10.0
+METRICS_PORT = int(os.environ.get('FACE_METRICS_PORT', '0'))
+METRICS_LOG_INTERVAL = float(os.environ.get('FACE_METRICS_LOG_INTERVAL', '0'))
+METRICS_LOG_FILE = os.environ.get('FACE_METRICS_LOG_FILE', '')
+METRICS_OVERLAY = os.environ.get('FACE_METRICS_OVERLAY', '0') == '1'
+
+# Enrollment sample selection (recognition/sample_selection.py): of the faces captured
+# while enrolling a user at most ENROLL_SAMPLES sharp, well exposed faces are kept whose
+# difference hashes differ in at least ENROLL_MIN_HASH_DISTANCE of 64 bits
+ENROLL_SAMPLES = int(os.environ.get('FACE_ENROLL_SAMPLES', '20'))
+ENROLL_MIN_HASH_DISTANCE = int(os.environ.get('FACE_ENROLL_MIN_HASH_DISTANCE', '6'))
+# Faces blurrier than this (Laplacian variance) or than this share of the user's median are dropped
+ENROLL_MIN_SHARPNESS = 10.0
+ENROLL_SHARPNESS_RATIO = 0.5
+ENROLL_BRIGHTNESS = (40, 220)
+
+# Face dataset storage: "directory" (one JPEG per sample under DATASET_DIR) or
+# "packed" (memory-mapped shards of FACE_SIZE crops under PACKED_DATASET_DIR)
+DATASET_FORMAT = os.environ.get('FACE_DATASET_FORMAT', 'directory')
+FACE_SIZE = (100, 100)
+PACKED_SHARD_SIZE = 10000
+
 # Directories
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATASET_DIR = os.path.join(BASE_DIR, 'dataset')
+PACKED_DATASET_DIR = os.path.join(BASE_DIR, 'dataset_packed')
 TRAINER_DIR = os.path.join(BASE_DIR, 'trainer')
-TRAINER_FILE = 'trainer.yml'
+TRAINER_FILE = 'trainer.lbph'
+# Model written by older versions, converted to TRAINER_FILE on first start
+LEGACY_TRAINER_FILE = 'trainer.yml'
 CASCADE_FILE = 'haarcascade_frontalface_default.xml'
 
 # User roles
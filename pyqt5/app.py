@@ -1,272 +1,245 @@
 import sys
+import datetime
 import cv2
 import numpy as np
 import os
-import datetime
-import psycopg2
+import time
 from PyQt5.QtWidgets import *       
 from PyQt5.QtGui import *
 from PyQt5.QtCore import *
-from PIL import Image
 import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.setting import (ANN_INDEX, ANN_NPROBE, ANN_RERANK, ATTENDANCE_BATCH_SIZE, ATTENDANCE_FLUSH_INTERVAL,
+                            CONFIDENCE_THRESHOLD, DATASET_FORMAT, DETECT_EVERY_N_FRAMES, DETECT_SCALE, FRAME_SOURCE,
+                            METRICS_LOG_FILE, METRICS_LOG_INTERVAL, METRICS_OVERLAY, METRICS_PORT, METRICS_WINDOW,
+                            MODEL_POLL_INTERVAL, REPLAY_FAST, VOTE_MIN_RATIO, VOTE_MIN_VOTES, VOTE_WINDOW)
+from recognition.ann_index import load_recognizer
+from recognition.attendance_writer import AttendanceWriter
+from recognition.database import DatabaseManager
+from recognition.enrollment import EnrollmentSession, save_samples
+from recognition.galleries import ClassGalleries
+from recognition.lbph_model import LBPHModel
+from recognition.metrics import MetricsLogger, MetricsServer, PipelineMetrics, draw_overlay
+from recognition.model_store import ModelStore
+from recognition.pipeline import RecognitionPipeline
+from recognition.sample_selection import select_samples
+from recognition.sources import open_source
+from recognition.tracking import TrackingDetector
+from recognition.training import STAGE_HISTOGRAMS, STAGE_INDEX, STAGE_LOAD, STAGE_WRITE
+from recognition.training_job import TrainingJob
+from recognition.voting import IdentityVoter
+
 _logger = logging.getLogger(__name__)
 
 # Constants
-CONFIDENCE_THRESHOLD = 50
 REQUIRED_FACE_SAMPLES = 100 #30
 DATASET_DIR = 'dataset'
+PACKED_DATASET_DIR = 'dataset_packed'
+# Dataset the model is trained from, see DATASET_FORMAT in config/setting.py
+TRAINING_DATASET_DIR = PACKED_DATASET_DIR if DATASET_FORMAT == 'packed' else DATASET_DIR
 TRAINER_DIR = 'trainer'
-TRAINER_FILE = 'trainer.yml'
+TRAINER_FILE = 'trainer.lbph'
+LEGACY_TRAINER_FILE = 'trainer.yml'
 
-class DatabaseManager:
-    def __init__(self):
-        try:
-            self.conn = psycopg2.connect(
-                database="face_recognization",
-                user="odoo",
-                password="odoo",
-                host="localhost",
-                port="5432"
-            )
-            self.cur = self.conn.cursor()
-            _logger.info("Database connected successfully")
-        except Exception as e:
-            _logger.error(f"Failed to connect to database {str(e)}")
-            raise e
-        
-    def close(self):
-        """Safely close database connection and cursor"""
-        try:
-            if self.cur:
-                self.cur.close()
-            if self.conn:
-                self.conn.close()
-            _logger.info("Database connection closed successfully")
-        except Exception as e:
-            _logger.error(f"Error closing database connection: {str(e)}")
-
-    def add_user(self, full_name, email, role, class_id = None):
-        try:
-            _logger.info(f"Attempting to add user: {full_name}, {email}, {role}")
-            if role not in ['Học sinh', 'Giáo viên', 'Quản trị viên']:
-                raise ValueError("Invalid role. Must be 'student', 'Giáo viên', or 'Quản trị viên'")
-            
-            self.cur.execute(
-                "INSERT INTO users (full_name, email, role) VALUES (%s, %s, %s) RETURNING user_id",
-                (full_name, email, role)
-            )
-            user_id = self.cur.fetchone()[0]
-
-            # If user is a student and class_id is provided, register them to the class
-            if role == 'Học sinh' and class_id is not None:
-                self.register_student_to_class(class_id, user_id)
-
-            self.conn.commit()
-            _logger.info(f"User added successfully with ID: {user_id}")
-            return user_id
-        except psycopg2.errors.UniqueViolation:
-            self.conn.rollback()
-            _logger.error(f"Email {email} already exists")
-            raise ValueError(f"Email {email} already exists")
-        except Exception as e:
-            self.conn.rollback()
-            _logger.error(f"Failed to add user: {str(e)}")
-            raise e
-        
-    def is_student_registered(self, class_id, student_id):
-        """Check if a student is registered for a specific class"""
-        try:
-            self.cur.execute("""
-                SELECT 1 FROM class_students 
-                WHERE class_id = %s AND student_id = %s
-            """, (class_id, student_id))
-            return bool(self.cur.fetchone())
-        except Exception as e:
-            _logger.error(f"Failed to check student registration: {str(e)}")
-            raise e
-
-    def save_face_data(self, user_id, face_encoding, image_path):
-        try:
-            _logger.info(f"Saving face data: {user_id}, {image_path}")
-            self.cur.execute(
-                "INSERT INTO face_data (user_id, face_encoding, image_path) VALUES (%s, %s, %s)",
-                (user_id, face_encoding, image_path)
-            )
-            self.conn.commit()
-        except Exception as e:
-            self.conn.rollback()
-            _logger.error(f"Failed to save face data: {str(e)}")
-            raise e
-
-    def record_attendance(self, class_id, student_id, status, confidence_score):
-            try:
-                _logger.info(f"Recording attendance: class_id: {class_id}, student_id: {student_id}, status: {status}, + {confidence_score}")
-                # Đảm bảo confidence_score nằm trong khoảng hợp lệ
-                confidence_score = max(0, min(100, confidence_score))  # Giới hạn giá trị từ 0 đến 100
-
-                current_date = datetime.date.today()
-                current_time = datetime.datetime.now().time()
-                
-                # Check if student already has attendance for today in this class
-                self.cur.execute("""
-                    SELECT attendance_id FROM attendance 
-                    WHERE class_id = %s AND student_id = %s AND attendance_date = %s
-                """, (class_id, student_id, current_date))
-                
-                if self.cur.fetchone() is None:
-                    # Only insert if no attendance record exists for today
-                    self.cur.execute(
-                        """INSERT INTO attendance 
-                           (class_id, student_id, attendance_date, check_in_time, status, confidence_score) 
-                           VALUES (%s, %s, %s, %s, %s, %s)""",
-                        (class_id, student_id, current_date, current_time, status, confidence_score)
-                    )
-                    self.conn.commit()
-            except Exception as e:
-                self.conn.rollback()
-                _logger.error(f"Failed to record attendence: {str(e)}")
-                raise e
-
-    def add_class(self, class_name, teacher_id, semester):
-        try:
-            _logger.info(f"Adding class: {class_name}, {teacher_id}")
-            self.cur.execute(
-                "INSERT INTO classes (class_name, teacher_id, semester) VALUES (%s, %s, %s) RETURNING class_id",
-                (class_name, teacher_id, semester)
-            )
-            class_id = self.cur.fetchone()[0]
-            self.conn.commit()
-            return class_id
-        except Exception as e:
-            self.conn.rollback()
-            _logger.error(f"Failed to add class: {str(e)}")
-            raise e  
-        
-    def get_classes(self):
-        try:
-            _logger.info("Fetching classes")
-            self.cur.execute("SELECT class_id, class_name FROM classes")
-            return self.cur.fetchall()
-        except Exception as e:
-            _logger.error(f"Failed to fetch classes: {str(e)}")
-            raise e
-        
-    def get_teachers(self):
-        try:
-            self.cur.execute("SELECT user_id, full_name FROM users WHERE role = 'Giáo viên'")
-            return self.cur.fetchall()
-        except Exception as e:
-            raise e
-        
-    def register_student_to_class(self, class_id, student_id):
-        try:
-            self.cur.execute(
-                "INSERT INTO class_students (class_id, student_id) VALUES (%s, %s)",
-                (class_id, student_id)
-            )
-            self.conn.commit()
-        except psycopg2.errors.UniqueViolation:
-            self.conn.rollback()
-            raise ValueError("Học sinh đã được đăng ký trong lớp này!")
-        except Exception as e:
-            self.conn.rollback()
-            raise e
-        
-    def get_attendance_by_date(self, class_id, date):
-        try:
-            _logger.info(f"Fetching attendance for class: {class_id}, date: {date}")
-            self.cur.execute("""
-                SELECT u.full_name, a.check_in_time, a.status, a.confidence_score
-                FROM attendance a
-                JOIN users u ON a.student_id = u.user_id
-                WHERE a.class_id = %s AND a.attendance_date = %s
-                ORDER BY a.check_in_time
-            """, (class_id, date))
-            return self.cur.fetchall()
-        except Exception as e:
-            _logger.error(f"Không thể lấy dữ liệu điểm danh: {str(e)}")
-            raise e
-
-    def get_students_by_class(self, class_id):
-        try:
-            self.cur.execute("""
-                SELECT u.user_id, u.full_name, u.email,
-                    COALESCE(
-                        (SELECT status 
-                        FROM attendance 
-                        WHERE student_id = u.user_id 
-                        AND class_id = %s 
-                        AND attendance_date = CURRENT_DATE
-                        ORDER BY check_in_time DESC 
-                        LIMIT 1),
-                        'Vắng'
-                    ) as attendance_status
-                FROM users u
-                JOIN class_students cs ON u.user_id = cs.student_id
-                WHERE cs.class_id = %s
-                ORDER BY u.full_name
-            """, (class_id, class_id))
-            return self.cur.fetchall()
-        except Exception as e:
-            _logger.error(f"Failed to fetch students: {str(e)}")
-            raise e
-        
 class FaceRecognitionThread(QThread):
-    change_pixmap_signal = pyqtSignal(np.ndarray)
+    # Frame, when it was captured and when it was emitted (time.monotonic())
+    change_pixmap_signal = pyqtSignal(np.ndarray, float, float)
     recognition_signal = pyqtSignal(str, float)
     error_signal = pyqtSignal(str)
 
-    def __init__(self):
+    def __init__(self, metrics=None):
         super().__init__()
         self.running = True
-        self.recognizer = cv2.face.LBPHFaceRecognizer_create()
+        self.metrics = metrics
+        self.dropped_frames = {}
+        self.voter = IdentityVoter(VOTE_WINDOW, VOTE_MIN_VOTES, VOTE_MIN_RATIO, 100 - CONFIDENCE_THRESHOLD)
+        self.voter_date = datetime.date.today()
         self.face_cascade = cv2.CascadeClassifier('haarcascade_frontalface_default.xml')
-        if os.path.exists('trainer/trainer.yml'):
-            self.recognizer.read('trainer/trainer.yml')
+        # Published model (see recognition/model_store.py) and its class galleries
+        self.store = ModelStore(os.path.join(TRAINER_DIR, TRAINER_FILE))
+        self.model = None
+        self.model_version = None
+        self.galleries = None
+        # Class in session; recognition only searches its students
+        self.roster = None
+        # Set when the roster changed and the pipeline needs the matching gallery
+        self.refresh = False
+        # Enrollment session the pipeline collects samples for, see recognition/enrollment.py
+        self.enrollment = None
+        self.pipeline = None
+        legacy_path = os.path.join(TRAINER_DIR, LEGACY_TRAINER_FILE)
+        if self.store.version() is None and os.path.exists(legacy_path):
+            # Chuyển mô hình trainer.yml cũ sang định dạng nhị phân (chỉ một lần)
+            _logger.info(f"Converting {legacy_path} to {self.store.unversioned_path}")
+            LBPHModel.import_yaml(legacy_path).save(self.store.unversioned_path)
+        self.load_model()
+
+    def load_model(self):
+        """Load the published model if it is newer than the one in use; return True if it was"""
+        version, path = self.store.current()
+        if path is None or version == self.model_version:
+            return False
+        # Memory-mapped, so loading takes milliseconds whatever the model size;
+        # searched through the gallery index when it is enabled and up to date
+        self.model = load_recognizer(path, ANN_INDEX, ANN_NPROBE, ANN_RERANK)
+        self.model_version = version
+        self.galleries = ClassGalleries(self.model)
+        _logger.info(f"Loaded model version {version} ({len(self.model)} samples)")
+        return True
+
+    def gallery(self):
+        """What to search: the students of the class in session, or every enrolled user"""
+        if self.roster is None or self.model is None:
+            return self.model
+        # Chỉ tìm trong các học sinh của lớp thay vì toàn bộ trường
+        return self.galleries.get(self.roster.class_id, self.roster.names)
+
+    def set_roster(self, roster):
+        """Recognize the students of another class (or everyone with None) from the next frame"""
+        self.roster = roster
+        self.refresh = True
+
+    def enroll(self, session):
+        """Hand the faces of the following frames to an enrollment session instead of recognizing them"""
+        self.enrollment = session
+        if self.pipeline is not None:
+            self.pipeline.set_enrollment(session)
 
     def run(self):
-        cap = cv2.VideoCapture(0)
+        self.load_model()
+        if self.model is None and self.enrollment is None:
+            self.error_signal.emit("Chưa có mô hình nhận diện, hãy đăng ký khuôn mặt trước!")
+            return
+        cap = open_source(FRAME_SOURCE, realtime=not REPLAY_FAST)
         if not cap.isOpened():
             self.error_signal.emit("Lỗi khi mở camera!0")
             return
-        
-        while self.running:
-            ret, frame = cap.read()
-            if not ret:
-                self.error_signal.emit("Không thể truy cập camera")
-                break
 
-            try:
-                frame = cv2.flip(frame, 1)
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                faces = self.face_cascade.detectMultiScale(gray, 1.3, 5)
-                
-                for (x, y, w, h) in faces:
-                    cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
-                    id_, confidence = self.recognizer.predict(gray[y:y+h, x:x+w])
-                    
-                    if confidence < 100:
-                        self.recognition_signal.emit(str(id_), confidence)
-                    
-                self.change_pixmap_signal.emit(frame)
-            except Exception  as e:
-                self.error_signal.emit(f"Lỗi xử lý khung hình: {str(e)}")
-                break
-            
-        cap.release()
+        self.voter.reset()
+        self.voter_date = datetime.date.today()
+        recognizer = self.gallery()
+        pipeline = RecognitionPipeline(
+            cap,
+            TrackingDetector(self.face_cascade, DETECT_EVERY_N_FRAMES, DETECT_SCALE, 1.3, 5),
+            recognizer,
+            on_frame=self.present_frame,
+            on_error=self.error_signal.emit,
+            # Models trained on a packed dataset expect crops at its normalized size
+            face_size=recognizer.face_size if recognizer is not None else None,
+            metrics=self.metrics,
+        )
+        pipeline.set_enrollment(self.enrollment)
+        self.pipeline = pipeline
+        pipeline.start()
+        last_check = time.monotonic()
+        try:
+            while self.running and pipeline.is_running():
+                self.msleep(50)
+                if time.monotonic() - last_check >= MODEL_POLL_INTERVAL:
+                    last_check = time.monotonic()
+                    # Newly trained models are swapped in between frames, without a restart
+                    self.refresh = self.load_model() or self.refresh
+                if self.refresh:
+                    self.refresh = False
+                    recognizer = self.gallery()
+                    if recognizer is not None:
+                        recognizer.prepare()
+                        pipeline.set_recognizer(recognizer, recognizer.face_size)
+        finally:
+            self.pipeline = None
+            pipeline.stop()
+            cap.release()
+            self.dropped_frames = pipeline.dropped_frames()
+            _logger.info(f"Recognition pipeline stopped, dropped frames per stage: {self.dropped_frames}")
+
+    def present_frame(self, packet):
+        """Called from the pipeline's presentation worker for every processed frame.
+
+        Emits recognition_signal only once per person per session, when the
+        votes of a tracked face settle on an identity. A session running past
+        midnight starts voting again, so students still in view are recorded
+        for the new day.
+        """
+        today = datetime.date.today()
+        if self.voter_date != today:
+            self.voter.reset()
+            self.voter_date = today
+        for track_id, _, id_, confidence in packet.results:
+            decision = self.voter.add(track_id, id_, confidence)
+            if decision:
+                self.recognition_signal.emit(str(decision[0]), decision[1])
+        self.voter.retain(packet.track_ids)
+        self.change_pixmap_signal.emit(packet.frame, packet.captured_at, time.monotonic())
 
 class MainWindow(QMainWindow):
+    attendance_written_signal = pyqtSignal(list)
+    attendance_failed_signal = pyqtSignal(list)
+    db_result_signal = pyqtSignal(object, object, object)
+    training_progress_signal = pyqtSignal(str, int, int)
+    training_done_signal = pyqtSignal(str, int)
+    training_failed_signal = pyqtSignal(str)
+    training_cancelled_signal = pyqtSignal()
+    enrollment_progress_signal = pyqtSignal(int, int)
+    enrollment_done_signal = pyqtSignal(object)
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Hệ thống điểm danh nhận diện khuôn mặt")
         self.current_class_id = None
+        self.roster = None
+        self.enrollment = None
 
         # Ensure required directories exist
         for directory in [DATASET_DIR, TRAINER_DIR]:
             if not os.path.exists(directory):
                 os.makedirs(directory)
 
+        # Stage timings of the pipeline, the GUI and the attendance writer
+        self.metrics = PipelineMetrics(METRICS_WINDOW)
+        self.metrics_snapshot = None
+        self.metrics_server = None
+        if METRICS_PORT:
+            try:
+                self.metrics_server = MetricsServer(self.metrics, port=METRICS_PORT)
+                self.metrics_server.start()
+            except OSError as e:
+                _logger.error(f"Failed to serve metrics on port {METRICS_PORT}: {str(e)}")
+        self.metrics_logger = None
+        if METRICS_LOG_INTERVAL:
+            self.metrics_logger = MetricsLogger(self.metrics, METRICS_LOG_INTERVAL, METRICS_LOG_FILE or None)
+            self.metrics_logger.start()
+
         self.db = DatabaseManager()
+        self.db_result_signal.connect(self.deliver_db_result)
+        self.attendance_writer = AttendanceWriter(
+            self.db.connect,
+            batch_size=ATTENDANCE_BATCH_SIZE,
+            flush_interval=ATTENDANCE_FLUSH_INTERVAL,
+            on_written=self.attendance_written_signal.emit,
+            on_failed=self.attendance_failed_signal.emit,
+            metrics=self.metrics,
+        )
+        self.attendance_written_signal.connect(self.on_attendance_written)
+        self.attendance_failed_signal.connect(self.on_attendance_failed)
+        self.attendance_writer.start()
+
+        # Training runs in a separate process so enrollment never freezes the window
+        self.training_progress_signal.connect(self.show_training_progress)
+        self.training_done_signal.connect(self.training_done)
+        self.training_failed_signal.connect(self.training_failed)
+        self.training_cancelled_signal.connect(self.training_cancelled)
+        self.enrollment_progress_signal.connect(self.show_enrollment_progress)
+        self.enrollment_done_signal.connect(self.finish_enrollment)
+        self.training = TrainingJob(
+            TRAINING_DATASET_DIR,
+            os.path.join(TRAINER_DIR, TRAINER_FILE),
+            on_progress=self.training_progress_signal.emit,
+            on_done=self.training_done_signal.emit,
+            on_error=self.training_failed_signal.emit,
+            on_cancelled=self.training_cancelled_signal.emit,
+            build_index=ANN_INDEX,
+        )
         self.setup_ui()
 
     def apply_styles(self):
@@ -399,6 +372,11 @@ class MainWindow(QMainWindow):
         stop_button = QPushButton("Dừng Điểm Danh")
         stop_button.clicked.connect(self.stop_recognition)
         button_layout.addWidget(stop_button)
+
+        # Timings of every stage drawn over the camera feed
+        self.metrics_checkbox = QCheckBox("Hiển thị số liệu hiệu năng")
+        self.metrics_checkbox.setChecked(METRICS_OVERLAY)
+        button_layout.addWidget(self.metrics_checkbox)
         
         camera_layout.addLayout(button_layout)
         tabs.addTab(camera_tab, "Điểm danh bằng gương mặt")
@@ -426,6 +404,29 @@ class MainWindow(QMainWindow):
         register_button.clicked.connect(self.register_user)
         reg_layout.addWidget(register_button)
 
+        # Live preview while face samples are captured
+        self.enroll_preview = QLabel()
+        self.enroll_preview.setAlignment(Qt.AlignCenter)
+        reg_layout.addRow(self.enroll_preview)
+        capture_layout = QHBoxLayout()
+        self.enroll_status_label = QLabel("")
+        capture_layout.addWidget(self.enroll_status_label)
+        self.stop_capture_button = QPushButton("Dừng chụp ảnh")
+        self.stop_capture_button.clicked.connect(self.stop_capture)
+        self.stop_capture_button.setEnabled(False)
+        capture_layout.addWidget(self.stop_capture_button)
+        reg_layout.addRow(capture_layout)
+
+        # Training status, updated while the model is retrained in the background
+        training_layout = QHBoxLayout()
+        self.training_label = QLabel("")
+        training_layout.addWidget(self.training_label)
+        self.cancel_training_button = QPushButton("Hủy huấn luyện")
+        self.cancel_training_button.clicked.connect(self.cancel_training)
+        self.cancel_training_button.setEnabled(False)
+        training_layout.addWidget(self.cancel_training_button)
+        reg_layout.addRow(training_layout)
+
         # Initially hide class selection (shown only for students)
         self.toggle_class_selection(self.role_combo.currentText())
 
@@ -577,9 +578,10 @@ class MainWindow(QMainWindow):
             QMessageBox.warning(self, "Error", f"Failed to fetch teachers: {str(e)}")
         
         # Set up face recognition thread
-        self.thread = FaceRecognitionThread()
+        self.thread = FaceRecognitionThread(self.metrics)
         self.thread.change_pixmap_signal.connect(self.update_image)
         self.thread.recognition_signal.connect(self.handle_recognition)
+        self.thread.error_signal.connect(self.recognition_error)
 
         # Attendance table
         self.attendance_table = QTableWidget()
@@ -653,6 +655,21 @@ class MainWindow(QMainWindow):
         if role != 'Học sinh':
             self.class_combo.setCurrentIndex(0)
 
+    def run_db(self, method, *args, on_done=None, on_error=None):
+        """Run a DatabaseManager query on a worker thread and deliver the outcome on the GUI thread"""
+        future = self.db.submit(method, *args)
+        future.add_done_callback(lambda f: self.db_result_signal.emit(f, on_done, on_error))
+
+    @pyqtSlot(object, object, object)
+    def deliver_db_result(self, future, on_done, on_error):
+        error = future.exception()
+        if error is not None:
+            _logger.error(f"Database task failed: {str(error)}")
+            if on_error:
+                on_error(error)
+        elif on_done:
+            on_done(future.result())
+
     # Fix the view_attendance method:
     def view_attendance(self):
         class_id = self.class_select.currentData()
@@ -662,24 +679,23 @@ class MainWindow(QMainWindow):
             QMessageBox.warning(self, "Warning", "Please select a class to view attendance")
             return
         
-        try:
-            attendance_data = self.db.get_attendance_by_date(class_id, selected_date)
-
-            # Clear and set up the table
-            self.attendance_table.setRowCount(0)  # Clear existing rows
-            self.attendance_table.setRowCount(len(attendance_data))
+        self.run_db(self.db.get_attendance_by_date, class_id, selected_date,
+                    on_done=self.show_attendance,
+                    on_error=lambda e: QMessageBox.warning(self, "Error", f"Failed to load attendance data: {str(e)}"))
+
+    def show_attendance(self, attendance_data):
+        # Clear and set up the table
+        self.attendance_table.setRowCount(0)  # Clear existing rows
+        self.attendance_table.setRowCount(len(attendance_data))
+        
+        for row, (name, time, status, confidence) in enumerate(attendance_data):
+            self.attendance_table.setItem(row, 0, QTableWidgetItem(str(name)))
+            self.attendance_table.setItem(row, 1, QTableWidgetItem(time.strftime("%H:%M:%S")))
+            self.attendance_table.setItem(row, 2, QTableWidgetItem(status))
+            self.attendance_table.setItem(row, 3, QTableWidgetItem(f"{confidence:.2f}%"))
             
-            for row, (name, time, status, confidence) in enumerate(attendance_data):
-                self.attendance_table.setItem(row, 0, QTableWidgetItem(str(name)))
-                self.attendance_table.setItem(row, 1, QTableWidgetItem(time.strftime("%H:%M:%S")))
-                self.attendance_table.setItem(row, 2, QTableWidgetItem(status))
-                self.attendance_table.setItem(row, 3, QTableWidgetItem(f"{confidence:.2f}%"))
-                
-            # Resize columns to content
-            self.attendance_table.resizeColumnsToContents()
-
-        except Exception as e:
-            QMessageBox.warning(self, "Error", f"Failed to load attendance data: {str(e)}")
+        # Resize columns to content
+        self.attendance_table.resizeColumnsToContents()
 
     # Modify the view_students method to handle alignment:
     def view_students(self):
@@ -688,46 +704,45 @@ class MainWindow(QMainWindow):
             QMessageBox.warning(self, "Warning", "Vui lòng chọn một lớp để xem danh sách học sinh")
             return
         
-        try:
-            students = self.db.get_students_by_class(class_id)
+        self.run_db(self.db.get_students_by_class, class_id,
+                    on_done=self.show_students,
+                    on_error=lambda e: QMessageBox.warning(self, "Error", f"Failed to load student data: {str(e)}"))
+
+    def show_students(self, students):
+        self.student_table.setRowCount(0)
+        self.student_table.setRowCount(len(students))
+        
+        for row, (user_id, name, email, status) in enumerate(students):
+            # Create items with alignment
+            id_item = QTableWidgetItem(str(user_id))
+            id_item.setTextAlignment(Qt.AlignCenter)
             
-            self.student_table.setRowCount(0)
-            self.student_table.setRowCount(len(students))
+            name_item = QTableWidgetItem(name)
+            name_item.setTextAlignment(Qt.AlignLeft | Qt.AlignVCenter)
             
-            for row, (user_id, name, email, status) in enumerate(students):
-                # Create items with alignment
-                id_item = QTableWidgetItem(str(user_id))
-                id_item.setTextAlignment(Qt.AlignCenter)
-                
-                name_item = QTableWidgetItem(name)
-                name_item.setTextAlignment(Qt.AlignLeft | Qt.AlignVCenter)
-                
-                email_item = QTableWidgetItem(email)
-                email_item.setTextAlignment(Qt.AlignLeft | Qt.AlignVCenter)
-                
-                status_item = QTableWidgetItem(status)
-                status_item.setTextAlignment(Qt.AlignCenter)
-                
-                # Set items in table
-                self.student_table.setItem(row, 0, id_item)
-                self.student_table.setItem(row, 1, name_item)
-                self.student_table.setItem(row, 2, email_item)
-                self.student_table.setItem(row, 3, status_item)
-                
-                # Set row height
-                self.student_table.setRowHeight(row, 30)
+            email_item = QTableWidgetItem(email)
+            email_item.setTextAlignment(Qt.AlignLeft | Qt.AlignVCenter)
             
-            # Make table rows fill the available height
-            header_height = self.student_table.horizontalHeader().height()
-            available_height = self.student_table.height() - header_height
-            if len(students) > 0:
-                # row_height = max(30, available_height / len(students))
-                row_height = int(max(30, available_height / len(students)))
-                for row in range(len(students)):
-                    self.student_table.setRowHeight(row, row_height)
-                    
-        except Exception as e:
-            QMessageBox.warning(self, "Error", f"Failed to load student data: {str(e)}")
+            status_item = QTableWidgetItem(status)
+            status_item.setTextAlignment(Qt.AlignCenter)
+            
+            # Set items in table
+            self.student_table.setItem(row, 0, id_item)
+            self.student_table.setItem(row, 1, name_item)
+            self.student_table.setItem(row, 2, email_item)
+            self.student_table.setItem(row, 3, status_item)
+            
+            # Set row height
+            self.student_table.setRowHeight(row, 30)
+        
+        # Make table rows fill the available height
+        header_height = self.student_table.horizontalHeader().height()
+        available_height = self.student_table.height() - header_height
+        if len(students) > 0:
+            # row_height = max(30, available_height / len(students))
+            row_height = int(max(30, available_height / len(students)))
+            for row in range(len(students)):
+                self.student_table.setRowHeight(row, row_height)
 
     def load_students_for_manual_attendance(self):
         """Load students for manual attendance marking with consistent status options"""
@@ -736,74 +751,45 @@ class MainWindow(QMainWindow):
             QMessageBox.warning(self, "Cảnh báo", "Vui lòng chọn một lớp")
             return
             
-        try:
-            # Fetch students
-            selected_date = self.date_select.date().toPyDate()
-            self.db.cur.execute("""
-                SELECT u.user_id, u.full_name, u.email,
-                    COALESCE(
-                        (SELECT status 
-                        FROM attendance 
-                        WHERE student_id = u.user_id 
-                        AND class_id = %s 
-                        AND attendance_date = %s
-                        ORDER BY check_in_time DESC 
-                        LIMIT 1),
-                        'Vắng'
-                    ) as attendance_status,
-                    COALESCE(
-                        (SELECT note 
-                        FROM attendance 
-                        WHERE student_id = u.user_id 
-                        AND class_id = %s 
-                        AND attendance_date = %s
-                        ORDER BY check_in_time DESC 
-                        LIMIT 1),
-                        ''
-                    ) as note
-                FROM users u
-                JOIN class_students cs ON u.user_id = cs.student_id
-                WHERE cs.class_id = %s
-                ORDER BY u.full_name
-            """, (class_id, selected_date, class_id, selected_date, class_id))
+        # Fetch students
+        selected_date = self.date_select.date().toPyDate()
+        self.run_db(self.db.get_manual_attendance, class_id, selected_date,
+                    on_done=self.show_manual_attendance,
+                    on_error=lambda e: QMessageBox.warning(self, "Lỗi", f"Không thể tải danh sách học sinh: {str(e)}"))
+
+    def show_manual_attendance(self, students):
+        # Clear and set up table
+        self.manual_attendance_table.setRowCount(len(students))
+        
+        # Define consistent status options
+        status_options = ['Có mặt', 'Vắng', 'Đi muộn', 'Có phép']
+        
+        for row, (user_id, name, email, status, note) in enumerate(students):
+            # User ID
+            id_item = QTableWidgetItem(str(user_id))
+            id_item.setFlags(id_item.flags() & ~Qt.ItemIsEditable)
+            self.manual_attendance_table.setItem(row, 0, id_item)
             
-            students = self.db.cur.fetchall()
+            # Name
+            name_item = QTableWidgetItem(name)
+            name_item.setFlags(name_item.flags() & ~Qt.ItemIsEditable)
+            self.manual_attendance_table.setItem(row, 1, name_item)
             
-            # Clear and set up table
-            self.manual_attendance_table.setRowCount(len(students))
+            # Email
+            email_item = QTableWidgetItem(email)
+            email_item.setFlags(email_item.flags() & ~Qt.ItemIsEditable)
+            self.manual_attendance_table.setItem(row, 2, email_item)
             
-            # Define consistent status options
-            status_options = ['Có mặt', 'Vắng', 'Đi muộn', 'Có phép']
+            # Status ComboBox
+            status_combo = QComboBox()
+            status_combo.addItems(status_options)
+            current_status = status if status in status_options else 'Vắng'
+            status_combo.setCurrentText(current_status)
+            self.manual_attendance_table.setCellWidget(row, 3, status_combo)
             
-            for row, (user_id, name, email, status, note) in enumerate(students):
-                # User ID
-                id_item = QTableWidgetItem(str(user_id))
-                id_item.setFlags(id_item.flags() & ~Qt.ItemIsEditable)
-                self.manual_attendance_table.setItem(row, 0, id_item)
-                
-                # Name
-                name_item = QTableWidgetItem(name)
-                name_item.setFlags(name_item.flags() & ~Qt.ItemIsEditable)
-                self.manual_attendance_table.setItem(row, 1, name_item)
-                
-                # Email
-                email_item = QTableWidgetItem(email)
-                email_item.setFlags(email_item.flags() & ~Qt.ItemIsEditable)
-                self.manual_attendance_table.setItem(row, 2, email_item)
-                
-                # Status ComboBox
-                status_combo = QComboBox()
-                status_combo.addItems(status_options)
-                current_status = status if status in status_options else 'Vắng'
-                status_combo.setCurrentText(current_status)
-                self.manual_attendance_table.setCellWidget(row, 3, status_combo)
-                
-                # Note
-                note_item = QTableWidgetItem(note)
-                self.manual_attendance_table.setItem(row, 4, note_item)
-                
-        except Exception as e:
-            QMessageBox.warning(self, "Lỗi", f"Không thể tải danh sách học sinh: {str(e)}")
+            # Note
+            note_item = QTableWidgetItem(note)
+            self.manual_attendance_table.setItem(row, 4, note_item)
 
     def save_manual_attendance(self):
         """Save manual attendance records and update student list view"""
@@ -814,56 +800,70 @@ class MainWindow(QMainWindow):
             QMessageBox.warning(self, "Cảnh báo", "Vui lòng chọn một lớp")
             return
             
-        try:
-            # Begin transaction
-            self.db.cur.execute("BEGIN")
-            
-            # Delete existing attendance records for this class and date
-            self.db.cur.execute("""
-                DELETE FROM attendance 
-                WHERE class_id = %s AND attendance_date = %s
-            """, (class_id, selected_date))
-            
-            # Insert new attendance records
-            current_time = datetime.datetime.now().time()
-            for row in range(self.manual_attendance_table.rowCount()):
-                student_id = int(self.manual_attendance_table.item(row, 0).text())
-                status = self.manual_attendance_table.cellWidget(row, 3).currentText()
-                note = self.manual_attendance_table.item(row, 4).text()
-                
-                self.db.cur.execute("""
-                    INSERT INTO attendance (class_id, student_id, attendance_date, status, note, check_in_time)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                """, (class_id, student_id, selected_date, status, note, current_time))
-            
-            # Commit transaction
-            self.db.cur.execute("COMMIT")
-            
+        records = []
+        for row in range(self.manual_attendance_table.rowCount()):
+            student_id = int(self.manual_attendance_table.item(row, 0).text())
+            status = self.manual_attendance_table.cellWidget(row, 3).currentText()
+            note = self.manual_attendance_table.item(row, 4).text()
+            records.append((student_id, status, note))
+
+        def saved(_):
             QMessageBox.information(self, "Thành công", "Đã lưu điểm danh thành công!")
             
+            # Keep the in-memory roster of a running session in sync
+            if self.roster and self.roster.class_id == class_id and self.roster.date == selected_date:
+                self.run_db(self.db.load_class_roster, class_id, on_done=self.set_roster)
+
             # Refresh both the manual attendance view and student list
             self.load_students_for_manual_attendance()
             
             # Update student list if we're viewing the same class
             if self.student_list_class_select.currentData() == class_id:
                 self.view_students()
-                
-        except Exception as e:
-            self.db.cur.execute("ROLLBACK")
-            QMessageBox.warning(self, "Lỗi", f"Không thể lưu điểm danh: {str(e)}")
+
+        self.run_db(self.db.save_manual_attendance, class_id, selected_date, records,
+                    on_done=saved,
+                    on_error=lambda e: QMessageBox.warning(self, "Lỗi", f"Không thể lưu điểm danh: {str(e)}"))
+
+    def set_roster(self, roster):
+        # Ignore a roster that arrives after its session has ended
+        if self.current_class_id == roster.class_id:
+            self.roster = roster
 
     def start_recognition(self):
         """
         Bắt đầu quá trình nhận diện khuôn mặt.
         Kiểm tra lớp học được chọn và khởi động luồng xử lý nhận diện.
         """
+        # Kiểm tra nếu người dùng đã chọn lớp học
+        class_id = self.camera_class_select.currentData()
+        if class_id is None:
+            QMessageBox.warning(self, "Warning", "Please select a class before starting recognition")
+            return
+
+        self.status_label.setText("Loading class roster...")
+        # Nạp danh sách lớp và điểm danh hôm nay vào bộ nhớ, sau đó khởi động nhận diện
+        self.run_db(self.db.load_class_roster, class_id,
+                    on_done=self.begin_recognition,
+                    on_error=self.recognition_start_failed)
+
+    def begin_recognition(self, roster):
         try:
-            # Kiểm tra nếu người dùng đã chọn lớp học
-            self.current_class_id = self.camera_class_select.currentData()
-            if self.current_class_id is None:
-                QMessageBox.warning(self, "Warning", "Please select a class before starting recognition")
+            self.thread.load_model()
+            if self.thread.model is None:
+                self.status_label.setText("")
+                QMessageBox.warning(self, "Warning", "Chưa có mô hình nhận diện, hãy đăng ký khuôn mặt trước!")
+                return
+            self.thread.set_roster(roster)
+            if not len(self.thread.gallery()):
+                self.thread.set_roster(None)
+                self.status_label.setText("")
+                QMessageBox.warning(self, "Warning", "Chưa có học sinh nào của lớp này được đăng ký khuôn mặt")
                 return
 
+            self.current_class_id = roster.class_id
+            self.roster = roster
+
             # Khởi động nhận diện
             self.thread.running = True
             self.thread.start()
@@ -871,19 +871,49 @@ class MainWindow(QMainWindow):
             _logger.info(f"Recognition started for class ID: {self.current_class_id}")
 
         except Exception as e:
-            _logger.error(f"Failed to start recognition: {str(e)}")
-            QMessageBox.critical(self, "Error", f"An error occurred while starting recognition: {str(e)}")
+            self.recognition_start_failed(e)
+
+    def recognition_start_failed(self, e):
+        _logger.error(f"Failed to start recognition: {str(e)}")
+        QMessageBox.critical(self, "Error", f"An error occurred while starting recognition: {str(e)}")
 
     def stop_recognition(self):
+        self.current_class_id = None
+        self.roster = None
+        self.thread.set_roster(None)
+        # The camera stays on until a running enrollment is done
+        if self.enrollment is None:
+            self.stop_camera()
+        dropped = ", ".join(f"{stage}: {count}" for stage, count in self.thread.dropped_frames.items())
+        self.status_label.setText(f"Recognition stopped (dropped frames - {dropped})" if dropped else "Recognition stopped")
+
+    def stop_camera(self):
         self.thread.running = False
         self.thread.wait()
-        self.current_class_id = None
-        self.status_label.setText("Recognition stopped")
 
-    @pyqtSlot(np.ndarray)
-    def update_image(self, cv_img):
+    @pyqtSlot(str)
+    def recognition_error(self, message):
+        self.status_label.setText(message)
+        if self.enrollment is not None:
+            self.enrollment.finish()
+        QMessageBox.warning(self, "Error", message)
+
+    @pyqtSlot(np.ndarray, float, float)
+    def update_image(self, cv_img, captured_at, emitted_at):
+        received_at = time.monotonic()
+        self.metrics.observe('handoff', received_at - emitted_at)
+        if self.metrics_checkbox.isChecked():
+            # Summarized twice a second rather than for every frame
+            if self.metrics_snapshot is None or received_at - self.metrics_snapshot[0] >= 0.5:
+                self.metrics_snapshot = (received_at, self.metrics.snapshot())
+            draw_overlay(cv_img, self.metrics_snapshot[1])
         qt_img = self.convert_cv_qt(cv_img)
         self.image_label.setPixmap(qt_img)
+        if self.enrollment is not None:
+            self.enroll_preview.setPixmap(qt_img.scaledToWidth(320))
+        displayed_at = time.monotonic()
+        self.metrics.observe('display', displayed_at - received_at)
+        self.metrics.observe('latency', displayed_at - captured_at)
 
     # Update the handle_recognition method to show success message:
     @pyqtSlot(str, float)
@@ -894,34 +924,28 @@ class MainWindow(QMainWindow):
         
         if status == 'Có mặt' and self.current_class_id:
             try:
+                student_id = int(user_id)
+                if not self.roster.is_current():
+                    self.roster.start_new_day()
+                    self.run_db(self.db.load_class_roster, self.current_class_id, on_done=self.set_roster)
+
                 # Kiểm tra học sinh có đăng ký lớp học không
-                if not self.db.is_student_registered(self.current_class_id, int(user_id)):
+                if not self.roster.is_registered(student_id):
                     self.status_label.setText(f"Student {user_id} not registered for this class")
                     return
-                
-                # Kiểm tra đã điểm danh chưa
-                self.db.cur.execute("""
-                    SELECT COUNT(*) 
-                    FROM attendance 
-                    WHERE class_id = %s AND student_id = %s AND attendance_date = CURRENT_DATE
-                """, (self.current_class_id, int(user_id)))
-                already_recorded = self.db.cur.fetchone()[0]
 
                 # Lấy tên học sinh
-                self.db.cur.execute("SELECT full_name FROM users WHERE user_id = %s", (int(user_id),))
-                student_name = self.db.cur.fetchone()[0]
+                student_name = self.roster.name(student_id)
 
-                if not already_recorded:
-                    # Ghi nhận điểm danh
-                    self.db.record_attendance(self.current_class_id, int(user_id), status, confidence_score)
+                # Kiểm tra đã điểm danh chưa
+                if not self.roster.is_recorded(student_id):
+                    # Ghi nhận điểm danh (ghi vào CSDL ở luồng nền)
+                    self.attendance_writer.submit(self.current_class_id, student_id, status, confidence_score)
+                    self.roster.mark_recorded(student_id)
                     
                     if student_name:
                         QMessageBox.information(self, "Điểm danh thành công", 
                                             f"Điểm danh đã được ghi nhận thành công cho {student_name}")
-                        
-                        # Cập nhật danh sách học sinh ngay lập tức
-                        if self.student_list_class_select.currentData() == self.current_class_id:
-                            self.view_students()  # Refresh student list
                     else:
                         QMessageBox.warning(self, "Error", "Không thể lấy tên học sinh.")
                 else:
@@ -934,6 +958,24 @@ class MainWindow(QMainWindow):
                 _logger.error(f"Failed to handle recognition: {str(e)}")
                 self.status_label.setText(f"Lỗi ghi nhận điểm danh: {str(e)}")
 
+    @pyqtSlot(list)
+    def on_attendance_written(self, rows):
+        # Cập nhật danh sách học sinh khi điểm danh đã được lưu
+        class_id = self.student_list_class_select.currentData()
+        if class_id is not None and any(row[0] == class_id for row in rows):
+            self.view_students()
+
+    @pyqtSlot(list)
+    def on_attendance_failed(self, rows):
+        # Điểm danh không lưu được: cho phép ghi nhận lại học sinh này
+        failed = []
+        for class_id, student_id, attendance_date, *_ in rows:
+            if self.roster and self.roster.class_id == class_id and self.roster.date == attendance_date:
+                self.roster.unmark_recorded(student_id)
+                failed.append(self.roster.name(student_id) or str(student_id))
+        if failed:
+            self.status_label.setText(f"Không thể lưu điểm danh cho: {', '.join(failed)}")
+
     def convert_cv_qt(self, cv_img):
         rgb_image = cv2.cvtColor(cv_img, cv2.COLOR_BGR2RGB)
         h, w, ch = rgb_image.shape
@@ -959,6 +1001,8 @@ class MainWindow(QMainWindow):
             _logger.info(f"Starting user registration for {name}")
             # Add user to database
             user_id = self.db.add_user(name, email, role, class_id)
+            if user_id and self.roster and self.roster.class_id == class_id:
+                self.roster.add_student(user_id, name)
 
             if user_id:
                 reply = QMessageBox.question(self, "Success", 
@@ -988,103 +1032,117 @@ class MainWindow(QMainWindow):
         self.class_combo.setCurrentIndex(0)
 
     def capture_faces(self, user_id):
+        """Capture face samples of a user through the recognition thread, without blocking the window"""
+        if self.enrollment is not None:
+            QMessageBox.warning(self, "Warning", "Đang chụp ảnh gương mặt của người dùng khác")
+            return
         _logger.info(f"Starting face capture for user: {user_id}")
-        face_detector = cv2.CascadeClassifier('haarcascade_frontalface_default.xml')
-        cam = None
-        try:
-            cam = cv2.VideoCapture(0)
-            if not cam.isOpened():
-                raise Exception("Failed to open camera")
-            
-            count = 0
-            user_path = os.path.join(DATASET_DIR, f"User_{user_id}")
-            os.makedirs(user_path, exist_ok=True)
-            
-            while count < REQUIRED_FACE_SAMPLES :
-                ret, img = cam.read()
-                if not ret:
-                    raise Exception("Failed to read from camera")
-                
-                gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-                faces = face_detector.detectMultiScale(gray, 1.3, 5)
-                
-                for (x, y, w, h) in faces:
-                    count += 1
-                    # Save face image
-                    # image_path = f"dataset/User.{user_id}.{count}.jpg"
-                    image_path = os.path.join(user_path, f"{count}.jpg")
-                    face_img = gray[y:y+h, x:x+w]
-                    cv2.imwrite(image_path, face_img)
-                    
-                    # Save face data to database
-                    face_encoding = face_img.tobytes().hex()
-                    self.db.save_face_data(user_id, face_encoding, image_path)
-
-                    # Show progress
-                    self.status_label.setText(f"Capturing face {count}/{REQUIRED_FACE_SAMPLES}")
-                    QApplication.processEvents()
-                    
-                if count >= REQUIRED_FACE_SAMPLES:
-                    break
-        
-        except Exception as e:
-            QMessageBox.warning(self, "Error", f"Failed to capture face data: {str(e)}")
-            raise e
-        finally:
-            if cam is not None:
-                cam.release()
-                self.train_model() # Always train model after capturing faces
+        self.enrollment = EnrollmentSession(user_id, REQUIRED_FACE_SAMPLES,
+                                            on_progress=self.enrollment_progress_signal.emit,
+                                            on_complete=self.enrollment_done_signal.emit)
+        # Shares the camera with recognition when it is running, otherwise starts it
+        self.thread.enroll(self.enrollment)
+        if not self.thread.isRunning():
+            self.thread.running = True
+            self.thread.start()
+        self.enroll_status_label.setText(f"Capturing face 0/{REQUIRED_FACE_SAMPLES}")
+        self.stop_capture_button.setEnabled(True)
+
+    def stop_capture(self):
+        """End the capture early, keeping the samples taken so far"""
+        if self.enrollment is not None:
+            self.enrollment.finish()
+
+    @pyqtSlot(int, int)
+    def show_enrollment_progress(self, count, required):
+        self.enroll_status_label.setText(f"Capturing face {count}/{required}")
+
+    @pyqtSlot(object)
+    def finish_enrollment(self, session):
+        self.enrollment = None
+        self.stop_capture_button.setEnabled(False)
+        self.enroll_preview.clear()
+        if self.current_class_id is None:
+            self.stop_camera()
+        if not session.samples:
+            self.enroll_status_label.setText("")
+            QMessageBox.warning(self, "Error", "Failed to capture face data: no face detected")
+            return
+        self.enroll_status_label.setText(f"Saving {len(session.samples)} face samples...")
+        self.run_db(self.save_enrollment, session,
+                    on_done=self.enrollment_saved,
+                    on_error=lambda e: QMessageBox.warning(self, "Error", f"Failed to save face data: {str(e)}"))
+
+    def save_enrollment(self, session):
+        """Write the captured samples to the dataset and the database (runs on the database worker)"""
+        # Chỉ giữ lại một số ít mẫu rõ nét và khác nhau thay vì các khung hình gần giống nhau
+        faces = [session.samples[i] for i in select_samples(session.samples)]
+        _logger.info(f"Selected {len(faces)} of {len(session.samples)} captured samples of user {session.user_id}")
+        packed_dir = PACKED_DATASET_DIR if DATASET_FORMAT == 'packed' else None
+        samples = save_samples(session.user_id, faces, DATASET_DIR, packed_dir)
+        self.db.save_face_samples(session.user_id, samples)
+        return len(samples)
+
+    def enrollment_saved(self, count):
+        self.enroll_status_label.setText(f"Saved {count} face samples")
+        self.train_model()
 
     def train_model(self):
-        try:
-            _logger.info("Training model....")
-            recognizer = cv2.face.LBPHFaceRecognizer_create()
-            detector = cv2.CascadeClassifier("haarcascade_frontalface_default.xml")
-
-            faces = []
-            ids = []
+        """Retrain in the background; requests made while training are merged into one more run"""
+        _logger.info("Training model....")
+        # Chỉ thêm các mẫu mới vào mô hình, huấn luyện lại toàn bộ khi cần
+        self.training.request()
+        self.training_label.setText("Đang huấn luyện mô hình...")
+        self.cancel_training_button.setEnabled(True)
+
+    def cancel_training(self):
+        if self.training.is_running():
+            self.training.cancel()
+            self.training_label.setText("Đang hủy huấn luyện...")
+
+    @pyqtSlot(str, int, int)
+    def show_training_progress(self, stage, done, total):
+        messages = {
+            STAGE_LOAD: f"Training model: {done}/{total} images loaded",
+            STAGE_HISTOGRAMS: f"Training model: {done}/{total} histograms computed",
+            STAGE_WRITE: "Training model: model written",
+            STAGE_INDEX: "Training model: gallery index written",
+        }
+        self.training_label.setText(messages.get(stage, stage))
 
-            # Duyệt qua các thư mục user trong DATASET_DIR
-            for user_dir in os.listdir(DATASET_DIR):
-                if not user_dir.startswith("User_"):
-                    continue
-                    
-                try:
-                    # Lấy user_id từ tên thư mục
-                    user_id = int(user_dir.split("_")[1])
-                    user_path = os.path.join(DATASET_DIR, user_dir)
-                    
-                    # Duyệt qua các ảnh trong thư mục user
-                    for img_file in os.listdir(user_path):
-                        img_path = os.path.join(user_path, img_file)
-                        img = Image.open(img_path).convert('L')
-                        img_numpy = np.array(img, 'uint8')
-                        
-                        faces.append(img_numpy)
-                        ids.append(user_id)
-                        
-                except Exception as e:
-                    _logger.warning(f"Error processing user directory {user_dir}: {str(e)}")
-                    continue
-
-            if not faces:
-                raise ValueError("No valid face images found")
-
-            recognizer.train(faces, np.array(ids))
-            trainer_path = os.path.join(TRAINER_DIR, TRAINER_FILE)
-            recognizer.write(trainer_path)
+    @pyqtSlot(str, int)
+    def training_done(self, mode, samples):
+        self.training_label.setText(f"Model updated ({mode}, {samples} samples)")
+        if not self.training.is_running():
+            self.cancel_training_button.setEnabled(False)
             QMessageBox.information(self, "Success", "Đăng ký hoàn tất !!!")
-            
-        except Exception as e:
-            _logger.error(f"Error training model: {str(e)}")
-            QMessageBox.warning(self, "Error", f"Failed to train model: {str(e)}")
+
+    @pyqtSlot(str)
+    def training_failed(self, message):
+        self.training_label.setText("")
+        self.cancel_training_button.setEnabled(self.training.is_running())
+        QMessageBox.warning(self, "Error", f"Failed to train model: {message}")
+
+    @pyqtSlot()
+    def training_cancelled(self):
+        self.training_label.setText("Đã hủy huấn luyện")
+        self.cancel_training_button.setEnabled(False)
 
     def closeEvent(self, event):
         """Handle application shutdown"""
         try:
+            self.enrollment = None
             self.stop_recognition()
+            if hasattr(self, 'training'):
+                self.training.cancel(wait=True)
+            if hasattr(self, 'attendance_writer'):
+                self.attendance_writer.close()
             if hasattr(self, 'db'):
                 self.db.close()
+            if self.metrics_server is not None:
+                self.metrics_server.stop()
+            if self.metrics_logger is not None:
+                self.metrics_logger.stop()
         except Exception as e:
             _logger.error(f"Error during shutdown: {str(e)}")
         finally:
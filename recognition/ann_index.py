@@ -0,0 +1,256 @@
+"""Approximate nearest-neighbour index over the LBPH gallery.
+
+The exact search in ``LBPHModel.predict_batch`` still touches every enrolled
+sample. For large schools the model can get an index next to it
+(``trainer.ann.npz``):
+
+* histograms are square-rooted (so Euclidean distance approximates the
+  chi-square distance) and reduced with PCA to ``dims`` components;
+* the reduced vectors are bucketed by k-means into inverted lists (IVF);
+* a query probes the ``nprobe`` nearest buckets, ranks their samples in the
+  reduced space and compares only the best ``rerank`` of them exactly.
+
+The work per face depends on the bucket size rather than the gallery size.
+``train_model`` builds the index when asked to and extends it with the
+samples of incremental updates. ``benchmarks/ann_index.py`` measures recall
+and latency against the exact scan.
+"""
+import logging
+import os
+
+import numpy as np
+
+from recognition.lbph_model import NO_MATCH, chi2_distance, load_model
+
+_logger = logging.getLogger(__name__)
+
+PCA_DIMS = 128
+# Samples used to fit PCA and k-means
+FIT_SAMPLES = 20000
+# Target number of samples per inverted list
+LIST_SIZE = 256
+KMEANS_ITERATIONS = 10
+NPROBE = 16
+RERANK = 256
+# Rows projected per step while building
+BUILD_CHUNK = 2048
+
+
+def index_path(model_path):
+    return os.path.splitext(model_path)[0] + '.ann.npz'
+
+
+def _roots(histograms):
+    return np.sqrt(np.asarray(histograms, np.float32))
+
+
+def fit_pca(x, dims, iterations=2, seed=0):
+    """Mean and top ``dims`` principal axes of the rows of ``x`` (randomized SVD)"""
+    mean = x.mean(axis=0)
+    centered = x - mean
+    rank = min(dims + 10, *centered.shape)
+    rng = np.random.default_rng(seed)
+    sketch = centered @ rng.standard_normal((x.shape[1], rank)).astype(np.float32)
+    for _ in range(iterations):
+        basis, _ = np.linalg.qr(sketch)
+        sketch = centered @ (centered.T @ basis)
+    basis, _ = np.linalg.qr(sketch)
+    _, _, axes = np.linalg.svd(basis.T @ centered, full_matrices=False)
+    return mean, np.ascontiguousarray(axes[:dims], np.float32)
+
+
+def nearest_centroids(x, centroids, count=1):
+    """Indices of the ``count`` nearest centroids of every row of ``x``"""
+    scores = x @ centroids.T
+    scores *= -2
+    scores += (centroids * centroids).sum(axis=1)
+    if count >= len(centroids):
+        return np.argsort(scores, axis=1)
+    nearest = np.argpartition(scores, count - 1, axis=1)[:, :count]
+    order = np.take_along_axis(scores, nearest, axis=1).argsort(axis=1)
+    return np.take_along_axis(nearest, order, axis=1)
+
+
+def kmeans(x, clusters, iterations=KMEANS_ITERATIONS, seed=0):
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = nearest_centroids(x, centroids)[:, 0]
+        order = np.argsort(assignment, kind='stable')
+        used, starts, counts = np.unique(assignment[order], return_index=True, return_counts=True)
+        # Empty clusters keep their previous centroid
+        centroids[used] = np.add.reduceat(x[order], starts, axis=0) / counts[:, None]
+    return centroids
+
+
+class GalleryIndex:
+    """PCA projection plus inverted lists of gallery rows"""
+
+    def __init__(self, mean, components, centroids, offsets, ids, vectors):
+        self.mean = mean
+        self.components = components
+        self.centroids = centroids
+        # Rows of list i are ids[offsets[i]:offsets[i + 1]], reduced vectors alongside
+        self.offsets = offsets
+        self.ids = ids
+        self.vectors = vectors
+
+    def __len__(self):
+        return len(self.ids)
+
+    def project(self, histograms):
+        return (_roots(histograms) - self.mean) @ self.components.T
+
+    def _project_rows(self, histograms, start=0):
+        parts = [self.project(histograms[i:i + BUILD_CHUNK]) for i in range(start, len(histograms), BUILD_CHUNK)]
+        return np.concatenate(parts) if parts else np.zeros((0, len(self.components)), np.float32)
+
+    @classmethod
+    def build(cls, histograms, dims=PCA_DIMS, list_size=LIST_SIZE, seed=0):
+        """Fit PCA and the inverted lists on (a sample of) the gallery and add every row"""
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(len(histograms), min(len(histograms), FIT_SAMPLES), replace=False))
+        fit_rows = _roots(histograms[sample])
+        mean, components = fit_pca(fit_rows, dims, seed=seed)
+        clusters = max(1, min(len(sample), round(len(histograms) / list_size)))
+        centroids = kmeans((fit_rows - mean) @ components.T, clusters, seed=seed)
+        index = cls(mean, components, centroids, np.zeros(clusters + 1, np.int64),
+                    np.zeros(0, np.int64), np.zeros((0, len(components)), np.float32))
+        index.add(histograms)
+        return index
+
+    def add(self, histograms, start=None):
+        """Add gallery rows from ``start`` (default: the first row not yet indexed) on"""
+        start = len(self) if start is None else start
+        vectors = self._project_rows(histograms, start)
+        if not len(vectors):
+            return 0
+        lists = nearest_centroids(vectors, self.centroids)[:, 0]
+        old_lists = np.repeat(np.arange(len(self.centroids)), np.diff(self.offsets))
+        all_lists = np.concatenate([old_lists, lists])
+        order = np.argsort(all_lists, kind='stable')
+        self.ids = np.concatenate([self.ids, np.arange(start, start + len(vectors))])[order]
+        self.vectors = np.concatenate([self.vectors, vectors])[order]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(all_lists, minlength=len(self.centroids)))])
+        return len(vectors)
+
+    def subset(self, rows):
+        """Index of the gallery rows ``rows`` (sorted), numbered like the samples of ``LBPHModel.subset``.
+
+        The projection and the lists are shared; only the entries of the
+        other rows are left out, so no vector is projected again.
+        """
+        rows = np.asarray(rows, np.int64)
+        positions = np.minimum(np.searchsorted(rows, self.ids), max(len(rows) - 1, 0))
+        keep = rows[positions] == self.ids if len(rows) else np.zeros(len(self.ids), bool)
+        lists = np.repeat(np.arange(len(self.centroids)), np.diff(self.offsets))[keep]
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(lists, minlength=len(self.centroids)))])
+        return GalleryIndex(self.mean, self.components, self.centroids, offsets,
+                            positions[keep], self.vectors[keep])
+
+    def candidates(self, vector, nprobe=NPROBE, count=RERANK):
+        """Gallery rows nearest to one reduced query within its ``nprobe`` nearest lists"""
+        lists = nearest_centroids(vector[None], self.centroids, nprobe)[0]
+        spans = [slice(self.offsets[i], self.offsets[i + 1]) for i in lists]
+        ids = np.concatenate([self.ids[span] for span in spans])
+        vectors = np.concatenate([self.vectors[span] for span in spans])
+        distances = ((vectors - vector) ** 2).sum(axis=1)
+        if count < len(ids):
+            keep = np.argpartition(distances, count - 1)[:count]
+            ids, distances = ids[keep], distances[keep]
+        return ids[np.argsort(distances, kind='stable')]
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, mean=self.mean, components=self.components, centroids=self.centroids,
+                     offsets=self.offsets, ids=self.ids, vectors=self.vectors)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['mean'], data['components'], data['centroids'],
+                       data['offsets'], data['ids'], data['vectors'])
+
+
+def update_index(model_path, rebuild=False, model=None, source_path=None):
+    """Build the index of a model, or add the rows appended since it was built.
+
+    ``source_path`` is the model the new one was derived from, whose index
+    is extended (default: the index of ``model_path`` itself). The index is
+    rebuilt from scratch when ``rebuild`` is set (the model was retrained),
+    when it is missing, or when it has more rows than the model.
+    """
+    model = model or load_model(model_path)
+    path = index_path(model_path)
+    source = index_path(source_path or model_path)
+    if not len(model):
+        return None
+    if not rebuild and os.path.exists(source):
+        index = GalleryIndex.load(source)
+        if len(index) <= len(model):
+            added = index.add(model.histograms)
+            if added or source != path:
+                index.save(path)
+                _logger.info(f"Added {added} samples to the gallery index")
+            return index
+    index = GalleryIndex.build(model.histograms)
+    index.save(path)
+    _logger.info(f"Built gallery index over {len(index)} samples in {len(index.centroids)} lists")
+    return index
+
+
+class IndexedRecognizer:
+    """``LBPHModel`` look-alike that answers queries through a ``GalleryIndex``"""
+
+    def __init__(self, model, index, nprobe=NPROBE, rerank=RERANK):
+        self.model = model
+        self.index = index
+        self.nprobe = nprobe
+        self.rerank = rerank
+        self.face_size = model.face_size
+
+    def __len__(self):
+        return len(self.model)
+
+    def prepare(self):
+        """Nothing to precompute, the index is loaded ready to search"""
+
+    def subset(self, labels):
+        """Recognizer restricted to the samples of ``labels``, searched through the matching part of the index"""
+        model = self.model.subset(labels)
+        return IndexedRecognizer(model, self.index.subset(model.histograms.rows), self.nprobe, self.rerank)
+
+    def predict_batch(self, faces, k=1):
+        """Same results format as ``LBPHModel.predict_batch``, but approximate"""
+        if not len(faces):
+            return []
+        queries = self.model.histograms_of(faces)
+        limit = np.inf if self.model.threshold is None else self.model.threshold
+        results = []
+        for query, vector in zip(queries, self.index.project(queries)):
+            best = {}
+            for row in self.index.candidates(vector, self.nprobe, self.rerank):
+                distance = chi2_distance(np.asarray(self.model.histograms[row], np.float32), query)
+                label = int(self.model.labels[row])
+                if distance < limit and distance < best.get(label, np.inf):
+                    best[label] = distance
+            matches = sorted(best.items(), key=lambda item: item[1])[:k]
+            results.append([(label, float(distance)) for label, distance in matches] or [NO_MATCH])
+        return results
+
+    def predict(self, gray):
+        return self.predict_batch([gray])[0][0]
+
+
+def load_recognizer(model_path, use_index=True, nprobe=NPROBE, rerank=RERANK):
+    """Open a model, wrapped in an ``IndexedRecognizer`` when it has an up-to-date index"""
+    model = load_model(model_path)
+    path = index_path(model_path)
+    if use_index and os.path.exists(path):
+        index = GalleryIndex.load(path)
+        if len(index) == len(model):
+            return IndexedRecognizer(model, index, nprobe, rerank)
+        _logger.warning(f"Gallery index {path} is out of date, using the exact search")
+    return model
@@ -0,0 +1,185 @@
+"""Background write-behind queue for attendance records.
+
+Recognition hands attendance events to ``AttendanceWriter.submit``, which
+returns immediately. A worker thread with its own database connection
+collects the events and writes them as multi-row inserts, either once
+``batch_size`` events are waiting or ``flush_interval`` seconds after the
+first one arrived, whichever comes first.
+"""
+import datetime
+import logging
+import queue
+import threading
+import time
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+_logger = logging.getLogger(__name__)
+
+# Errors worth reconnecting and retrying for, e.g. the server restarting
+TRANSIENT_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+INSERT_ATTENDANCE_SQL = """
+    INSERT INTO attendance
+        (class_id, student_id, attendance_date, check_in_time, status, confidence_score)
+    SELECT v.class_id, v.student_id, v.attendance_date, v.check_in_time, v.status, v.confidence_score
+    FROM (VALUES %s) AS v(class_id, student_id, attendance_date, check_in_time, status, confidence_score)
+    WHERE NOT EXISTS (
+        SELECT 1 FROM attendance a
+        WHERE a.class_id = v.class_id AND a.student_id = v.student_id
+          AND a.attendance_date = v.attendance_date
+    )
+"""
+INSERT_ATTENDANCE_TEMPLATE = "(%s::integer, %s::integer, %s::date, %s::time, %s, %s::float)"
+
+
+class AttendanceWriter(threading.Thread):
+    """Batches attendance events into multi-row inserts on a worker thread.
+
+    ``connect`` is a callable returning a new psycopg2 connection.
+    ``on_written(rows)`` is called from the worker after each committed
+    batch. Transient connection errors are retried with backoff on a fresh
+    connection; a batch that still fails is kept and retried with the next
+    one, so nothing is lost while the server is down. A batch rejected for
+    another reason (e.g. a student removed from the class) is written again
+    one record at a time, so only the rejected records are dropped; they are
+    passed to ``on_failed(rows)``, also from the worker. With ``metrics`` (see
+    ``recognition.metrics``) the time of every committed batch is recorded
+    as the ``db_write`` stage and the written records are counted.
+    """
+
+    def __init__(self, connect, batch_size=100, flush_interval=0.5,
+                 max_retries=3, retry_delay=0.5, on_written=None, on_failed=None, metrics=None):
+        super().__init__(name='attendance-writer', daemon=True)
+        self.connect = connect
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.on_written = on_written
+        self.on_failed = on_failed
+        self.metrics = metrics
+        self._queue = queue.Queue()
+        self._pending = []
+        self._closing = threading.Event()
+        self._conn = None
+
+    def submit(self, class_id, student_id, status, confidence_score, when=None):
+        """Queue one attendance record without blocking"""
+        when = when or datetime.datetime.now()
+        confidence_score = max(0, min(100, confidence_score))
+        self._queue.put((class_id, student_id, when.date(), when.time(), status, confidence_score))
+
+    def close(self, timeout=10.0):
+        """Write out everything still queued and stop the worker"""
+        self._closing.set()
+        if self.is_alive():
+            self.join(timeout)
+        if self._pending or not self._queue.empty():
+            _logger.error(f"Attendance writer stopped with {len(self._pending) + self._queue.qsize()} unwritten records")
+        self._disconnect()
+
+    def run(self):
+        while not (self._closing.is_set() and self._queue.empty() and not self._pending):
+            batch = self._collect()
+            if batch:
+                self._write(batch)
+
+    def _collect(self):
+        """Wait for the first event, then gather more until the size or time trigger fires"""
+        taken = []
+        try:
+            taken.append(self._queue.get(timeout=0.1 if self._pending else self.flush_interval))
+        except queue.Empty:
+            pass
+        deadline = time.monotonic() + (0 if self._closing.is_set() else self.flush_interval)
+        while len(self._pending) + len(taken) < self.batch_size:
+            try:
+                taken.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        batch = self._pending + taken
+        self._pending = []
+        return batch
+
+    def _write(self, batch):
+        # One record per student, class and day is enough
+        rows = list({(row[0], row[1], row[2]): row for row in reversed(batch)}.values())
+        for attempt in range(self.max_retries + 1):
+            try:
+                started = time.perf_counter()
+                self._insert(rows)
+                self._written(rows, time.perf_counter() - started)
+                return
+            except TRANSIENT_ERRORS as e:
+                _logger.warning(f"Attendance write failed (attempt {attempt + 1}): {str(e)}")
+                self._disconnect()
+                if attempt < self.max_retries:
+                    time.sleep(self.retry_delay * 2 ** attempt)
+            except Exception as e:
+                self._rollback()
+                _logger.warning(f"Attendance batch of {len(rows)} records rejected, writing them one by one: {str(e)}")
+                self._write_each(rows)
+                return
+        if self._closing.is_set():
+            _logger.error(f"Giving up on {len(rows)} attendance records after {self.max_retries + 1} attempts")
+        else:
+            self._pending = rows
+
+    def _write_each(self, rows):
+        """Write records in separate transactions, dropping only the ones the database rejects"""
+        started = time.perf_counter()
+        written, failed = [], []
+        for i, row in enumerate(rows):
+            try:
+                self._insert([row])
+                written.append(row)
+            except TRANSIENT_ERRORS as e:
+                # The rest is retried with the next batch, like a batch written while the server is down
+                _logger.warning(f"Attendance write failed: {str(e)}")
+                self._disconnect()
+                self._pending = rows[i:]
+                break
+            except Exception as e:
+                self._rollback()
+                _logger.error(f"Failed to record attendance of student {row[1]} in class {row[0]}, "
+                              f"dropping it: {str(e)}")
+                failed.append(row)
+        if written:
+            self._written(written, time.perf_counter() - started)
+        if failed and self.on_failed:
+            self.on_failed(failed)
+
+    def _insert(self, rows):
+        if self._conn is None:
+            self._conn = self.connect()
+        with self._conn.cursor() as cur:
+            execute_values(cur, INSERT_ATTENDANCE_SQL, rows, template=INSERT_ATTENDANCE_TEMPLATE)
+        self._conn.commit()
+
+    def _written(self, rows, seconds):
+        if self.metrics is not None:
+            self.metrics.observe('db_write', seconds)
+            self.metrics.count('attendance_records', len(rows))
+        _logger.info(f"Wrote {len(rows)} attendance records")
+        if self.on_written:
+            self.on_written(rows)
+
+    def _rollback(self):
+        """Roll back the failed transaction; a connection that cannot be rolled back is dropped"""
+        if self._conn is None:
+            return
+        try:
+            self._conn.rollback()
+        except Exception as e:
+            _logger.warning(f"Rollback failed, reconnecting: {str(e)}")
+            self._disconnect()
+
+    def _disconnect(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
@@ -0,0 +1,297 @@
+"""Local HTTP API recognizing the faces in batches of still images.
+
+Other systems on the same machine (a kiosk, an exam check-in tool) reuse the
+trained model through this service instead of each loading it. The model is
+loaded once and kept warm; newly published models are picked up in the
+background (see ``recognition.model_store``), so no request pays for a load.
+Images of a request are decoded, detected and normalized in parallel on a
+shared pool of workers, then all their faces are recognized in one
+``predict_batch`` call.
+
+The service only listens on the local machine::
+
+    python -m recognition.batch_api                       # http://127.0.0.1:8765
+    python -m recognition.batch_api --socket /run/face-recognition.sock
+
+``POST /recognize`` takes a JSON body::
+
+    {"images": ["<base64 JPEG or PNG>", ...], "detect": true, "k": 1, "max_distance": 50}
+
+With ``"detect": false`` every image is taken as one face crop. The answer
+has one entry per image, in order::
+
+    {"model_version": 8,
+     "results": [{"faces": [{"box": [x, y, w, h], "label": 3, "distance": 41.2}]},
+                 {"error": "Cannot decode image"}]}
+
+``label`` is -1 and ``distance`` null when no enrolled user is closer
+than ``max_distance`` (LBPH distance, by default ``100 -
+CONFIDENCE_THRESHOLD`` like the app and the attendance daemon); with ``k`` > 1 each face also lists its ``matches`` as
+[label, distance] pairs, nearest first. ``GET /health`` returns the model
+version and gallery size. See ``recognition.batch_client`` for a client
+and load test.
+"""
+import argparse
+import base64
+import binascii
+import concurrent.futures
+import http.server
+import json
+import logging
+import os
+import signal
+import socketserver
+import threading
+
+import cv2
+import numpy as np
+
+from config.setting import (ANN_INDEX, ANN_NPROBE, ANN_RERANK, API_HOST, API_MAX_BATCH, API_PORT, API_SOCKET,
+                            CASCADE_FILE, CONFIDENCE_THRESHOLD, MODEL_POLL_INTERVAL, RECOGNITION_WORKERS,
+                            TRAINER_DIR, TRAINER_FILE)
+from recognition.ann_index import load_recognizer
+from recognition.lbph_model import NO_MATCH
+from recognition.model_store import ModelStore
+from recognition.pipeline import CascadeDetector
+from recognition.preprocess import normalize_face
+
+_logger = logging.getLogger(__name__)
+
+# Largest request body accepted, in bytes
+MAX_BODY_BYTES = 32 * 1024 * 1024
+MAX_MATCHES = 10
+# Matches at this LBPH distance or farther are strangers, as in the app
+MAX_DISTANCE = 100 - CONFIDENCE_THRESHOLD
+
+
+class RequestError(Exception):
+    """A request the API rejects, with the HTTP status to answer"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class BatchRecognizer:
+    """Keeps the published model loaded and recognizes faces in batches of encoded images"""
+
+    def __init__(self, model_path, workers=None, use_index=ANN_INDEX):
+        self.store = ModelStore(model_path)
+        self.use_index = use_index
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix='recognize')
+        self.model = None
+        self.model_version = None
+        self._local = threading.local()
+        self._stop_event = threading.Event()
+        self._watcher = None
+
+    def load_model(self):
+        """Load the published model if it is newer than the one in use; return whether it was"""
+        version, model_path = self.store.current()
+        if model_path is None or version == self.model_version:
+            return False
+        model = load_recognizer(model_path, self.use_index, ANN_NPROBE, ANN_RERANK)
+        model.prepare()
+        # Requests in flight finish with the model they started with
+        self.model, self.model_version = model, version
+        _logger.info(f"Loaded model version {version} from {model_path}")
+        return True
+
+    def start(self):
+        self.load_model()
+        self._stop_event.clear()
+        self._watcher = threading.Thread(target=self._watch, name='model-watcher', daemon=True)
+        self._watcher.start()
+
+    def close(self):
+        self._stop_event.set()
+        if self._watcher is not None:
+            self._watcher.join()
+        self.pool.shutdown()
+
+    def _watch(self):
+        while not self._stop_event.wait(MODEL_POLL_INTERVAL):
+            try:
+                self.load_model()
+            except Exception as e:
+                _logger.error(f"Failed to load model: {str(e)}")
+
+    def _detector(self):
+        # Cascades are not shared between threads
+        detector = getattr(self._local, 'detector', None)
+        if detector is None:
+            detector = self._local.detector = CascadeDetector(cv2.CascadeClassifier(CASCADE_FILE))
+        return detector
+
+    def _prepare(self, data, detect, face_size):
+        """Decode one image; return its face boxes and normalized crops"""
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            raise ValueError("Cannot decode image")
+        if detect:
+            boxes = [box for _, box in self._detector()(image)]
+        else:
+            boxes = [(0, 0, image.shape[1], image.shape[0])]
+        crops = []
+        for (x, y, w, h) in boxes:
+            face = image[y:y+h, x:x+w]
+            crops.append(normalize_face(face, face_size) if face_size else face)
+        return boxes, crops
+
+    def recognize(self, images, detect=True, k=1, max_distance=MAX_DISTANCE):
+        """Recognize the faces of encoded images; one result dict per image (see the module docstring)"""
+        model, version = self.model, self.model_version
+        if model is None:
+            raise RequestError(503, "No trained model")
+        futures = [self.pool.submit(self._prepare, data, detect, model.face_size) for data in images]
+        results, boxes, crops = [], [], []
+        for future in futures:
+            try:
+                image_boxes, image_crops = future.result()
+            except Exception as e:
+                results.append({'error': str(e)})
+                continue
+            results.append({'faces': []})
+            boxes += [(results[-1], box) for box in image_boxes]
+            crops += image_crops
+        if crops:
+            matches = self.pool.submit(model.predict_batch, crops, k).result()
+            for (result, box), face_matches in zip(boxes, matches):
+                result['faces'].append(face_result(box, face_matches, k, max_distance))
+        return {'model_version': version, 'results': results}
+
+    def health(self):
+        model = self.model
+        return {'model_version': self.model_version, 'samples': len(model) if model is not None else 0,
+                'workers': self.workers}
+
+
+def face_result(box, matches, k, max_distance=MAX_DISTANCE):
+    matches = [(int(label), float(distance)) for label, distance in matches
+               if (label, distance) != NO_MATCH and distance < max_distance]
+    label, distance = matches[0] if matches else (NO_MATCH[0], None)
+    result = {'box': [int(v) for v in box], 'label': label, 'distance': distance}
+    if k > 1:
+        result['matches'] = [list(match) for match in matches]
+    return result
+
+
+def parse_request(body):
+    """(images as bytes, detect, k, max_distance) of a /recognize body"""
+    try:
+        request = json.loads(body)
+        encoded = request['images']
+        detect = bool(request.get('detect', True))
+        k = int(request.get('k', 1))
+        max_distance = float(request.get('max_distance', MAX_DISTANCE))
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        raise RequestError(400, f"Invalid request: {str(e)}")
+    if not isinstance(encoded, list):
+        raise RequestError(400, "images must be a list of base64 strings")
+    if len(encoded) > API_MAX_BATCH:
+        raise RequestError(413, f"At most {API_MAX_BATCH} images per request")
+    if not 1 <= k <= MAX_MATCHES:
+        raise RequestError(400, f"k must be between 1 and {MAX_MATCHES}")
+    try:
+        images = [base64.b64decode(image, validate=True) for image in encoded]
+    except (binascii.Error, TypeError, ValueError) as e:
+        raise RequestError(400, f"Invalid base64 image: {str(e)}")
+    return images, detect, k, max_distance
+
+
+class RecognitionHandler(http.server.BaseHTTPRequestHandler):
+    # Keep-alive, so a client can send many batches over one connection
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send(200, self.server.recognizer.health())
+        else:
+            self._send(404, {'error': f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != '/recognize':
+            self._send(404, {'error': f"Unknown path {self.path}"})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if length > MAX_BODY_BYTES:
+                self.close_connection = True
+                raise RequestError(413, f"Request body larger than {MAX_BODY_BYTES} bytes")
+            images, detect, k, max_distance = parse_request(self.rfile.read(length))
+            self._send(200, self.server.recognizer.recognize(images, detect, k, max_distance))
+        except RequestError as e:
+            self._send(e.status, {'error': str(e)})
+        except Exception as e:
+            _logger.error(f"Failed to recognize batch: {str(e)}")
+            self._send(500, {'error': str(e)})
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Clients of a Unix socket have no address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def log_message(self, format, *args):
+        _logger.debug(f"{self.address_string()} {format % args}")
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        super().server_bind()
+        # Only processes of the same user may connect
+        os.chmod(self.server_address, 0o600)
+
+
+def make_server(recognizer, host=API_HOST, port=API_PORT, socket_path=API_SOCKET):
+    """HTTP server for ``recognizer`` on a Unix socket when ``socket_path`` is set, else on host:port"""
+    if socket_path:
+        server = UnixHTTPServer(socket_path, RecognitionHandler)
+    else:
+        server = http.server.ThreadingHTTPServer((host, port), RecognitionHandler)
+    server.recognizer = recognizer
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local batch face recognition API")
+    parser.add_argument('--host', default=API_HOST)
+    parser.add_argument('--port', type=int, default=API_PORT)
+    parser.add_argument('--socket', default=API_SOCKET, help="listen on this Unix socket instead")
+    parser.add_argument('--workers', type=int, default=RECOGNITION_WORKERS, help="shared workers (0 = one per core)")
+    parser.add_argument('--model', default=os.path.join(TRAINER_DIR, TRAINER_FILE))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    recognizer = BatchRecognizer(args.model, args.workers or None)
+    recognizer.start()
+    if recognizer.model is None:
+        _logger.warning("No trained model yet, requests fail until one is published")
+    server = make_server(recognizer, args.host, args.port, args.socket)
+    # serve_forever returns once shut down from another thread
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    _logger.info(f"Listening on {args.socket or f'http://{args.host}:{args.port}'}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        recognizer.close()
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""Client and load test for the batch recognition API (see ``recognition.batch_api``).
+
+    client = BatchClient()                       # or BatchClient(socket_path='/run/face-recognition.sock')
+    with open('photo.jpg', 'rb') as f:
+        result = client.recognize([f.read()])
+
+Load test: send batches of images from a directory (searched recursively,
+e.g. the dataset) from several concurrent clients and report throughput and
+latency percentiles::
+
+    python -m recognition.batch_client dataset --clients 4 --requests 200 --batch 8 --no-detect
+"""
+import argparse
+import base64
+import glob
+import http.client
+import json
+import os
+import socket
+import threading
+import time
+
+import numpy as np
+
+from config.setting import API_HOST, API_PORT, API_SOCKET
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a Unix socket"""
+
+    def __init__(self, socket_path, timeout=60):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class BatchClient:
+    """Sends requests to the batch recognition API over one kept-alive connection.
+
+    A client is not thread-safe; use one per thread.
+    """
+
+    def __init__(self, host=API_HOST, port=API_PORT, socket_path=API_SOCKET, timeout=60):
+        if socket_path:
+            self.conn = UnixHTTPConnection(socket_path, timeout)
+        else:
+            self.conn = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def _request(self, method, path, payload=None):
+        body = json.dumps(payload).encode('utf-8') if payload is not None else None
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        self.conn.request(method, path, body, headers)
+        response = self.conn.getresponse()
+        result = json.loads(response.read())
+        if response.status != 200:
+            raise RuntimeError(f"{response.status}: {result.get('error')}")
+        return result
+
+    def recognize(self, images, detect=True, k=1, max_distance=None):
+        """Recognize the faces of encoded (JPEG, PNG) images given as bytes.
+
+        ``max_distance`` overrides the server's cutoff for strangers.
+        """
+        encoded = [base64.b64encode(image).decode('ascii') for image in images]
+        payload = {'images': encoded, 'detect': detect, 'k': k}
+        if max_distance is not None:
+            payload['max_distance'] = max_distance
+        return self._request('POST', '/recognize', payload)
+
+    def health(self):
+        return self._request('GET', '/health')
+
+    def close(self):
+        self.conn.close()
+
+
+def load_images(path, limit=1000):
+    """Encoded bytes of up to ``limit`` JPEG/PNG images under ``path``"""
+    paths = sorted(p for p in glob.glob(os.path.join(path, '**', '*'), recursive=True)
+                   if p.lower().endswith(('.jpg', '.jpeg', '.png')))[:limit]
+    images = []
+    for image_path in paths:
+        with open(image_path, 'rb') as f:
+            images.append(f.read())
+    return images
+
+
+def load_test(make_client, images, clients=4, requests=100, batch=8, detect=True):
+    """Send ``requests`` batches from ``clients`` threads; return (latencies in seconds, faces, errors, elapsed)"""
+    latencies, counts = [], {'faces': 0, 'errors': 0}
+    lock = threading.Lock()
+    next_request = iter(range(requests))
+
+    def worker():
+        client = make_client()
+        try:
+            while True:
+                with lock:
+                    i = next(next_request, None)
+                if i is None:
+                    return
+                start = i * batch % len(images)
+                chunk = [images[(start + j) % len(images)] for j in range(batch)]
+                began = time.perf_counter()
+                try:
+                    result = client.recognize(chunk, detect)
+                    faces = sum(len(r.get('faces', [])) for r in result['results'])
+                    errors = sum('error' in r for r in result['results'])
+                except Exception as e:
+                    print(f" [ERROR] {str(e)}")
+                    faces, errors = 0, len(chunk)
+                with lock:
+                    latencies.append(time.perf_counter() - began)
+                    counts['faces'] += faces
+                    counts['errors'] += errors
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(clients)]
+    began = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, counts['faces'], counts['errors'], time.perf_counter() - began
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the batch recognition API")
+    parser.add_argument('images', help="directory of JPEG/PNG images, searched recursively")
+    parser.add_argument('--host', default=API_HOST)
+    parser.add_argument('--port', type=int, default=API_PORT)
+    parser.add_argument('--socket', default=API_SOCKET, help="connect to this Unix socket instead")
+    parser.add_argument('--clients', type=int, default=4, help="concurrent clients")
+    parser.add_argument('--requests', type=int, default=100, help="requests in total")
+    parser.add_argument('--batch', type=int, default=8, help="images per request")
+    parser.add_argument('--no-detect', action='store_true', help="images are face crops")
+    args = parser.parse_args()
+
+    images = load_images(args.images)
+    if not images:
+        raise SystemExit(f" [ERROR] No images under {args.images}")
+
+    def make_client():
+        return BatchClient(args.host, args.port, args.socket)
+
+    client = make_client()
+    print(f" [INFO] Server: {client.health()}")
+    client.close()
+    latencies, faces, errors, elapsed = load_test(make_client, images, args.clients, args.requests,
+                                                  args.batch, not args.no_detect)
+    p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+    print(f" [INFO] {len(latencies)} requests of {args.batch} images in {elapsed:.2f}s: "
+          f"{len(latencies) / elapsed:.1f} requests/s, {len(latencies) * args.batch / elapsed:.1f} images/s, "
+          f"{faces / elapsed:.1f} faces/s, {errors} errors")
+    print(f" [INFO] Latency p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
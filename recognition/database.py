@@ -0,0 +1,437 @@
+"""PostgreSQL access for the attendance system.
+
+``DatabaseManager`` hands out connections from a thread-safe pool instead of
+sharing a single cursor, so queries can run concurrently and off the GUI
+thread. When every connection is busy a query waits up to ``pool_timeout``
+seconds for one. Connections broken by a server restart are discarded and
+the transaction is run again on a fresh one. A transaction whose commit
+failed may have been applied, so it is only run again when it is safe to
+repeat (reads, and writes guarded by NOT EXISTS). Every query method can
+also be run in the background with ``submit``, which returns a
+``concurrent.futures.Future``.
+"""
+import concurrent.futures
+import datetime
+import logging
+import threading
+import time
+import zlib
+
+import numpy as np
+import psycopg2
+import psycopg2.pool
+from psycopg2.extras import execute_values
+
+from config.setting import DB_CONFIG
+from recognition.roster import ClassRoster
+
+_logger = logging.getLogger(__name__)
+
+# Errors that mean the connection is gone, e.g. the server restarted
+TRANSIENT_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+def encode_face_sample(face_img):
+    """Compress a grayscale face crop for the face_data table; return (data, width, height)"""
+    height, width = face_img.shape[:2]
+    return zlib.compress(np.ascontiguousarray(face_img, np.uint8).tobytes(), 6), width, height
+
+
+def decode_face_sample(data, width, height, compression='zlib'):
+    """Inverse of encode_face_sample; rows migrated from hex text have no dimensions"""
+    pixels = zlib.decompress(data) if compression == 'zlib' else data
+    face = np.frombuffer(pixels, np.uint8)
+    return face.reshape(height, width) if width and height else face
+
+
+class DatabaseManager:
+    def __init__(self, config=None, min_connections=1, max_connections=5,
+                 retries=2, retry_delay=0.5, pool_timeout=10.0):
+        self.config = config or DB_CONFIG
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.pool_timeout = pool_timeout
+        # The pool raises instead of waiting when it is exhausted, so callers queue here
+        self._slots = threading.BoundedSemaphore(max_connections)
+        try:
+            self.pool = psycopg2.pool.ThreadedConnectionPool(
+                min_connections, max_connections, **self.config
+            )
+            # Leave one connection for synchronous calls from the GUI thread
+            self.executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=max(1, max_connections - 1), thread_name_prefix='db'
+            )
+            _logger.info("Database connected successfully")
+        except Exception as e:
+            _logger.error(f"Failed to connect to database {str(e)}")
+            raise e
+
+    def connect(self):
+        """Open a new connection outside the pool, for long-lived workers"""
+        return psycopg2.connect(**self.config)
+
+    def close(self):
+        """Safely close the worker threads and every pooled connection"""
+        try:
+            self.executor.shutdown(wait=True)
+            self.pool.closeall()
+            _logger.info("Database connection closed successfully")
+        except Exception as e:
+            _logger.error(f"Error closing database connection: {str(e)}")
+
+    def submit(self, method, *args):
+        """Run a query method (e.g. ``db.get_classes``) on a worker thread and return a Future"""
+        return self.executor.submit(method, *args)
+
+    def _run(self, work, retry=False):
+        """Run ``work(cursor)`` in a transaction.
+
+        If the connection was lost before the commit, nothing was written and
+        the transaction is run again on a fresh connection. If it was lost
+        during the commit, the transaction may have been applied; it is only
+        run again with ``retry``, for work that is safe to repeat.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return self._run_once(work)
+            except TRANSIENT_ERRORS as e:
+                if (getattr(e, 'during_commit', False) and not retry) or attempt == self.retries:
+                    raise
+                _logger.warning(f"Database connection lost, reconnecting: {str(e)}")
+                time.sleep(self.retry_delay * 2 ** attempt)
+
+    def _run_once(self, work):
+        if not self._slots.acquire(timeout=self.pool_timeout):
+            raise psycopg2.pool.PoolError(
+                f"No database connection free after {self.pool_timeout}s, all of them are busy")
+        try:
+            conn = self.pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+        broken = committing = False
+        try:
+            with conn.cursor() as cur:
+                result = work(cur)
+            committing = True
+            conn.commit()
+            return result
+        except TRANSIENT_ERRORS as e:
+            broken = True
+            e.during_commit = committing
+            raise
+        except Exception:
+            try:
+                conn.rollback()
+            except psycopg2.Error as e:
+                _logger.warning(f"Rollback failed, discarding the connection: {str(e)}")
+                broken = True
+            raise
+        finally:
+            # The connection always goes back, closed if it cannot be reused
+            self.pool.putconn(conn, close=broken or bool(conn.closed))
+            self._slots.release()
+
+    def add_user(self, full_name, email, role, class_id = None):
+        try:
+            _logger.info(f"Attempting to add user: {full_name}, {email}, {role}")
+            if role not in ['Học sinh', 'Giáo viên', 'Quản trị viên']:
+                raise ValueError("Invalid role. Must be 'student', 'Giáo viên', or 'Quản trị viên'")
+
+            def work(cur):
+                cur.execute(
+                    "INSERT INTO users (full_name, email, role) VALUES (%s, %s, %s) RETURNING user_id",
+                    (full_name, email, role)
+                )
+                user_id = cur.fetchone()[0]
+
+                # If user is a student and class_id is provided, register them to the class
+                if role == 'Học sinh' and class_id is not None:
+                    cur.execute(
+                        "INSERT INTO class_students (class_id, student_id) VALUES (%s, %s)",
+                        (class_id, user_id)
+                    )
+                return user_id
+
+            user_id = self._run(work)
+            _logger.info(f"User added successfully with ID: {user_id}")
+            return user_id
+        except psycopg2.errors.UniqueViolation:
+            _logger.error(f"Email {email} already exists")
+            raise ValueError(f"Email {email} already exists")
+        except Exception as e:
+            _logger.error(f"Failed to add user: {str(e)}")
+            raise e
+
+    def delete_users(self, user_ids):
+        """Delete users with their registrations, face samples and attendance (ON DELETE CASCADE)"""
+        try:
+            _logger.info(f"Deleting users: {list(user_ids)}")
+            self._run(lambda cur: cur.execute(
+                "DELETE FROM users WHERE user_id = ANY(%s)", (list(user_ids),)
+            ), retry=True)
+        except Exception as e:
+            _logger.error(f"Failed to delete users: {str(e)}")
+            raise e
+
+    def is_student_registered(self, class_id, student_id):
+        """Check if a student is registered for a specific class"""
+        def work(cur):
+            cur.execute("""
+                SELECT 1 FROM class_students
+                WHERE class_id = %s AND student_id = %s
+            """, (class_id, student_id))
+            return bool(cur.fetchone())
+
+        try:
+            return self._run(work, retry=True)
+        except Exception as e:
+            _logger.error(f"Failed to check student registration: {str(e)}")
+            raise e
+
+    def save_face_samples(self, user_id, samples):
+        """Store (face image, image path) samples of one user in a single transaction"""
+        rows = []
+        for face_img, image_path in samples:
+            data, width, height = encode_face_sample(face_img)
+            rows.append((user_id, psycopg2.Binary(data), width, height, 'zlib', image_path))
+
+        try:
+            _logger.info(f"Saving {len(rows)} face samples for user: {user_id}")
+            self._run(lambda cur: execute_values(
+                cur,
+                "INSERT INTO face_data (user_id, face_encoding, width, height, compression, image_path) VALUES %s",
+                rows
+            ))
+        except Exception as e:
+            _logger.error(f"Failed to save face data: {str(e)}")
+            raise e
+
+    def get_face_samples(self, user_id):
+        """Return the stored face samples of a user as grayscale arrays"""
+        def work(cur):
+            cur.execute("""
+                SELECT face_encoding, width, height, compression FROM face_data
+                WHERE user_id = %s ORDER BY face_id
+            """, (user_id,))
+            return [decode_face_sample(bytes(data), width, height, compression)
+                    for data, width, height, compression in cur.fetchall()]
+
+        try:
+            return self._run(work, retry=True)
+        except Exception as e:
+            _logger.error(f"Failed to fetch face data: {str(e)}")
+            raise e
+
+    def record_attendance(self, class_id, student_id, status, confidence_score):
+        try:
+            _logger.info(f"Recording attendance: class_id: {class_id}, student_id: {student_id}, status: {status}, + {confidence_score}")
+            # Đảm bảo confidence_score nằm trong khoảng hợp lệ
+            confidence_score = max(0, min(100, confidence_score))  # Giới hạn giá trị từ 0 đến 100
+
+            current_date = datetime.date.today()
+            current_time = datetime.datetime.now().time()
+
+            # Only insert if no attendance record exists for today, in a single round-trip
+            self._run(lambda cur: cur.execute(
+                """INSERT INTO attendance
+                   (class_id, student_id, attendance_date, check_in_time, status, confidence_score)
+                   SELECT %s, %s, %s, %s, %s, %s
+                   WHERE NOT EXISTS (
+                       SELECT 1 FROM attendance
+                       WHERE class_id = %s AND student_id = %s AND attendance_date = %s
+                   )""",
+                (class_id, student_id, current_date, current_time, status, confidence_score,
+                 class_id, student_id, current_date)
+            ), retry=True)
+        except Exception as e:
+            _logger.error(f"Failed to record attendence: {str(e)}")
+            raise e
+
+    def load_class_roster(self, class_id):
+        """Load the students of a class and today's recorded attendance into a ClassRoster"""
+        current_date = datetime.date.today()
+
+        def work(cur):
+            cur.execute("""
+                SELECT u.user_id, u.full_name
+                FROM users u
+                JOIN class_students cs ON u.user_id = cs.student_id
+                WHERE cs.class_id = %s
+            """, (class_id,))
+            students = cur.fetchall()
+            cur.execute("""
+                SELECT DISTINCT student_id FROM attendance
+                WHERE class_id = %s AND attendance_date = %s
+            """, (class_id, current_date))
+            recorded = [row[0] for row in cur.fetchall()]
+            return ClassRoster(class_id, students, recorded, current_date)
+
+        try:
+            _logger.info(f"Loading roster for class: {class_id}")
+            return self._run(work, retry=True)
+        except Exception as e:
+            _logger.error(f"Failed to load class roster: {str(e)}")
+            raise e
+
+    def add_class(self, class_name, teacher_id, semester):
+        def work(cur):
+            cur.execute(
+                "INSERT INTO classes (class_name, teacher_id, semester) VALUES (%s, %s, %s) RETURNING class_id",
+                (class_name, teacher_id, semester)
+            )
+            return cur.fetchone()[0]
+
+        try:
+            _logger.info(f"Adding class: {class_name}, {teacher_id}")
+            return self._run(work)
+        except Exception as e:
+            _logger.error(f"Failed to add class: {str(e)}")
+            raise e
+
+    def delete_class(self, class_id):
+        """Delete a class with its registrations and attendance (ON DELETE CASCADE)"""
+        try:
+            _logger.info(f"Deleting class: {class_id}")
+            self._run(lambda cur: cur.execute(
+                "DELETE FROM classes WHERE class_id = %s", (class_id,)
+            ), retry=True)
+        except Exception as e:
+            _logger.error(f"Failed to delete class: {str(e)}")
+            raise e
+
+    def get_classes(self):
+        def work(cur):
+            cur.execute("SELECT class_id, class_name FROM classes")
+            return cur.fetchall()
+
+        try:
+            _logger.info("Fetching classes")
+            return self._run(work, retry=True)
+        except Exception as e:
+            _logger.error(f"Failed to fetch classes: {str(e)}")
+            raise e
+
+    def get_teachers(self):
+        def work(cur):
+            cur.execute("SELECT user_id, full_name FROM users WHERE role = 'Giáo viên'")
+            return cur.fetchall()
+
+        return self._run(work, retry=True)
+
+    def register_student_to_class(self, class_id, student_id):
+        try:
+            self._run(lambda cur: cur.execute(
+                "INSERT INTO class_students (class_id, student_id) VALUES (%s, %s)",
+                (class_id, student_id)
+            ))
+        except psycopg2.errors.UniqueViolation:
+            raise ValueError("Học sinh đã được đăng ký trong lớp này!")
+
+    def get_attendance_by_date(self, class_id, date):
+        def work(cur):
+            cur.execute("""
+                SELECT u.full_name, a.check_in_time, a.status, a.confidence_score
+                FROM attendance a
+                JOIN users u ON a.student_id = u.user_id
+                WHERE a.class_id = %s AND a.attendance_date = %s
+                ORDER BY a.check_in_time
+            """, (class_id, date))
+            return cur.fetchall()
+
+        try:
+            _logger.info(f"Fetching attendance for class: {class_id}, date: {date}")
+            return self._run(work, retry=True)
+        except Exception as e:
+            _logger.error(f"Không thể lấy dữ liệu điểm danh: {str(e)}")
+            raise e
+
+    def get_students_by_class(self, class_id):
+        def work(cur):
+            cur.execute("""
+                SELECT u.user_id, u.full_name, u.email,
+                    COALESCE(
+                        (SELECT status
+                        FROM attendance
+                        WHERE student_id = u.user_id
+                        AND class_id = %s
+                        AND attendance_date = CURRENT_DATE
+                        ORDER BY check_in_time DESC
+                        LIMIT 1),
+                        'Vắng'
+                    ) as attendance_status
+                FROM users u
+                JOIN class_students cs ON u.user_id = cs.student_id
+                WHERE cs.class_id = %s
+                ORDER BY u.full_name
+            """, (class_id, class_id))
+            return cur.fetchall()
+
+        try:
+            return self._run(work, retry=True)
+        except Exception as e:
+            _logger.error(f"Failed to fetch students: {str(e)}")
+            raise e
+
+    def get_manual_attendance(self, class_id, date):
+        """Students of a class with their attendance status and note for a given date"""
+        def work(cur):
+            cur.execute("""
+                SELECT u.user_id, u.full_name, u.email,
+                    COALESCE(
+                        (SELECT status
+                        FROM attendance
+                        WHERE student_id = u.user_id
+                        AND class_id = %s
+                        AND attendance_date = %s
+                        ORDER BY check_in_time DESC
+                        LIMIT 1),
+                        'Vắng'
+                    ) as attendance_status,
+                    COALESCE(
+                        (SELECT note
+                        FROM attendance
+                        WHERE student_id = u.user_id
+                        AND class_id = %s
+                        AND attendance_date = %s
+                        ORDER BY check_in_time DESC
+                        LIMIT 1),
+                        ''
+                    ) as note
+                FROM users u
+                JOIN class_students cs ON u.user_id = cs.student_id
+                WHERE cs.class_id = %s
+                ORDER BY u.full_name
+            """, (class_id, date, class_id, date, class_id))
+            return cur.fetchall()
+
+        try:
+            return self._run(work, retry=True)
+        except Exception as e:
+            _logger.error(f"Failed to fetch manual attendance: {str(e)}")
+            raise e
+
+    def save_manual_attendance(self, class_id, date, records):
+        """Replace a class's attendance for a date with (student_id, status, note) records"""
+        current_time = datetime.datetime.now().time()
+
+        def work(cur):
+            # Delete existing attendance records for this class and date
+            cur.execute("""
+                DELETE FROM attendance
+                WHERE class_id = %s AND attendance_date = %s
+            """, (class_id, date))
+
+            # Insert new attendance records
+            for student_id, status, note in records:
+                cur.execute("""
+                    INSERT INTO attendance (class_id, student_id, attendance_date, status, note, check_in_time)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                """, (class_id, student_id, date, status, note, current_time))
+
+        try:
+            _logger.info(f"Saving manual attendance for class: {class_id}, date: {date}")
+            self._run(work)
+        except Exception as e:
+            _logger.error(f"Failed to save manual attendance: {str(e)}")
+            raise e
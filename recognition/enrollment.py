@@ -0,0 +1,85 @@
+"""Face enrollment as a mode of the recognition pipeline.
+
+Enrollment shares the camera and the worker threads of the running
+``RecognitionPipeline`` instead of opening the camera on the GUI thread.
+An ``EnrollmentSession`` handed to ``RecognitionPipeline.set_enrollment``
+receives the detected faces of every frame and keeps the largest one (the
+person in front of the camera rather than someone passing behind them) in
+memory. Nothing is written while capturing: once the session is done,
+``save_samples`` writes all samples to the dataset in one go.
+"""
+import logging
+import os
+import threading
+
+import cv2
+
+from recognition.packed_dataset import PackedDataset
+from recognition.training import USER_DIR_PREFIX
+
+_logger = logging.getLogger(__name__)
+
+
+class EnrollmentSession:
+    """Collects ``required`` face samples of one user from pipeline frames.
+
+    ``on_progress(count, required)`` is called from the pipeline after every
+    sample and ``on_complete(session)`` once, when enough samples were taken
+    or ``finish`` was called.
+    """
+
+    def __init__(self, user_id, required, on_progress=None, on_complete=None):
+        self.user_id = user_id
+        self.required = required
+        self.on_progress = on_progress
+        self.on_complete = on_complete
+        self.samples = []
+        self.done = False
+        self._lock = threading.Lock()
+
+    def add(self, gray, faces):
+        """Take the largest of the detected faces of a grayscale frame"""
+        if not len(faces):
+            return
+        x, y, w, h = max(faces, key=lambda box: box[2] * box[3])
+        with self._lock:
+            if self.done:
+                return
+            # Copied so the buffered sample does not keep the whole frame alive
+            self.samples.append(gray[y:y+h, x:x+w].copy())
+            count = len(self.samples)
+        if self.on_progress:
+            self.on_progress(count, self.required)
+        if count >= self.required:
+            self.finish()
+
+    def finish(self):
+        """Stop collecting and report the samples taken so far"""
+        with self._lock:
+            if self.done:
+                return
+            self.done = True
+        _logger.info(f"Enrollment of user {self.user_id} finished with {len(self.samples)} samples")
+        if self.on_complete:
+            self.on_complete(self)
+
+
+def save_samples(user_id, faces, dataset_dir, packed_dir=None):
+    """Write the face samples of a user to the dataset in one go.
+
+    With ``packed_dir`` they are appended to the packed dataset, otherwise
+    written as ``<dataset_dir>/User_<id>/<n>.jpg``. Returns the
+    (face, image path) pairs for ``DatabaseManager.save_face_samples``.
+    """
+    if packed_dir:
+        PackedDataset(packed_dir).append(user_id, faces)
+        return [(face, None) for face in faces]
+
+    user_path = os.path.join(dataset_dir, f"{USER_DIR_PREFIX}{user_id}")
+    os.makedirs(user_path, exist_ok=True)
+    samples = []
+    for count, face in enumerate(faces, 1):
+        image_path = os.path.join(user_path, f"{count}.jpg")
+        cv2.imwrite(image_path, face)
+        samples.append((face, image_path))
+    return samples
@@ -0,0 +1,191 @@
+"""Cache of normalized face crops and their LBP histograms, kept with the dataset.
+
+Training a directory dataset used to decode every JPEG and recompute its
+LBP histogram on every full retrain. The cache stores, per image content
+hash, the crop normalized to the dataset face size and its histogram, in
+append-only files next to the samples::
+
+    dataset/
+        .features/
+            meta.json           face size and LBPH parameters
+            keys.bin            16-byte BLAKE2 digest of the image file, one per row
+            crops.u8            (rows, height, width) uint8
+            histograms.f4       (rows, bins) float32
+
+A retrain reads the image files only to hash them; images whose content was
+seen before (even under another name) are not decoded again and their
+histograms are read from the memory-mapped cache. Only new or changed
+images are decoded, normalized and turned into histograms. As in
+``recognition.packed_dataset`` the key of a row is written after its data,
+so an interrupted write never leaves a row that looks complete.
+
+The cache is dropped and rebuilt when the face size or the LBPH parameters
+it was built with change.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+
+from config.setting import FACE_SIZE
+from recognition.lbph_model import LBPHModel
+from recognition.preprocess import normalize_face
+
+_logger = logging.getLogger(__name__)
+
+FEATURE_CACHE_DIR = '.features'
+KEY_BYTES = 16
+# Crops turned into histograms per step
+FEATURE_BATCH_SIZE = 100
+
+
+def content_key(data):
+    return hashlib.blake2b(data, digest_size=KEY_BYTES).digest()
+
+
+def cache_dir(dataset_dir):
+    return os.path.join(dataset_dir, FEATURE_CACHE_DIR)
+
+
+class FeatureCache:
+    """Append-only store of (normalized crop, LBP histogram) rows keyed by content hash"""
+
+    def __init__(self, root, face_size=FACE_SIZE, model=None):
+        self.root = root
+        self.face_size = tuple(face_size)
+        # Empty model carrying the LBPH parameters the histograms are computed with
+        self.model = model or LBPHModel(np.zeros((0, 0), np.float32), np.zeros(0, np.int32),
+                                        face_size=self.face_size)
+        meta = {'face_size': list(self.face_size), 'params': self.model.params()}
+        meta_path = os.path.join(root, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding='utf-8') as f:
+                stored = json.load(f)
+            if stored != meta:
+                _logger.info(f"Feature cache {root} was built with {stored}, rebuilding it")
+                shutil.rmtree(root)
+        if not os.path.exists(meta_path):
+            os.makedirs(root, exist_ok=True)
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+
+        self.keys_path = os.path.join(root, 'keys.bin')
+        self.crops_path = os.path.join(root, 'crops.u8')
+        self.histograms_path = os.path.join(root, 'histograms.f4')
+        self.rows = {}
+        self._count = 0
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path, 'rb') as f:
+                keys = f.read()
+            self._count = len(keys) // KEY_BYTES
+            for row in range(self._count):
+                self.rows.setdefault(keys[row * KEY_BYTES:(row + 1) * KEY_BYTES], row)
+        # Drop data of a write that crashed before its keys were written
+        for path, row_bytes in ((self.crops_path, self.crop_bytes), (self.histograms_path, self.histogram_bytes)):
+            if os.path.exists(path) and os.path.getsize(path) > self._count * row_bytes:
+                os.truncate(path, self._count * row_bytes)
+
+    @property
+    def crop_bytes(self):
+        return self.face_size[0] * self.face_size[1]
+
+    @property
+    def histogram_bytes(self):
+        return self.model.bins * 4
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    def add(self, keys, crops):
+        """Normalize crops, compute their histograms and append them; return their rows"""
+        crops = [normalize_face(crop, self.face_size) for crop in crops]
+        histograms = self.model.histograms_of(crops)
+        with open(self.crops_path, 'ab') as f:
+            for crop in crops:
+                f.write(np.ascontiguousarray(crop, np.uint8).tobytes())
+        with open(self.histograms_path, 'ab') as f:
+            f.write(histograms.tobytes())
+        with open(self.keys_path, 'ab') as f:
+            f.write(b''.join(keys))
+        rows = list(range(self._count, self._count + len(keys)))
+        for key, row in zip(keys, rows):
+            self.rows.setdefault(key, row)
+        self._count += len(keys)
+        return rows
+
+    def histograms(self, rows):
+        """(len(rows), bins) float32 histograms of cached rows"""
+        if not len(rows):
+            return np.zeros((0, self.model.bins), np.float32)
+        stored = np.memmap(self.histograms_path, np.float32, 'r', shape=(self._count, self.model.bins))
+        return np.asarray(stored[np.asarray(rows)])
+
+    def crops(self, rows):
+        """(len(rows), height, width) uint8 normalized crops of cached rows"""
+        width, height = self.face_size
+        if not len(rows):
+            return np.zeros((0, height, width), np.uint8)
+        stored = np.memmap(self.crops_path, np.uint8, 'r', shape=(self._count, height, width))
+        return np.asarray(stored[np.asarray(rows)])
+
+
+def cached_features(cache, labeled_paths, processes=None, progress=None):
+    """Histograms of (label, path) samples, computing only those missing from the cache.
+
+    Returns (histograms, labels, set of paths that were read). ``progress``
+    is called as in ``recognition.training.train_streaming``: images are
+    loaded when hashed, and their histograms are ready when found in the
+    cache or once computed.
+    """
+    from recognition.training import PROGRESS_EVERY, STAGE_HISTOGRAMS, STAGE_LOAD, iter_images
+
+    total = len(labeled_paths)
+    keys = {}
+    for done, (_, path) in enumerate(labeled_paths, 1):
+        try:
+            with open(path, 'rb') as f:
+                keys[path] = content_key(f.read())
+        except OSError as e:
+            _logger.warning(f"Error processing image {path}: {str(e)}")
+        if progress and (done % PROGRESS_EVERY == 0 or done == total):
+            progress(STAGE_LOAD, done, total)
+
+    missing = list({keys[path]: path for _, path in labeled_paths if path in keys and keys[path] not in cache}.values())
+    ready = total - len(missing)
+    if progress:
+        progress(STAGE_HISTOGRAMS, ready, total)
+    if missing:
+        _logger.info(f"Computing features of {len(missing)} new images, {ready} cached")
+    batch_keys, batch_crops = [], []
+
+    def flush():
+        nonlocal ready
+        if batch_keys:
+            cache.add(batch_keys, batch_crops)
+            ready += len(batch_keys)
+            batch_keys.clear()
+            batch_crops.clear()
+            if progress:
+                progress(STAGE_HISTOGRAMS, ready, total)
+
+    for path, crops in iter_images(missing, processes=processes):
+        if not crops:
+            _logger.warning(f"Error processing image {path}")
+            keys.pop(path)
+            continue
+        batch_keys.append(keys[path])
+        batch_crops.append(crops[0])
+        if len(batch_keys) >= FEATURE_BATCH_SIZE:
+            flush()
+    flush()
+
+    loaded = [(label, path) for label, path in labeled_paths if keys.get(path) in cache]
+    rows = [cache.rows[keys[path]] for _, path in loaded]
+    labels = np.array([label for label, _ in loaded], np.int32)
+    return cache.histograms(rows), labels, {path for _, path in loaded}
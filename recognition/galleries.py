@@ -0,0 +1,68 @@
+"""Class-scoped recognition galleries.
+
+Only the students of the class in session can be in the room, so recognition
+searches the samples of those students instead of every enrolled user. That
+makes prediction cost depend on the class size and rules out matches with
+students of other classes.
+
+Sub-galleries share the histograms of the full model (see
+``LBPHModel.subset``) and are cached per class. A cached gallery is rebuilt
+when the class membership it was built for changes.
+
+When the model is searched through its approximate index
+(FACE_ANN_INDEX=1, see ``recognition.ann_index``), a class with at least
+``index_min_samples`` samples gets the part of the index covering its
+students; smaller classes are searched exactly, which is as fast there.
+"""
+import collections
+import logging
+import threading
+
+from config.setting import ANN_CLASS_MIN_SAMPLES
+
+_logger = logging.getLogger(__name__)
+
+# Classes whose galleries are kept, least recently used are dropped first
+MAX_CLASSES = 8
+
+
+class ClassGalleries:
+    """Per-class sub-galleries of one model (an ``LBPHModel`` or ``IndexedRecognizer``)"""
+
+    def __init__(self, model, max_classes=MAX_CLASSES, index_min_samples=ANN_CLASS_MIN_SAMPLES):
+        self.model = model
+        # Small classes skip the index wrapper and search the model itself
+        self.base = getattr(model, 'model', model)
+        self.max_classes = max_classes
+        self.index_min_samples = index_min_samples
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, class_id, student_ids):
+        """Gallery of the given students of a class, cached while the membership stays the same"""
+        members = frozenset(student_ids)
+        with self._lock:
+            cached = self._cache.get(class_id)
+            if cached and cached[0] == members:
+                self._cache.move_to_end(class_id)
+                return cached[1]
+
+        gallery = self.base.subset(members)
+        if self.model is not self.base and len(gallery) >= self.index_min_samples:
+            gallery = self.model.subset(members)
+        _logger.info(f"Built gallery of class {class_id}: {len(gallery)} samples of {len(members)} students"
+                     f"{', indexed' if hasattr(gallery, 'index') else ''}")
+        with self._lock:
+            self._cache[class_id] = (members, gallery)
+            self._cache.move_to_end(class_id)
+            while len(self._cache) > self.max_classes:
+                self._cache.popitem(last=False)
+        return gallery
+
+    def invalidate(self, class_id=None):
+        """Drop the gallery of one class, or of every class"""
+        with self._lock:
+            if class_id is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(class_id, None)
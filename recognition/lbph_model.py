@@ -0,0 +1,470 @@
+"""Binary LBPH model file.
+
+``trainer.yml`` is OpenCV's YAML dump of every training histogram, which
+takes tens of seconds to parse once a few thousand samples are enrolled.
+The binary format stores the same data as contiguous arrays::
+
+    magic       b'LBPHMDL1'
+    header      uint32 length + JSON: LBPH parameters, dtype, row count, face size
+    histograms  (rows, bins) float32 or float16, 64-byte aligned
+    labels      (rows,) int32
+    roots       (rows, bins) float32 square roots of the histograms, 64-byte aligned
+    sums        (rows,) float32 row sums of the histograms
+
+Loading memory-maps all arrays, so opening a model takes milliseconds
+regardless of its size. The roots and sums are the search cache of
+``predict_batch`` (see ``chi2_lower_bounds``); storing them makes the file
+about twice as large (three times with float16 histograms), but keeps them
+out of RAM. Files written before they were stored still load and are
+bounded chunk by chunk instead; saving such a model again adds them. ``LBPHModel.predict`` mirrors
+``LBPHFaceRecognizer.predict`` (same LBP codes, spatial histograms and
+chi-square distance), so the model is a drop-in replacement for the OpenCV
+recognizer at recognition time. ``LBPHModel.predict_batch`` handles all
+faces of a frame in one pass and returns the top-k labels of each. Training
+still uses OpenCV and converts its histograms with
+``LBPHModel.from_recognizer``.
+
+Convert an existing model with::
+
+    python -m recognition.lbph_model import trainer/trainer.yml trainer/trainer.lbph
+"""
+import argparse
+import json
+import os
+import struct
+import sys
+
+import cv2
+import numpy as np
+
+MAGIC = b'LBPHMDL1'
+ALIGNMENT = 64
+DTYPES = ('float32', 'float16')
+# Returned by predict when no sample is under the threshold, like OpenCV
+NO_MATCH = (-1, sys.float_info.max)
+# Gallery rows converted per step, bounds the temporary arrays
+CHUNK_ROWS = 512
+# Taken off the chi-square lower bounds to absorb float32 rounding in the matrix product
+BOUND_TOLERANCE = 1e-3
+
+
+def lbp_image(gray, radius=1, neighbors=8):
+    """Extended (circular) LBP codes of a grayscale image, as computed by OpenCV.
+
+    ``gray`` may also be a (count, height, width) stack of equally sized images.
+    """
+    src = np.asarray(gray, np.float32)
+    rows, cols = src.shape[-2:]
+    center = src[..., radius:rows - radius, radius:cols - radius]
+    codes = np.zeros(center.shape, np.int32)
+    eps = np.finfo(np.float32).eps
+    for n in range(neighbors):
+        x = np.float32(radius * np.cos(2.0 * np.pi * n / neighbors))
+        y = np.float32(-radius * np.sin(2.0 * np.pi * n / neighbors))
+        fx, fy = int(np.floor(x)), int(np.floor(y))
+        cx, cy = int(np.ceil(x)), int(np.ceil(y))
+        tx, ty = x - fx, y - fy
+        weights = ((1 - tx) * (1 - ty), tx * (1 - ty), (1 - tx) * ty, tx * ty)
+        offsets = ((fy, fx), (fy, cx), (cy, fx), (cy, cx))
+        t = sum(np.float32(w) * src[..., radius + dy:rows - radius + dy, radius + dx:cols - radius + dx]
+                for w, (dy, dx) in zip(weights, offsets))
+        codes |= ((t > center) | (np.abs(t - center) < eps)).astype(np.int32) << n
+    return codes
+
+
+def spatial_histogram(codes, bins, grid_x=8, grid_y=8):
+    """Concatenated, normalized per-cell histograms of an LBP image or a stack of them"""
+    single = codes.ndim == 2
+    codes = codes[None] if single else codes
+    count = len(codes)
+    height, width = codes.shape[1] // grid_y, codes.shape[2] // grid_x
+    cells = codes[:, :grid_y * height, :grid_x * width].reshape(count, grid_y, height, grid_x, width)
+    cells = cells.transpose(0, 1, 3, 2, 4).reshape(count * grid_y * grid_x, height * width)
+    # One bincount over all cells of all images, each shifted into its own range of bins
+    shifted = cells + (np.arange(len(cells), dtype=np.int32) * bins)[:, None]
+    hist = np.bincount(shifted.ravel(), minlength=len(cells) * bins).astype(np.float32)
+    hist = hist.reshape(count, grid_y * grid_x * bins) / np.float32(max(height * width, 1))
+    return hist[0] if single else hist
+
+
+def chi2_distance(a, b):
+    """Chi-square distance used by ``LBPHFaceRecognizer.predict``"""
+    return cv2.compareHist(a, b, cv2.HISTCMP_CHISQR_ALT)
+
+
+def chi2_lower_bounds(roots, sums, queries):
+    """Lower bounds of the chi-square distance of each query to each gallery histogram.
+
+    (g - q)^2 / (g + q) = (sqrt(g) - sqrt(q))^2 * (sqrt(g) + sqrt(q))^2 / (g + q)
+    and the last factor is between 1 and 2, so the distance is at least
+    2 * sum((sqrt(g) - sqrt(q))^2) = 2 * (sum(g) + sum(q)) - 4 * sqrt(g).sqrt(q).
+    That is one matrix product for all queries against the whole gallery
+    (``roots`` holds the square roots of the gallery, ``sums`` its row sums).
+    Returns a (queries, gallery rows) array.
+    """
+    queries = np.asarray(queries, np.float32)
+    bounds = roots @ np.sqrt(queries).T
+    bounds *= -4
+    bounds += 2 * (sums[:, None] + queries.sum(axis=1)) - BOUND_TOLERANCE
+    return np.maximum(bounds.T, 0)
+
+
+def _aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+class RowSubset:
+    """Read-only view of some rows of a (memory-mapped) histogram array.
+
+    Rows are only read from the underlying array when they are accessed.
+    """
+
+    def __init__(self, array, rows):
+        self.array = array
+        self.rows = rows
+
+    @property
+    def shape(self):
+        return (len(self.rows),) + self.array.shape[1:]
+
+    @property
+    def dtype(self):
+        return self.array.dtype
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, key):
+        return self.array[self.rows[key]]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.array[self.rows], dtype)
+
+
+class RowConcat:
+    """Read-only view of the rows of two arrays, one after the other.
+
+    Rows are only read from the underlying arrays when they are accessed.
+    """
+
+    def __init__(self, first, second):
+        self.first = first
+        self.second = second
+
+    @property
+    def shape(self):
+        return (len(self),) + self.first.shape[1:]
+
+    @property
+    def dtype(self):
+        return np.result_type(self.first.dtype, self.second.dtype)
+
+    def __len__(self):
+        return len(self.first) + len(self.second)
+
+    def __getitem__(self, key):
+        split = len(self.first)
+        if isinstance(key, slice) and key.step in (None, 1):
+            start, stop, _ = key.indices(len(self))
+            return np.concatenate([np.asarray(self.first[start:max(min(stop, split), start)], self.dtype),
+                                   np.asarray(self.second[max(start - split, 0):max(stop - split, 0)], self.dtype)])
+        rows = np.arange(len(self))[key]
+        if np.ndim(rows) == 0:
+            return self.first[rows] if rows < split else self.second[rows - split]
+        return np.array([self[int(row)] for row in rows], self.dtype).reshape((len(rows),) + self.shape[1:])
+
+    def __array__(self, dtype=None, copy=None):
+        return np.concatenate([np.asarray(self.first, self.dtype), np.asarray(self.second, self.dtype)]).astype(
+            dtype or self.dtype, copy=False)
+
+
+class LBPHModel:
+    """Training histograms and labels of an LBPH face recognizer"""
+
+    def __init__(self, histograms, labels, radius=1, neighbors=8, grid_x=8, grid_y=8,
+                 threshold=None, face_size=None, roots=None, sums=None):
+        self.histograms = histograms
+        self.labels = labels
+        self.radius = radius
+        self.neighbors = neighbors
+        self.grid_x = grid_x
+        self.grid_y = grid_y
+        self.threshold = threshold
+        self.face_size = tuple(face_size) if face_size else None
+        # Stored square roots and row sums of the histograms, when the model file has them
+        self.roots = roots
+        self.sums = sums
+        self._roots = None
+        self._sums = None
+
+    def __len__(self):
+        return len(self.labels)
+
+    @property
+    def bins(self):
+        return 2 ** self.neighbors * self.grid_x * self.grid_y
+
+    def params(self):
+        return {
+            'radius': self.radius, 'neighbors': self.neighbors,
+            'grid_x': self.grid_x, 'grid_y': self.grid_y,
+            'threshold': self.threshold,
+            'face_size': list(self.face_size) if self.face_size else None,
+        }
+
+    @classmethod
+    def from_recognizer(cls, recognizer, face_size=None):
+        """Copy the histograms of a trained ``cv2.face.LBPHFaceRecognizer``"""
+        neighbors, grid_x, grid_y = recognizer.getNeighbors(), recognizer.getGridX(), recognizer.getGridY()
+        histograms = recognizer.getHistograms()
+        if histograms:
+            histograms = np.vstack([h.reshape(1, -1) for h in histograms]).astype(np.float32, copy=False)
+        else:
+            histograms = np.zeros((0, 2 ** neighbors * grid_x * grid_y), np.float32)
+        threshold = recognizer.getThreshold()
+        return cls(histograms, np.asarray(recognizer.getLabels(), np.int32).ravel(),
+                   recognizer.getRadius(), neighbors, grid_x, grid_y,
+                   None if threshold >= sys.float_info.max else threshold, face_size)
+
+    @classmethod
+    def import_yaml(cls, path, face_size=None):
+        """Read a model written by ``LBPHFaceRecognizer.write`` (e.g. trainer.yml)"""
+        recognizer = cv2.face.LBPHFaceRecognizer_create()
+        recognizer.read(path)
+        return cls.from_recognizer(recognizer, face_size)
+
+    def export_yaml(self, path):
+        """Write the model in the YAML format read by ``LBPHFaceRecognizer.read``"""
+        threshold = sys.float_info.max if self.threshold is None else self.threshold
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("%YAML:1.0\n---\nopencv_lbphfaces:\n")
+            f.write(f"   threshold: {threshold!r}\n   radius: {self.radius}\n   neighbors: {self.neighbors}\n"
+                    f"   grid_x: {self.grid_x}\n   grid_y: {self.grid_y}\n   histograms:\n")
+            for row in self.histograms:
+                data = ', '.join(f'{v:.9g}' for v in np.asarray(row, np.float32))
+                f.write(f"      - !!opencv-matrix\n         rows: 1\n         cols: {len(row)}\n"
+                        f"         dt: f\n         data: [ {data} ]\n")
+            labels = ', '.join(str(int(label)) for label in self.labels)
+            f.write(f"   labels: !!opencv-matrix\n      rows: {len(self)}\n      cols: 1\n"
+                    f"      dt: i\n      data: [ {labels} ]\n   labelsInfo: []\n")
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Open a binary model; the arrays are memory-mapped unless ``mmap`` is false"""
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a binary LBPH model")
+            header_len, = struct.unpack('<I', f.read(4))
+            header = json.loads(f.read(header_len).decode('utf-8'))
+        rows, bins, dtype = header['rows'], header['bins'], np.dtype(header['dtype'])
+        # Models written before the search cache was stored have no roots
+        arrays = [('histograms', dtype, (rows, bins)), ('labels', '<i4', (rows,))]
+        if 'roots_offset' in header:
+            arrays += [('roots', '<f4', (rows, bins)), ('sums', '<f4', (rows,))]
+        loaded = {}
+        if rows == 0:
+            loaded.update(histograms=np.zeros((0, bins), dtype), labels=np.zeros(0, np.int32))
+        elif mmap:
+            for name, array_dtype, shape in arrays:
+                loaded[name] = np.memmap(path, array_dtype, 'r', offset=header[f'{name}_offset'], shape=shape)
+        else:
+            with open(path, 'rb') as f:
+                for name, array_dtype, shape in arrays:
+                    f.seek(header[f'{name}_offset'])
+                    loaded[name] = np.fromfile(f, array_dtype, int(np.prod(shape))).reshape(shape)
+        params = {key: header[key] for key in ('radius', 'neighbors', 'grid_x', 'grid_y', 'threshold', 'face_size')}
+        return cls(loaded['histograms'], loaded['labels'], **params,
+                   roots=loaded.get('roots'), sums=loaded.get('sums'))
+
+    def save(self, path, dtype=None):
+        """Write the binary model, replacing ``path`` atomically"""
+        dtype = np.dtype(dtype or (self.histograms.dtype if self.histograms.dtype.name in DTYPES else 'float32'))
+        rows = len(self)
+        header = dict(self.params(), rows=rows, bins=self.bins, dtype=dtype.newbyteorder('<').str)
+        # Offsets depend on the header length, so size the header with placeholders first
+        header.update(histograms_offset=0, labels_offset=0, roots_offset=0, sums_offset=0)
+        start = len(MAGIC) + 4 + len(json.dumps(header)) + 64
+        header['histograms_offset'] = _aligned(start)
+        header['labels_offset'] = _aligned(header['histograms_offset'] + rows * self.bins * dtype.itemsize)
+        header['roots_offset'] = _aligned(header['labels_offset'] + rows * 4)
+        header['sums_offset'] = _aligned(header['roots_offset'] + rows * self.bins * 4)
+        encoded = json.dumps(header).encode('utf-8')
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC + struct.pack('<I', len(encoded)) + encoded)
+            f.write(b'\0' * (header['histograms_offset'] - f.tell()))
+            for start in range(0, rows, CHUNK_ROWS):
+                f.write(np.ascontiguousarray(self.histograms[start:start + CHUNK_ROWS], dtype.newbyteorder('<')).tobytes())
+            f.write(b'\0' * (header['labels_offset'] - f.tell()))
+            f.write(np.ascontiguousarray(self.labels, '<i4').tobytes())
+            # Roots of the histograms as stored, so a reloaded float16 model bounds the same values
+            f.write(b'\0' * (header['roots_offset'] - f.tell()))
+            sums = np.empty(rows, '<f4')
+            for start in range(0, rows, CHUNK_ROWS):
+                chunk = np.asarray(self.histograms[start:start + CHUNK_ROWS]).astype(dtype).astype(np.float32)
+                sums[start:start + len(chunk)] = chunk.sum(axis=1)
+                f.write(np.sqrt(chunk).astype('<f4').tobytes())
+            f.write(b'\0' * (header['sums_offset'] - f.tell()))
+            f.write(sums.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def append(self, other):
+        """Return a model with the samples of ``other`` (same LBPH parameters) added.
+
+        The histograms of both models are read as they are accessed rather than
+        copied, so saving the result streams a memory-mapped model into the new
+        file chunk by chunk.
+        """
+        if (other.radius, other.neighbors, other.grid_x, other.grid_y) != (self.radius, self.neighbors, self.grid_x, self.grid_y):
+            raise ValueError("Cannot merge LBPH models with different parameters")
+        histograms = RowConcat(self.histograms, other.histograms)
+        labels = np.concatenate([np.asarray(self.labels, np.int32), np.asarray(other.labels, np.int32)])
+        return LBPHModel(histograms, labels, self.radius, self.neighbors, self.grid_x, self.grid_y,
+                         self.threshold, self.face_size or other.face_size)
+
+    def subset(self, labels):
+        """Model restricted to the samples of ``labels``, sharing this model's histograms"""
+        rows = np.flatnonzero(np.isin(self.labels, np.fromiter(labels, np.int64)))
+        stored = self.roots is not None
+        return LBPHModel(RowSubset(self.histograms, rows), np.asarray(self.labels)[rows],
+                         self.radius, self.neighbors, self.grid_x, self.grid_y,
+                         self.threshold, self.face_size,
+                         RowSubset(self.roots, rows) if stored else None,
+                         np.asarray(self.sums)[rows] if stored else None)
+
+    def histograms_of(self, faces):
+        """(faces, bins) histograms of grayscale crops, computed together per crop size"""
+        result = np.empty((len(faces), self.bins), np.float32)
+        by_shape = {}
+        for i, face in enumerate(faces):
+            by_shape.setdefault(face.shape, []).append(i)
+        for indices in by_shape.values():
+            stack = np.stack([faces[i] for i in indices])
+            result[indices] = spatial_histogram(lbp_image(stack, self.radius, self.neighbors),
+                                                2 ** self.neighbors, self.grid_x, self.grid_y)
+        return result
+
+    def _gallery_roots(self):
+        """Square roots and row sums of the histograms, or (None, None).
+
+        A saved model stores them, so they are memory-mapped like the
+        histograms (a subset reads its rows into memory once). A model built
+        in memory computes them once, which doubles its memory. A
+        memory-mapped model saved without them gets (None, None) rather than
+        an in-memory copy as large as its histograms; ``_lower_bounds`` then
+        square-roots the gallery chunk by chunk on every prediction.
+        """
+        if self._roots is None:
+            if self.roots is not None:
+                self._roots, self._sums = np.asarray(self.roots, np.float32), np.asarray(self.sums, np.float32)
+            elif type(self.histograms) is np.ndarray:
+                histograms = np.asarray(self.histograms, np.float32)
+                self._roots, self._sums = np.sqrt(histograms), histograms.sum(axis=1)
+        return self._roots, self._sums
+
+    def _lower_bounds(self, queries):
+        """``chi2_lower_bounds`` of the queries against the whole gallery"""
+        roots, sums = self._gallery_roots()
+        if roots is not None:
+            return chi2_lower_bounds(roots, sums, queries)
+        bounds = np.empty((len(queries), len(self)), np.float32)
+        for start in range(0, len(self), CHUNK_ROWS):
+            rows = np.asarray(self.histograms[start:start + CHUNK_ROWS], np.float32)
+            bounds[:, start:start + len(rows)] = chi2_lower_bounds(np.sqrt(rows), rows.sum(axis=1), queries)
+        return bounds
+
+    def prepare(self):
+        """Compute the search caches now rather than on the first prediction"""
+        self._gallery_roots()
+
+    def _nearest_labels(self, query, bounds, k):
+        """Exact top-k labels of one query, comparing samples in order of their lower bound"""
+        limit = np.inf if self.threshold is None else self.threshold
+        best = {}
+        kth = np.inf
+        for row in np.argsort(bounds, kind='stable'):
+            # Every remaining sample is at least this far away
+            if bounds[row] >= min(kth, limit):
+                break
+            distance = chi2_distance(np.asarray(self.histograms[row], np.float32), query)
+            label = int(self.labels[row])
+            if distance < limit and distance < best.get(label, np.inf):
+                best[label] = distance
+                if len(best) >= k:
+                    kth = sorted(best.values())[k - 1]
+        matches = sorted(best.items(), key=lambda item: item[1])[:k]
+        return [(label, float(distance)) for label, distance in matches] or [NO_MATCH]
+
+    def predict_batch(self, faces, k=1):
+        """Predict every face of a frame at once.
+
+        The histograms of all faces are computed together and bounded against
+        the whole gallery with one matrix product (see ``chi2_lower_bounds``);
+        only samples whose bound can still beat the current k-th best label
+        are compared exactly, so the result is the same as a linear scan.
+        Returns, per face, up to ``k`` (label, distance) pairs of distinct
+        labels, nearest first, or ``[NO_MATCH]`` when no label is under the
+        threshold.
+        """
+        if not len(self):
+            raise ValueError("The LBPH model is empty, train it first")
+        if not len(faces):
+            return []
+        queries = self.histograms_of(faces)
+        bounds = self._lower_bounds(queries)
+        return [self._nearest_labels(query, row, k) for query, row in zip(queries, bounds)]
+
+    def predict(self, gray):
+        """Return (label, distance) of the nearest training sample, like ``LBPHFaceRecognizer.predict``"""
+        return self.predict_batch([gray])[0][0]
+
+
+def is_yaml_model(path):
+    return os.path.splitext(path)[1].lower() in ('.yml', '.yaml', '.xml')
+
+
+def load_model(path):
+    """Open a model in the binary format, or import an OpenCV YAML model"""
+    return LBPHModel.import_yaml(path) if is_yaml_model(path) else LBPHModel.load(path)
+
+
+def save_model(model, path):
+    """Write a model in the format given by the extension of ``path``"""
+    if is_yaml_model(path):
+        model.export_yaml(path)
+    else:
+        model.save(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Binary LBPH model tools")
+    commands = parser.add_subparsers(dest='command', required=True)
+    importer = commands.add_parser('import', help="convert an OpenCV YAML model to the binary format")
+    importer.add_argument('yaml_path')
+    importer.add_argument('model_path')
+    importer.add_argument('--dtype', choices=DTYPES, default='float32')
+    exporter = commands.add_parser('export', help="convert a binary model to OpenCV YAML")
+    exporter.add_argument('model_path')
+    exporter.add_argument('yaml_path')
+    info = commands.add_parser('info', help="show the size and parameters of a model")
+    info.add_argument('model_path')
+    args = parser.parse_args()
+
+    if args.command == 'import':
+        LBPHModel.import_yaml(args.yaml_path).save(args.model_path, args.dtype)
+        print(f" [INFO] {args.yaml_path} converted to {args.model_path}")
+    elif args.command == 'export':
+        LBPHModel.load(args.model_path).export_yaml(args.yaml_path)
+        print(f" [INFO] {args.model_path} exported to {args.yaml_path}")
+    else:
+        model = load_model(args.model_path)
+        print(f"{len(model)} samples of {len(np.unique(model.labels))} users, "
+              f"histograms {model.histograms.dtype} x {model.bins}, "
+              f"search cache {'stored' if model.roots is not None else 'not stored'}, parameters {model.params()}")
+
+
+if __name__ == '__main__':
+    main()
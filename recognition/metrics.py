@@ -0,0 +1,268 @@
+"""Per-stage latency and throughput metrics of the recognition pipeline.
+
+One ``PipelineMetrics`` is shared by the pipeline workers, the GUI and the
+attendance writer. Each records how long its step took with ``observe`` (or
+the ``timer`` context manager) and counts frames, faces, dropped frames and
+written records with ``count``. Stages recorded:
+
+==========  ==============================================================
+capture     waiting for the next frame of the source
+grayscale   BGR to grayscale conversion
+detect      face detection and tracking of one frame
+recognize   recognition of all faces of one frame
+predict     recognizer time per face
+handoff     from the presentation worker emitting a frame to the GUI slot
+display     drawing a frame in the GUI
+latency     from capture to display (end to end)
+db_write    writing one batch of attendance records
+==========  ==============================================================
+
+``snapshot`` summarizes the last ``window`` seconds (frames per second,
+faces per frame, dropped frames per second, and count, mean, p50, p95 and
+max per stage in milliseconds). It is shown as an overlay on the camera
+preview (``draw_overlay``), served in the Prometheus text format by
+``MetricsServer`` and written as periodic JSON lines by ``MetricsLogger``
+(see METRICS_* in config/setting.py).
+"""
+import collections
+import contextlib
+import http.server
+import json
+import logging
+import threading
+import time
+
+import cv2
+import numpy as np
+
+_logger = logging.getLogger(__name__)
+
+# Observations kept per stage for the windowed percentiles
+MAX_RECENT = 5000
+QUANTILES = (0.5, 0.95)
+
+
+class _Stage:
+    __slots__ = ('count', 'total', 'recent')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.recent = collections.deque(maxlen=MAX_RECENT)
+
+
+class _Counter:
+    __slots__ = ('total', 'recent')
+
+    def __init__(self):
+        self.total = 0
+        self.recent = collections.deque(maxlen=MAX_RECENT)
+
+
+class PipelineMetrics:
+    """Thread-safe stage timings and counters, summarized over a sliding window"""
+
+    def __init__(self, window=10.0):
+        self.window = window
+        self.started = time.monotonic()
+        self._stages = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds, count=1):
+        """Record that ``stage`` took ``seconds``, per item when it handled ``count`` items at once"""
+        now = time.monotonic()
+        with self._lock:
+            series = self._stages.get(stage)
+            if series is None:
+                series = self._stages[stage] = _Stage()
+            series.count += count
+            series.total += seconds * count
+            series.recent.append((now, seconds))
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def count(self, name, n=1, stage=None):
+        """Add ``n`` to a counter, optionally per pipeline stage (e.g. dropped frames)"""
+        now = time.monotonic()
+        with self._lock:
+            series = self._counters.get((name, stage))
+            if series is None:
+                series = self._counters[(name, stage)] = _Counter()
+            series.total += n
+            series.recent.append((now, n))
+
+    def _windowed(self, name, since):
+        return sum(n for (counter, _), series in self._counters.items() if counter == name
+                   for t, n in series.recent if t >= since)
+
+    def snapshot(self):
+        """Summary of the last ``window`` seconds, plus totals since the metrics were created"""
+        now = time.monotonic()
+        since = now - self.window
+        # Rates over at least a second, so they do not spike right after startup
+        span = max(min(self.window, now - self.started), 1.0)
+        with self._lock:
+            frames = self._windowed('frames', since)
+            faces = self._windowed('faces', since)
+            dropped = self._windowed('dropped_frames', since)
+            stages = {}
+            for stage, series in self._stages.items():
+                recent = np.array([seconds for t, seconds in series.recent if t >= since])
+                summary = {'count': series.count, 'sum_s': series.total}
+                if len(recent):
+                    p50, p95 = np.percentile(recent, [100 * q for q in QUANTILES]) * 1000
+                    summary.update(mean_ms=float(recent.mean() * 1000), p50_ms=float(p50), p95_ms=float(p95),
+                                   max_ms=float(recent.max() * 1000))
+                stages[stage] = summary
+            counters = {(f"{name}.{stage}" if stage else name): series.total
+                        for (name, stage), series in self._counters.items()}
+        return {
+            'window_s': self.window,
+            'fps': frames / span,
+            'faces_per_frame': faces / frames if frames else 0.0,
+            'dropped_per_s': dropped / span,
+            'stages': stages,
+            'counters': counters,
+        }
+
+    def prometheus_text(self, prefix='face_'):
+        """All metrics in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = [f"# HELP {prefix}stage_seconds Time per pipeline stage, quantiles over the last "
+                 f"{self.window:g} seconds",
+                 f"# TYPE {prefix}stage_seconds summary"]
+        for stage, summary in sorted(snapshot['stages'].items()):
+            for quantile in QUANTILES:
+                key = f"p{round(quantile * 100)}_ms"
+                if key in summary:
+                    lines.append(f'{prefix}stage_seconds{{stage="{stage}",quantile="{quantile}"}} '
+                                 f'{summary[key] / 1000:.6f}')
+            lines.append(f'{prefix}stage_seconds_sum{{stage="{stage}"}} {summary["sum_s"]:.6f}')
+            lines.append(f'{prefix}stage_seconds_count{{stage="{stage}"}} {summary["count"]}')
+        with self._lock:
+            counters = sorted(((name, stage, series.total) for (name, stage), series in self._counters.items()),
+                              key=lambda item: (item[0], item[1] or ''))
+        typed = set()
+        for name, stage, total in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {prefix}{name}_total counter")
+                typed.add(name)
+            labels = f'{{stage="{stage}"}}' if stage else ''
+            lines.append(f"{prefix}{name}_total{labels} {total}")
+        for name in ('fps', 'faces_per_frame', 'dropped_per_s'):
+            lines.append(f"# TYPE {prefix}{name} gauge")
+            lines.append(f"{prefix}{name} {snapshot[name]:.4f}")
+        return '\n'.join(lines) + '\n'
+
+
+def overlay_lines(snapshot):
+    """Text lines summarizing a snapshot for the camera preview"""
+    stages = snapshot['stages']
+
+    def mean(stage):
+        summary = stages.get(stage)
+        return f"{summary['mean_ms']:.1f}" if summary and 'mean_ms' in summary else '-'
+
+    return [
+        f"FPS {snapshot['fps']:.1f}  faces/frame {snapshot['faces_per_frame']:.2f}  "
+        f"dropped/s {snapshot['dropped_per_s']:.1f}",
+        f"capture {mean('capture')}  gray {mean('grayscale')}  detect {mean('detect')}  "
+        f"predict {mean('predict')} ms",
+        f"handoff {mean('handoff')}  display {mean('display')}  latency {mean('latency')}  "
+        f"db {mean('db_write')} ms",
+    ]
+
+
+def draw_overlay(frame, snapshot):
+    """Draw the summary of a snapshot in the top-left corner of a BGR frame, in place"""
+    lines = overlay_lines(snapshot)
+    scale = max(0.4, frame.shape[1] / 1600)
+    height = int(22 * scale / 0.5)
+    width = max(cv2.getTextSize(line, cv2.FONT_HERSHEY_SIMPLEX, scale, 1)[0][0] for line in lines)
+    # Darken the background so the text stays readable on any scene
+    region = frame[:height * len(lines) + 8, :width + 12]
+    region[:] = region // 3
+    for i, line in enumerate(lines):
+        cv2.putText(frame, line, (6, height * (i + 1)), cv2.FONT_HERSHEY_SIMPLEX, scale, (0, 255, 255), 1,
+                    cv2.LINE_AA)
+    return frame
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        metrics = self.server.metrics
+        if self.path == '/metrics':
+            body, content_type = metrics.prometheus_text().encode('utf-8'), 'text/plain; version=0.0.4'
+        elif self.path == '/metrics.json':
+            body, content_type = json.dumps(metrics.snapshot()).encode('utf-8'), 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        _logger.debug(f"{self.client_address[0]} {format % args}")
+
+
+class MetricsServer:
+    """Serves /metrics (Prometheus text format) and /metrics.json from a background thread"""
+
+    def __init__(self, metrics, host='127.0.0.1', port=9108):
+        self.server = http.server.ThreadingHTTPServer((host, port), _MetricsHandler)
+        self.server.metrics = metrics
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='metrics-server', daemon=True)
+        self._thread.start()
+        host, port = self.server.server_address[:2]
+        _logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+
+    def stop(self):
+        if self._thread is not None:
+            self.server.shutdown()
+            self._thread.join()
+        self.server.server_close()
+
+
+class MetricsLogger(threading.Thread):
+    """Writes a JSON snapshot every ``interval`` seconds, to ``path`` (JSON lines) or to the log"""
+
+    def __init__(self, metrics, interval=10.0, path=None):
+        super().__init__(name='metrics-logger', daemon=True)
+        self.metrics = metrics
+        self.interval = interval
+        self.path = path
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.write()
+
+    def write(self):
+        record = dict(self.metrics.snapshot(), time=time.strftime('%Y-%m-%dT%H:%M:%S'))
+        line = json.dumps(record)
+        if not self.path:
+            _logger.info(f"metrics {line}")
+            return
+        try:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+        except OSError as e:
+            _logger.error(f"Failed to write metrics to {self.path}: {str(e)}")
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
@@ -0,0 +1,84 @@
+"""Versioned model files with atomic publish.
+
+Training never rewrites the model that recognition is reading. Every run
+writes a new version next to the previous ones::
+
+    trainer/
+        trainer.v000007.lbph            model
+        trainer.v000007.manifest.json   training manifest
+        trainer.v000007.ann.npz         gallery index (optional)
+        trainer.current.json            {"version": 7, "file": "trainer.v000007.lbph"}
+
+and publishes it by atomically replacing the pointer file. Readers resolve
+the pointer, so they see either the old or the new model and never a
+half-written one, and can poll ``version()`` to pick up new models. A model
+file at the unversioned path (``trainer/trainer.lbph``) from before
+versioning is used as version 0 until the first version is published.
+"""
+import glob
+import json
+import logging
+import os
+
+_logger = logging.getLogger(__name__)
+
+# Published versions kept on disk, older ones are deleted
+KEEP_VERSIONS = 3
+
+
+class ModelStore:
+    """Versions of the model named by ``model_path`` (e.g. trainer/trainer.lbph)"""
+
+    def __init__(self, model_path, keep=KEEP_VERSIONS):
+        self.directory = os.path.dirname(model_path) or '.'
+        self.name, self.extension = os.path.splitext(os.path.basename(model_path))
+        self.unversioned_path = model_path
+        self.pointer_path = os.path.join(self.directory, f"{self.name}.current.json")
+        self.keep = keep
+
+    def version_path(self, version):
+        return os.path.join(self.directory, f"{self.name}.v{version:06d}{self.extension}")
+
+    def current(self):
+        """(version, path) of the published model, or (None, None) if there is none"""
+        try:
+            with open(self.pointer_path, encoding='utf-8') as f:
+                pointer = json.load(f)
+            return pointer['version'], os.path.join(self.directory, pointer['file'])
+        except FileNotFoundError:
+            pass
+        if os.path.exists(self.unversioned_path):
+            return 0, self.unversioned_path
+        return None, None
+
+    def version(self):
+        return self.current()[0]
+
+    def new_version(self):
+        """(version, path) to write the next model to; it is not visible until published"""
+        version = (self.version() or 0) + 1
+        return version, self.version_path(version)
+
+    def publish(self, version):
+        """Make a written version the current model and delete versions that are too old"""
+        pointer = {'version': version, 'file': os.path.basename(self.version_path(version))}
+        tmp_path = f"{self.pointer_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(pointer, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.pointer_path)
+        _logger.info(f"Published model version {version}")
+        self._prune(version)
+
+    def _prune(self, version):
+        pattern = os.path.join(glob.escape(self.directory), f"{glob.escape(self.name)}.v*.*")
+        for path in glob.glob(pattern):
+            number = os.path.basename(path)[len(self.name) + 2:].split('.', 1)[0]
+            if not number.isdigit() or int(number) > version - self.keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError as e:
+                # e.g. still mapped by a reader on Windows; retried after the next publish
+                _logger.warning(f"Could not remove old model file {path}: {str(e)}")
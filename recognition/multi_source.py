@@ -0,0 +1,242 @@
+"""Recognition over several frame sources with one shared recognizer.
+
+One machine serves several entrances or classrooms. Instead of one
+``RecognitionPipeline`` (and one copy of the model) per camera, a
+``MultiSourceScheduler`` runs:
+
+* one capture thread per source, which only keeps the latest frame of its
+  source (older ones are dropped, as in ``LatestQueue``);
+* a shared pool of workers that detect and recognize. A source is due again
+  ``1 / fps`` seconds after its last frame was taken, so no source uses more
+  than its frame-rate budget. Among the sources that are due, idle workers
+  serve the one that used the least processing time recently (decaying
+  with a half-life of ``USAGE_HALF_LIFE`` seconds). A camera whose frames
+  are expensive (a crowded entrance) therefore gets only the time the
+  others leave over instead of slowing all of them down, and the CPU is
+  not oversubscribed however many sources there are. A frame is never
+  interrupted, so a frame that takes longer than another source's frame
+  interval still delays that source when every worker is busy with one.
+
+Frames of one source are processed one at a time and in order, so each
+source keeps its own ``TrackingDetector``. Recognizers are read-only and
+shared: sources of the same class get the same class gallery of the one
+loaded model (see ``recognition.galleries``).
+
+Sources are configured as ``spec|class_id|fps`` entries separated by ``;``
+(see FRAME_SOURCES in config/setting.py), e.g.
+``0|1|10;1|2|10;videos/gate.mp4||5``.
+"""
+import logging
+import os
+import threading
+import time
+
+import cv2
+
+from recognition.pipeline import FramePacket, recognize_faces
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_FPS = 10.0
+# Seconds after which the processing time a source used counts half
+USAGE_HALF_LIFE = 2.0
+
+
+class SourceSpec:
+    """A frame source spec (see ``recognition.sources.open_source``) tagged with a class"""
+
+    def __init__(self, spec, class_id=None, fps=DEFAULT_FPS, name=None):
+        self.spec = spec
+        self.class_id = class_id
+        self.fps = fps
+        self.name = name or spec
+
+    def __repr__(self):
+        return f"SourceSpec({self.spec!r}, class_id={self.class_id}, fps={self.fps})"
+
+
+def parse_sources(text):
+    """Parse ``spec|class_id|fps`` entries separated by ``;`` into SourceSpecs"""
+    sources = []
+    for entry in text.split(';'):
+        if not entry.strip():
+            continue
+        spec, class_id, fps = (entry.split('|') + ['', ''])[:3]
+        sources.append(SourceSpec(spec.strip(),
+                                  int(class_id) if class_id.strip() else None,
+                                  float(fps) if fps.strip() else DEFAULT_FPS))
+    names = [source.name for source in sources]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Frame sources must be distinct: {names}")
+    return sources
+
+
+def assign_galleries(scheduler, specs, galleries, model, rosters):
+    """Point every source at the shared model, or at the gallery of its class when its roster is known.
+
+    ``galleries`` is the ``ClassGalleries`` of ``model`` and ``rosters`` maps
+    class ids to ``ClassRoster``s. Sources whose class has nobody enrolled,
+    or every source while there is no model yet, only detect faces.
+    """
+    for spec in specs:
+        roster = rosters.get(spec.class_id)
+        recognizer = galleries.get(spec.class_id, roster.names) if model is not None and roster else model
+        if recognizer is None or not len(recognizer):
+            _logger.warning(f"Nobody to recognize for class {spec.class_id}, {spec.name} only detects faces")
+            scheduler.set_recognizer(spec.name, None)
+            continue
+        recognizer.prepare()
+        scheduler.set_recognizer(spec.name, recognizer, recognizer.face_size)
+
+
+class Channel:
+    """Scheduling state of one source"""
+
+    def __init__(self, spec, source, detector):
+        self.spec = spec
+        self.source = source
+        self.detector = detector
+        self.recognizer = None
+        self.face_size = None
+        self.interval = 1.0 / spec.fps if spec.fps else 0.0
+        self.latest = None
+        self.next_due = 0.0
+        self.busy = False
+        self.usage = 0.0
+        self.usage_at = 0.0
+        self.finished = False
+        self.index = 0
+        self.processed = 0
+        self.dropped = 0
+
+
+class MultiSourceScheduler:
+    """Detects and recognizes faces of several sources on a shared pool of workers.
+
+    ``sources`` maps each ``SourceSpec`` to an opened frame source and
+    ``make_detector()`` returns a new detector (see ``recognition.tracking``)
+    for each of them. ``set_recognizer`` assigns the recognizer of a source.
+    ``on_result(spec, packet)`` is called from a worker with every processed
+    ``FramePacket``; frames of one source never overlap. ``on_error(spec,
+    message)`` is called when a source fails; the other sources go on.
+    """
+
+    def __init__(self, sources, make_detector, on_result, on_error=None, workers=None, flip=True):
+        self.channels = {spec.name: Channel(spec, source, make_detector()) for spec, source in sources.items()}
+        self.on_result = on_result
+        self.on_error = on_error
+        self.workers = workers or os.cpu_count() or 1
+        self.flip = flip
+        self._cond = threading.Condition()
+        self._stop_event = threading.Event()
+        self._threads = []
+
+    def set_recognizer(self, name, recognizer, face_size=None):
+        """Use ``recognizer`` for the next frames of the named source"""
+        channel = self.channels[name]
+        with self._cond:
+            channel.recognizer, channel.face_size = recognizer, face_size
+
+    def start(self):
+        self._stop_event.clear()
+        self._threads = [threading.Thread(target=self._capture_loop, args=(channel,),
+                                          name=f'capture-{channel.spec.name}', daemon=True)
+                         for channel in self.channels.values()]
+        self._threads += [threading.Thread(target=self._work_loop, name=f'recognize-{i}', daemon=True)
+                          for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout=2.0):
+        self._stop_event.set()
+        with self._cond:
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def is_running(self):
+        """Whether the scheduler was not stopped and some source is still delivering frames"""
+        with self._cond:
+            return not self._stop_event.is_set() and not all(
+                channel.finished and channel.latest is None and not channel.busy
+                for channel in self.channels.values())
+
+    def stats(self):
+        """Frames processed and frames dropped (not processed in time) per source"""
+        with self._cond:
+            return {name: {'processed': channel.processed, 'dropped': channel.dropped}
+                    for name, channel in self.channels.items()}
+
+    def _capture_loop(self, channel):
+        source = channel.source
+        while not self._stop_event.is_set():
+            ret, frame = source.read()
+            if not ret:
+                if not getattr(source, 'eof', False):
+                    message = "Không thể truy cập camera"
+                    _logger.error(f"Source {channel.spec.name}: {message}")
+                    if self.on_error:
+                        self.on_error(channel.spec, message)
+                break
+            if self.flip:
+                frame = cv2.flip(frame, 1)
+            with self._cond:
+                if channel.latest is not None:
+                    channel.dropped += 1
+                channel.latest = FramePacket(channel.index, frame)
+                channel.index += 1
+                self._cond.notify()
+        with self._cond:
+            channel.finished = True
+            self._cond.notify_all()
+
+    def _usage(self, channel, now):
+        return channel.usage * 0.5 ** ((now - channel.usage_at) / USAGE_HALF_LIFE)
+
+    def _take(self):
+        """Wait for the frame of the due source that used the least time recently; None when stopping"""
+        with self._cond:
+            while not self._stop_event.is_set():
+                now = time.monotonic()
+                waiting = [channel for channel in self.channels.values()
+                           if channel.latest is not None and not channel.busy]
+                due = [channel for channel in waiting if channel.next_due <= now]
+                if due:
+                    channel = min(due, key=lambda channel: (self._usage(channel, now), channel.next_due))
+                    packet, channel.latest = channel.latest, None
+                    channel.busy = True
+                    channel.next_due = max(channel.next_due + channel.interval, now)
+                    return channel, packet, channel.recognizer, channel.face_size
+                # Sleep until a frame arrives or the earliest waiting source is due
+                timeout = min((channel.next_due - now for channel in waiting), default=0.1)
+                self._cond.wait(min(max(timeout, 0.001), 0.1))
+        return None
+
+    def _work_loop(self):
+        while True:
+            taken = self._take()
+            if taken is None:
+                return
+            channel, packet, recognizer, face_size = taken
+            started = time.monotonic()
+            try:
+                packet.gray = cv2.cvtColor(packet.frame, cv2.COLOR_BGR2GRAY)
+                detections = channel.detector(packet.gray)
+                packet.track_ids = [track_id for track_id, _ in detections]
+                packet.faces = [box for _, box in detections]
+                if recognizer is not None:
+                    recognize_faces(recognizer, face_size, packet)
+                self.on_result(channel.spec, packet)
+            except Exception as e:
+                _logger.error(f"Lỗi xử lý khung hình ({channel.spec.name}): {str(e)}")
+                if self.on_error:
+                    self.on_error(channel.spec, str(e))
+            finally:
+                with self._cond:
+                    now = time.monotonic()
+                    channel.usage = self._usage(channel, now) + now - started
+                    channel.usage_at = now
+                    channel.busy = False
+                    channel.processed += 1
+                    self._cond.notify_all()
@@ -0,0 +1,184 @@
+"""Packed, memory-mapped face dataset.
+
+Instead of one JPEG per sample, faces are normalized to a fixed size and
+appended to a few large shard files of raw uint8 pixels, with a small index
+file holding the label, shard and row of every sample::
+
+    dataset_packed/
+        meta.json           face size and shard capacity
+        index.bin           int32 (label, shard, row) per sample
+        shard_00000.u8      (rows, height, width) uint8
+        shard_00001.u8      ...
+
+Shards are read with ``np.memmap``, so training and evaluation get the whole
+dataset zero-copy in one sequential pass. Samples are only ever appended;
+the index is written after the pixels so a concurrent reader never sees a
+row that is not there yet.
+
+Convert an existing ``dataset/User_<id>`` tree with::
+
+    python -m recognition.packed_dataset convert dataset dataset_packed
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+
+from config.setting import FACE_SIZE, PACKED_SHARD_SIZE
+from recognition.preprocess import normalize_face
+
+INDEX_DTYPE = np.dtype([('label', '<i4'), ('shard', '<i4'), ('row', '<i4')])
+
+
+def is_packed_dataset(path):
+    return os.path.exists(os.path.join(path, 'meta.json'))
+
+
+class PackedDataset:
+    """Append-only store of fixed-size grayscale faces"""
+
+    def __init__(self, root, face_size=FACE_SIZE, shard_size=PACKED_SHARD_SIZE):
+        self.root = root
+        meta_path = os.path.join(root, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            self.face_size = tuple(meta['face_size'])
+            self.shard_size = meta['shard_size']
+        else:
+            os.makedirs(root, exist_ok=True)
+            self.face_size = tuple(face_size)
+            self.shard_size = shard_size
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump({'face_size': list(self.face_size), 'shard_size': self.shard_size}, f)
+        self.index_path = os.path.join(root, 'index.bin')
+
+    @property
+    def sample_bytes(self):
+        return self.face_size[0] * self.face_size[1]
+
+    def shard_path(self, shard):
+        return os.path.join(self.root, f'shard_{shard:05d}.u8')
+
+    def index(self):
+        """Structured (label, shard, row) array of every sample"""
+        if not os.path.exists(self.index_path):
+            return np.zeros(0, INDEX_DTYPE)
+        count = os.path.getsize(self.index_path) // INDEX_DTYPE.itemsize
+        if count == 0:
+            return np.zeros(0, INDEX_DTYPE)
+        return np.memmap(self.index_path, INDEX_DTYPE, 'r', shape=(count,))
+
+    def __len__(self):
+        return len(self.index())
+
+    def labels(self):
+        return np.asarray(self.index()['label'])
+
+    def shard(self, shard, rows=None):
+        """Memory-map one shard as a (rows, height, width) uint8 array"""
+        path = self.shard_path(shard)
+        width, height = self.face_size
+        available = os.path.getsize(path) // self.sample_bytes
+        rows = available if rows is None else min(rows, available)
+        if rows == 0:
+            return np.zeros((0, height, width), np.uint8)
+        return np.memmap(path, np.uint8, 'r', shape=(rows, height, width))
+
+    def iter_shards(self, start=0):
+        """Yield (faces, labels) per shard for samples from index position ``start`` on"""
+        index = self.index()[start:]
+        for shard in np.unique(index['shard']):
+            entries = index[index['shard'] == shard]
+            first, last = int(entries['row'].min()), int(entries['row'].max())
+            faces = self.shard(int(shard), last + 1)
+            if last - first + 1 == len(entries):
+                # Appended rows are contiguous, so this stays a zero-copy view
+                faces = faces[first:last + 1]
+            else:
+                faces = faces[entries['row']]
+            yield faces, np.asarray(entries['label'])
+
+    def append(self, label, faces):
+        """Normalize and append grayscale face crops for one label; return the new sample count"""
+        index = self.index()
+        shard, row = (int(index[-1]['shard']), int(index[-1]['row']) + 1) if len(index) else (0, 0)
+        # Drop pixels of an append that crashed before its index was written
+        path = self.shard_path(shard)
+        if os.path.exists(path) and os.path.getsize(path) > row * self.sample_bytes:
+            os.truncate(path, row * self.sample_bytes)
+        entries = []
+        batch = []
+        for face in faces:
+            if row >= self.shard_size:
+                self._write_shard(shard, batch)
+                shard, row, batch = shard + 1, 0, []
+            batch.append(normalize_face(face, self.face_size))
+            entries.append((label, shard, row))
+            row += 1
+        self._write_shard(shard, batch)
+
+        with open(self.index_path, 'ab') as f:
+            f.write(np.array(entries, INDEX_DTYPE).tobytes())
+        return len(index) + len(entries)
+
+    def _write_shard(self, shard, faces):
+        if not faces:
+            return
+        with open(self.shard_path(shard), 'ab') as f:
+            f.write(np.ascontiguousarray(np.stack(faces), np.uint8).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def convert_directory(dataset_dir, packed_dir, processes=None, progress=None):
+    """Append every sample of a dataset/User_<id> tree to a packed store"""
+    from recognition.training import USER_DIR_PREFIX, iter_images, scan_dataset
+
+    store = PackedDataset(packed_dir)
+    labeled_paths = [(user_id, os.path.join(dataset_dir, f"{USER_DIR_PREFIX}{user_id}", name))
+                     for user_id, files in sorted(scan_dataset(dataset_dir).items())
+                     for name in sorted(files)]
+    labels = {path: user_id for user_id, path in labeled_paths}
+    total = 0
+    current, faces = None, []
+    for path, crops in iter_images([path for _, path in labeled_paths], processes=processes):
+        if labels[path] != current and faces:
+            total = store.append(current, faces)
+            if progress:
+                progress(current, total)
+            faces = []
+        current = labels[path]
+        if crops:
+            faces.append(crops[0])
+    if faces:
+        total = store.append(current, faces)
+        if progress:
+            progress(current, total)
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Packed face dataset tools")
+    commands = parser.add_subparsers(dest='command', required=True)
+    convert = commands.add_parser('convert', help="convert a dataset/User_<id> tree to a packed store")
+    convert.add_argument('dataset_dir')
+    convert.add_argument('packed_dir')
+    convert.add_argument('--processes', type=int, default=None)
+    info = commands.add_parser('info', help="show the size of a packed store")
+    info.add_argument('packed_dir')
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        total = convert_directory(args.dataset_dir, args.packed_dir, args.processes,
+                                  lambda user_id, total: print(f" [INFO] User {user_id} packed ({total} samples)"))
+        print(f" [INFO] {args.packed_dir} now holds {total} samples")
+    else:
+        store = PackedDataset(args.packed_dir)
+        labels = store.labels()
+        print(f"{len(labels)} samples of {len(np.unique(labels))} users, face size {store.face_size}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,293 @@
+"""Staged capture/detect/recognize/present pipeline for face recognition.
+
+Each stage runs in its own worker thread and hands frames to the next one
+through a ``LatestQueue``: a small bounded queue that drops the oldest frame
+when it is full. A slow stage therefore never makes the stages in front of it
+back up, and the preview stays close to real time under load.
+
+For deterministic replay of recorded footage the queues can instead be made
+lossless, in which case a full queue blocks the stage in front of it.
+"""
+import collections
+import logging
+import threading
+import time
+
+import cv2
+
+from recognition.preprocess import normalize_face
+
+_logger = logging.getLogger(__name__)
+
+STAGES = ('capture', 'detect', 'recognize', 'present')
+
+# Passed down the stages once a recorded source runs out of frames
+END_OF_STREAM = object()
+
+
+class LatestQueue:
+    """Bounded queue with a "latest frame wins" drop policy.
+
+    With ``lossless=True`` a full queue makes ``put`` wait for space instead,
+    until ``close`` is called. ``on_drop()`` is called for every dropped item.
+    """
+
+    def __init__(self, maxsize=1, lossless=False, on_drop=None):
+        self.maxsize = maxsize
+        self.lossless = lossless
+        self.on_drop = on_drop
+        self.dropped = 0
+        self._items = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def put(self, item):
+        with self._cond:
+            if self.lossless:
+                while len(self._items) >= self.maxsize and not self._closed:
+                    self._cond.wait(0.1)
+            if len(self._items) >= self.maxsize:
+                self._items.popleft()
+                self.dropped += 1
+                if self.on_drop:
+                    self.on_drop()
+            self._items.append(item)
+            self._cond.notify_all()
+
+    def get(self, timeout=None):
+        """Return the next item, or None if nothing arrived within timeout"""
+        with self._cond:
+            if not self._items:
+                self._cond.wait(timeout)
+            if not self._items:
+                return None
+            item = self._items.popleft()
+            self._cond.notify_all()
+            return item
+
+    def close(self):
+        """Release producers blocked on a full lossless queue"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class FramePacket:
+    """A frame travelling through the pipeline and what each stage added to it"""
+
+    __slots__ = ('index', 'frame', 'gray', 'faces', 'track_ids', 'results', 'captured_at')
+
+    def __init__(self, index, frame):
+        self.index = index
+        self.frame = frame
+        self.gray = None
+        self.faces = []
+        self.track_ids = []
+        self.results = []
+        self.captured_at = time.monotonic()
+
+
+class CascadeDetector:
+    """Runs a Haar cascade over every grayscale frame, without tracking"""
+
+    def __init__(self, cascade, scale_factor=1.3, min_neighbors=5):
+        self.cascade = cascade
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+
+    def __call__(self, gray):
+        return [(None, tuple(box)) for box in
+                self.cascade.detectMultiScale(gray, self.scale_factor, self.min_neighbors)]
+
+
+def recognize_faces(recognizer, face_size, packet, metrics=None):
+    """Recognize the detected faces of a packet and add them to its results.
+
+    ``recognizer`` provides ``predict(face) -> (label, confidence)``; when it
+    also has ``predict_batch(faces)`` (see ``recognition.lbph_model``) all
+    faces are recognized in one call. With ``face_size`` every crop is resized
+    to that (width, height) first. The recognizer time per face is recorded
+    as the ``predict`` stage of ``metrics`` (see ``recognition.metrics``).
+    """
+    gray = packet.gray
+    crops = []
+    for (x, y, w, h) in packet.faces:
+        face = gray[y:y+h, x:x+w]
+        if face_size:
+            face = normalize_face(face, face_size)
+        crops.append(face)
+    if not crops:
+        return
+    started = time.perf_counter()
+    if hasattr(recognizer, 'predict_batch'):
+        predictions = [matches[0] for matches in recognizer.predict_batch(crops)]
+    else:
+        predictions = [recognizer.predict(face) for face in crops]
+    if metrics is not None:
+        metrics.observe('predict', (time.perf_counter() - started) / len(crops), len(crops))
+    for track_id, box, (id_, confidence) in zip(packet.track_ids, packet.faces, predictions):
+        packet.results.append((track_id, tuple(box), id_, confidence))
+
+
+class RecognitionPipeline:
+    """Runs capture, detection, recognition and presentation in separate workers.
+
+    ``source`` must provide ``read() -> (ok, frame)``, ``detector`` maps a
+    grayscale frame to a list of ``(track_id, box)`` (see
+    ``recognition.tracking``) and ``recognizer`` provides
+    ``predict(face) -> (label, confidence)``; when it also has
+    ``predict_batch(faces)`` (see ``recognition.lbph_model``) all faces of a
+    frame are recognized in one call. ``on_frame`` is called from the
+    presentation worker with every ``FramePacket`` that made it through, and
+    ``on_error`` with a message when a stage fails. Every stage after capture
+    is fed by a ``LatestQueue`` of ``queue_size`` frames, lossless when the
+    source asks for it (see ``recognition.sources``). A source that runs out
+    of frames drains the pipeline and then stops it. With ``face_size`` every
+    crop is resized to that (width, height) before it is recognized.
+    ``set_recognizer`` swaps the recognizer while the pipeline runs; it may
+    be None to only detect and present.
+
+    ``set_enrollment`` switches the pipeline to enrollment: while the given
+    ``EnrollmentSession`` (see ``recognition.enrollment``) is collecting,
+    the detected faces of every frame go to it instead of the recognizer.
+
+    With ``metrics`` (a ``recognition.metrics.PipelineMetrics``) every stage
+    records its timings, and frames, faces and dropped frames are counted.
+    """
+
+    def __init__(self, source, detector, recognizer, on_frame, on_error=None,
+                 queue_size=1, flip=True, face_size=None, metrics=None):
+        self.source = source
+        self.detector = detector
+        self._recognizer = (recognizer, face_size)
+        self._enrollment = None
+        self.on_frame = on_frame
+        self.on_error = on_error
+        self.flip = flip
+        self.metrics = metrics
+        lossless = getattr(source, 'lossless', False)
+        self.queues = {stage: LatestQueue(queue_size, lossless, self._drop_counter(stage)) for stage in STAGES[1:]}
+        self._stop_event = threading.Event()
+        self._workers = []
+
+    def start(self):
+        self._stop_event.clear()
+        self._workers = [
+            threading.Thread(target=self._capture_loop, name='pipeline-capture', daemon=True),
+            self._stage_worker('detect', self._detect, 'recognize'),
+            self._stage_worker('recognize', self._recognize, 'present'),
+            self._stage_worker('present', self._present, None),
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def stop(self, timeout=2.0):
+        self._stop_event.set()
+        for queue in self.queues.values():
+            queue.close()
+        for worker in self._workers:
+            if worker is not threading.current_thread():
+                worker.join(timeout)
+        self._workers = []
+
+    def is_running(self):
+        return not self._stop_event.is_set()
+
+    def set_recognizer(self, recognizer, face_size=None):
+        """Use another recognizer from the next frame that reaches the recognition stage.
+
+        The frame being recognized finishes with the previous one, so no
+        frame is dropped or recognized with a mix of both.
+        """
+        self._recognizer = (recognizer, face_size)
+
+    def set_enrollment(self, session):
+        """Collect face samples into ``session`` until it is done, then go back to recognizing"""
+        self._enrollment = session
+
+    def dropped_frames(self):
+        """Number of frames each stage dropped because it was still busy"""
+        return {stage: queue.dropped for stage, queue in self.queues.items()}
+
+    def _drop_counter(self, stage):
+        if self.metrics is None:
+            return None
+        return lambda: self.metrics.count('dropped_frames', stage=stage)
+
+    def _observe(self, stage, started):
+        if self.metrics is not None:
+            self.metrics.observe(stage, time.perf_counter() - started)
+
+    def _fail(self, message):
+        _logger.error(message)
+        self._stop_event.set()
+        if self.on_error:
+            self.on_error(message)
+
+    def _capture_loop(self):
+        index = 0
+        while not self._stop_event.is_set():
+            started = time.perf_counter()
+            ret, frame = self.source.read()
+            self._observe('capture', started)
+            if not ret:
+                if getattr(self.source, 'eof', False):
+                    self.queues['detect'].put(END_OF_STREAM)
+                else:
+                    self._fail("Không thể truy cập camera")
+                return
+            if self.flip:
+                frame = cv2.flip(frame, 1)
+            self.queues['detect'].put(FramePacket(index, frame))
+            index += 1
+
+    def _stage_worker(self, stage, func, next_stage):
+        def loop():
+            inbox = self.queues[stage]
+            while not self._stop_event.is_set():
+                packet = inbox.get(timeout=0.1)
+                if packet is None:
+                    continue
+                if packet is END_OF_STREAM:
+                    if next_stage:
+                        self.queues[next_stage].put(packet)
+                    else:
+                        self._stop_event.set()
+                    return
+                try:
+                    func(packet)
+                except Exception as e:
+                    self._fail(f"Lỗi xử lý khung hình ({stage}): {str(e)}")
+                    return
+                if next_stage:
+                    self.queues[next_stage].put(packet)
+        return threading.Thread(target=loop, name=f'pipeline-{stage}', daemon=True)
+
+    def _detect(self, packet):
+        started = time.perf_counter()
+        packet.gray = cv2.cvtColor(packet.frame, cv2.COLOR_BGR2GRAY)
+        self._observe('grayscale', started)
+        started = time.perf_counter()
+        detections = self.detector(packet.gray)
+        self._observe('detect', started)
+        packet.track_ids = [track_id for track_id, _ in detections]
+        packet.faces = [box for _, box in detections]
+
+    def _recognize(self, packet):
+        enrollment = self._enrollment
+        if enrollment is not None and not enrollment.done:
+            enrollment.add(packet.gray, packet.faces)
+            return
+        recognizer, face_size = self._recognizer
+        if recognizer is not None:
+            started = time.perf_counter()
+            recognize_faces(recognizer, face_size, packet, self.metrics)
+            self._observe('recognize', started)
+
+    def _present(self, packet):
+        if self.metrics is not None:
+            self.metrics.count('frames')
+            self.metrics.count('faces', len(packet.faces))
+        for (x, y, w, h) in packet.faces:
+            cv2.rectangle(packet.frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
+        self.on_frame(packet)
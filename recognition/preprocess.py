@@ -0,0 +1,10 @@
+"""Face crop preprocessing shared by enrollment, training and recognition"""
+import cv2
+
+
+def normalize_face(gray, size):
+    """Resize a grayscale face crop to the fixed (width, height) used by the dataset"""
+    if gray.shape[1] == size[0] and gray.shape[0] == size[1]:
+        return gray
+    interpolation = cv2.INTER_AREA if gray.shape[1] > size[0] else cv2.INTER_LINEAR
+    return cv2.resize(gray, tuple(size), interpolation=interpolation)
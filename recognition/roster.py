@@ -0,0 +1,44 @@
+"""In-memory class roster for a recognition session.
+
+Loaded once when a session starts so that checking a recognized student is a
+dictionary lookup instead of several database round-trips per face.
+"""
+import datetime
+
+
+class ClassRoster:
+    """Students of one class and who already has attendance for the day"""
+
+    def __init__(self, class_id, students, recorded, date=None):
+        self.class_id = class_id
+        self.date = date or datetime.date.today()
+        self.names = dict(students)
+        self.recorded = set(recorded)
+
+    def is_registered(self, student_id):
+        return student_id in self.names
+
+    def name(self, student_id):
+        return self.names.get(student_id)
+
+    def is_recorded(self, student_id):
+        return student_id in self.recorded
+
+    def add_student(self, student_id, full_name):
+        self.names[student_id] = full_name
+
+    def mark_recorded(self, student_id):
+        self.recorded.add(student_id)
+
+    def unmark_recorded(self, student_id):
+        """Forget a record that could not be written, so the student is recorded again"""
+        self.recorded.discard(student_id)
+
+    def is_current(self):
+        """False once the day has rolled over and the roster must be reloaded"""
+        return self.date == datetime.date.today()
+
+    def start_new_day(self):
+        """Clear the recorded set after a day rollover"""
+        self.date = datetime.date.today()
+        self.recorded.clear()
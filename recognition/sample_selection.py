@@ -0,0 +1,155 @@
+"""Selection of a small, diverse set of enrollment samples.
+
+Enrollment captures consecutive frames, most of which are near-identical.
+Every extra sample makes the model larger and prediction slower without
+making it more accurate, so only a few good and mutually different faces
+are kept per user:
+
+* blurred faces (variance of the Laplacian well below that of the user's
+  other samples) and badly exposed ones (mean brightness outside a range)
+  are rejected;
+* the rest are compared by a 64-bit difference hash (dHash) and picked
+  farthest-first: the sharpest face, then repeatedly the one whose hash is
+  farthest from every face picked so far, until ``count`` are picked or the
+  remaining ones are all within ``min_distance`` bits of a picked face.
+
+Shrink an existing dataset (a ``dataset/User_<id>`` tree or a packed
+dataset) into a new one with::
+
+    python -m recognition.sample_selection dataset dataset_selected --count 20
+"""
+import argparse
+import logging
+import os
+import shutil
+
+import cv2
+import numpy as np
+
+from config.setting import (ENROLL_BRIGHTNESS, ENROLL_MIN_HASH_DISTANCE, ENROLL_MIN_SHARPNESS,
+                            ENROLL_SAMPLES, ENROLL_SHARPNESS_RATIO)
+from recognition.packed_dataset import PackedDataset, is_packed_dataset
+
+_logger = logging.getLogger(__name__)
+
+# Faces are scored at this size so sharpness does not depend on the crop size
+QUALITY_SIZE = (64, 64)
+
+
+def sharpness(face):
+    """Variance of the Laplacian, low for blurred faces"""
+    small = cv2.resize(face, QUALITY_SIZE, interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(small, cv2.CV_32F).var())
+
+
+def brightness(face):
+    return float(np.mean(face))
+
+
+def dhash(face):
+    """64-bit difference hash: whether each pixel of a 9x8 thumbnail is brighter than its left neighbour"""
+    small = cv2.resize(face, (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+    bits = np.packbits(small[:, 1:] > small[:, :-1])
+    return int.from_bytes(bits.tobytes(), 'big')
+
+
+def hamming(hashes, value):
+    """Bits in which each of ``hashes`` (uint64 array) differs from ``value``"""
+    diff = (hashes ^ np.uint64(value)).view(np.uint8)
+    return np.unpackbits(diff).reshape(len(hashes), 64).sum(axis=1)
+
+
+def select_samples(faces, count=ENROLL_SAMPLES, min_sharpness=ENROLL_MIN_SHARPNESS,
+                   sharpness_ratio=ENROLL_SHARPNESS_RATIO, brightness_range=ENROLL_BRIGHTNESS,
+                   min_distance=ENROLL_MIN_HASH_DISTANCE):
+    """Indices of at most ``count`` good, mutually different faces, in the order they were picked"""
+    if not len(faces):
+        return []
+    sharp = np.array([sharpness(face) for face in faces])
+    bright = np.array([brightness(face) for face in faces])
+    low, high = brightness_range
+    usable = ((sharp >= max(min_sharpness, sharpness_ratio * np.median(sharp)))
+              & (bright >= low) & (bright <= high))
+    candidates = np.flatnonzero(usable)
+    if not len(candidates):
+        # Better one poor sample than none at all
+        candidates = np.array([int(np.argmax(sharp))])
+    candidates = candidates[np.argsort(-sharp[candidates], kind='stable')]
+
+    hashes = np.array([dhash(faces[i]) for i in candidates], np.uint64)
+    picked = [0]
+    distances = hamming(hashes, hashes[0]).astype(np.int64)
+    # Picked faces are masked out, so even with min_distance 0 none is picked twice
+    distances[0] = -1
+    while len(picked) < count:
+        best = int(np.argmax(distances))
+        if distances[best] < max(min_distance, 0):
+            break
+        picked.append(best)
+        distances = np.minimum(distances, hamming(hashes, hashes[best]))
+        distances[best] = -1
+    return [int(candidates[i]) for i in picked]
+
+
+def select_directory(dataset_dir, output_dir, **options):
+    """Copy the selected samples of every dataset/User_<id> directory to ``output_dir``"""
+    from recognition.training import USER_DIR_PREFIX, scan_dataset
+
+    before = after = 0
+    for user_id, files in sorted(scan_dataset(dataset_dir).items()):
+        user_dir = f"{USER_DIR_PREFIX}{user_id}"
+        paths = [os.path.join(dataset_dir, user_dir, name) for name in sorted(files)]
+        faces, readable = [], []
+        for path in paths:
+            face = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+            if face is None:
+                _logger.warning(f"Error processing image {path}")
+                continue
+            faces.append(face)
+            readable.append(path)
+        selected = select_samples(faces, **options)
+        os.makedirs(os.path.join(output_dir, user_dir), exist_ok=True)
+        for i in selected:
+            shutil.copy2(readable[i], os.path.join(output_dir, user_dir, os.path.basename(readable[i])))
+        before += len(paths)
+        after += len(selected)
+    return before, after
+
+
+def select_packed(packed_dir, output_dir, **options):
+    """Append the selected samples of every label of a packed dataset to a new packed dataset"""
+    source = PackedDataset(packed_dir)
+    if os.path.exists(output_dir) and len(PackedDataset(output_dir, source.face_size)):
+        raise ValueError(f"{output_dir} already holds samples")
+    target = PackedDataset(output_dir, source.face_size, source.shard_size)
+    faces_by_label = {}
+    for faces, labels in source.iter_shards():
+        for face, label in zip(faces, labels):
+            faces_by_label.setdefault(int(label), []).append(face)
+    after = 0
+    for label, faces in sorted(faces_by_label.items()):
+        selected = select_samples(faces, **options)
+        target.append(label, [faces[i] for i in selected])
+        after += len(selected)
+    return len(source), after
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep a small, diverse set of samples per user")
+    parser.add_argument('dataset_dir', help="dataset/User_<id> tree or packed dataset")
+    parser.add_argument('output_dir', help="new dataset of the same format")
+    parser.add_argument('--count', type=int, default=ENROLL_SAMPLES, help="samples kept per user")
+    parser.add_argument('--min-distance', type=int, default=ENROLL_MIN_HASH_DISTANCE,
+                        help="bits in which kept samples must differ")
+    args = parser.parse_args()
+
+    options = {'count': args.count, 'min_distance': args.min_distance}
+    if is_packed_dataset(args.dataset_dir):
+        before, after = select_packed(args.dataset_dir, args.output_dir, **options)
+    else:
+        before, after = select_directory(args.dataset_dir, args.output_dir, **options)
+    print(f" [INFO] Kept {after} of {before} samples in {args.output_dir}")
+
+
+if __name__ == '__main__':
+    main()
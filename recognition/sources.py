@@ -0,0 +1,218 @@
+"""Frame sources for the recognition loop.
+
+Every source exposes the same small ``cv2.VideoCapture``-like surface
+(``isOpened``, ``read``, ``release``) so the GUI, the demo script and the
+pipeline can run on a live camera, recorded footage, a folder of images or
+generated frames without caring which one it is.
+
+Recorded sources replay at their native frame rate by default. With
+``realtime=False`` they are read as fast as possible and marked ``lossless``
+so the pipeline processes every frame, which makes runs reproducible
+frame-for-frame.
+"""
+import os
+import time
+
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.pgm', '.tif', '.tiff')
+
+
+class FrameSource:
+    """Base class for all frame sources"""
+
+    live = False
+
+    def __init__(self, fps=30.0, realtime=True):
+        self.fps = fps or 30.0
+        self.realtime = realtime
+        self.eof = False
+        self._next_frame_at = None
+
+    @property
+    def lossless(self):
+        """Whether consumers should process every frame instead of dropping stale ones"""
+        return not self.live and not self.realtime
+
+    def isOpened(self):
+        return True
+
+    def read(self):
+        if self.eof:
+            return False, None
+        frame = self._read_frame()
+        if frame is None:
+            self.eof = True
+            return False, None
+        self._pace()
+        return True, frame
+
+    def release(self):
+        pass
+
+    def _read_frame(self):
+        raise NotImplementedError
+
+    def _pace(self):
+        if self.live or not self.realtime:
+            return
+        now = time.monotonic()
+        if self._next_frame_at is None:
+            self._next_frame_at = now
+        delay = self._next_frame_at - now
+        if delay > 0:
+            time.sleep(delay)
+        self._next_frame_at = max(self._next_frame_at, now) + 1.0 / self.fps
+
+    def __iter__(self):
+        while True:
+            ret, frame = self.read()
+            if not ret:
+                return
+            yield frame
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class CameraSource(FrameSource):
+    """Live camera, read at whatever rate the device delivers"""
+
+    live = True
+
+    def __init__(self, index=0, width=None, height=None):
+        super().__init__()
+        self.cap = cv2.VideoCapture(index)
+        if width:
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        if height:
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+
+    @property
+    def width(self):
+        return int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+
+    @property
+    def height(self):
+        return int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def read(self):
+        # A camera that stops delivering frames is an error, not end of stream
+        return self.cap.read()
+
+    def release(self):
+        self.cap.release()
+
+
+class VideoFileSource(FrameSource):
+    """Recorded video file"""
+
+    def __init__(self, path, realtime=True):
+        self.cap = cv2.VideoCapture(path)
+        super().__init__(self.cap.get(cv2.CAP_PROP_FPS), realtime)
+
+    @property
+    def width(self):
+        return int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+
+    @property
+    def height(self):
+        return int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def _read_frame(self):
+        ret, frame = self.cap.read()
+        return frame if ret else None
+
+    def release(self):
+        self.cap.release()
+
+
+class ImageDirectorySource(FrameSource):
+    """Directory of still images, replayed in file name order"""
+
+    def __init__(self, path, fps=30.0, realtime=True, loop=False):
+        super().__init__(fps, realtime)
+        self.paths = sorted(
+            os.path.join(path, name) for name in os.listdir(path)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        self.loop = loop
+        self._position = 0
+        first = cv2.imread(self.paths[0]) if self.paths else None
+        self.height, self.width = first.shape[:2] if first is not None else (0, 0)
+
+    def isOpened(self):
+        return bool(self.paths)
+
+    def _read_frame(self):
+        if self._position >= len(self.paths):
+            if not self.loop or not self.paths:
+                return None
+            self._position = 0
+        frame = cv2.imread(self.paths[self._position])
+        self._position += 1
+        return frame
+
+
+class SyntheticSource(FrameSource):
+    """In-memory generated frames.
+
+    ``generate(index)`` returns the BGR frame for a given index; the default
+    draws a few face-like shapes drifting over a fixed noise background,
+    seeded so every run produces the same frames. ``count=None`` never ends.
+    """
+
+    def __init__(self, generate=None, count=None, width=640, height=480,
+                 faces=1, seed=0, fps=30.0, realtime=True):
+        super().__init__(fps, realtime)
+        self.width = width
+        self.height = height
+        self.count = count
+        self.faces = faces
+        self.generate = generate or self._default_frame
+        self._index = 0
+        rng = np.random.default_rng(seed)
+        self._background = rng.integers(0, 64, (height, width, 3), dtype=np.uint8)
+        self._positions = rng.random((faces, 2))
+
+    def _read_frame(self):
+        if self.count is not None and self._index >= self.count:
+            return None
+        frame = self.generate(self._index)
+        self._index += 1
+        return frame
+
+    def _default_frame(self, index):
+        frame = self._background.copy()
+        size = min(self.width, self.height) // 4
+        for n, (fx, fy) in enumerate(self._positions):
+            cx = int((fx * self.width + 3 * index * (n + 1)) % (self.width - size)) + size // 2
+            cy = int(fy * (self.height - size)) + size // 2
+            cv2.ellipse(frame, (cx, cy), (size // 3, size // 2), 0, 0, 360, (170, 180, 200), -1)
+            for ex in (cx - size // 7, cx + size // 7):
+                cv2.circle(frame, (ex, cy - size // 8), size // 16, (40, 40, 40), -1)
+            cv2.line(frame, (cx - size // 8, cy + size // 5), (cx + size // 8, cy + size // 5), (60, 60, 90), 2)
+        return frame
+
+
+def open_source(spec, realtime=True, width=None, height=None):
+    """Create a frame source from a camera index, file, directory or "synthetic[:N]" spec"""
+    if isinstance(spec, int) or (isinstance(spec, str) and spec.isdigit()):
+        return CameraSource(int(spec), width, height)
+    if spec.startswith('synthetic'):
+        _, _, count = spec.partition(':')
+        return SyntheticSource(count=int(count) if count else None,
+                               width=width or 640, height=height or 480, realtime=realtime)
+    if os.path.isdir(spec):
+        return ImageDirectorySource(spec, realtime=realtime)
+    return VideoFileSource(spec, realtime)
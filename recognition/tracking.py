@@ -0,0 +1,122 @@
+"""Detect-then-track face localisation.
+
+Running the Haar cascade over every full-resolution frame is the most
+expensive step of the recognition loop. ``TrackingDetector`` runs it only
+every ``detect_every`` frames, optionally on a downscaled copy of the frame,
+and carries the known face boxes forward in between by template matching
+inside a small window around each box. Each face keeps a stable track id
+for as long as it is followed.
+"""
+import itertools
+
+import cv2
+
+
+def iou(a, b):
+    """Intersection over union of two (x, y, w, h) boxes"""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    ix = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy
+    union = aw * ah + bw * bh - inter
+    return inter / union if union else 0.0
+
+
+class Track:
+    """A face followed across frames"""
+
+    __slots__ = ('id', 'box', 'template')
+
+    def __init__(self, track_id, box, template):
+        self.id = track_id
+        self.box = box
+        self.template = template
+
+
+class TrackingDetector:
+    """Cascade detection every N frames with template-matching tracking in between.
+
+    Called with a grayscale frame, returns a list of ``(track_id, box)``.
+    A track is dropped when its template no longer matches well enough, and
+    losing a track forces a full detection on the next frame.
+    """
+
+    def __init__(self, cascade, detect_every=5, detect_scale=1.0, scale_factor=1.3,
+                 min_neighbors=5, search_margin=0.5, min_score=0.6, iou_threshold=0.3):
+        self.cascade = cascade
+        self.detect_every = max(1, detect_every)
+        self.detect_scale = detect_scale
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.search_margin = search_margin
+        self.min_score = min_score
+        self.iou_threshold = iou_threshold
+        self.tracks = []
+        self._frames_since_detect = None
+        self._ids = itertools.count(1)
+
+    def reset(self):
+        self.tracks = []
+        self._frames_since_detect = None
+
+    def __call__(self, gray):
+        if self._frames_since_detect is None or self._frames_since_detect + 1 >= self.detect_every:
+            self._detect(gray)
+            self._frames_since_detect = 0
+        else:
+            self._frames_since_detect += 1
+            if not self._track(gray):
+                self._frames_since_detect = None
+        return [(track.id, track.box) for track in self.tracks]
+
+    def _detect(self, gray):
+        if self.detect_scale != 1.0:
+            small = cv2.resize(gray, None, fx=self.detect_scale, fy=self.detect_scale,
+                               interpolation=cv2.INTER_AREA)
+            boxes = [tuple(int(round(v / self.detect_scale)) for v in box)
+                     for box in self.cascade.detectMultiScale(small, self.scale_factor, self.min_neighbors)]
+        else:
+            boxes = [tuple(int(v) for v in box)
+                     for box in self.cascade.detectMultiScale(gray, self.scale_factor, self.min_neighbors)]
+
+        # Greedily hand each detection the unclaimed track it overlaps most
+        unclaimed = list(self.tracks)
+        tracks = []
+        for box in boxes:
+            best = max(unclaimed, key=lambda track: iou(track.box, box), default=None)
+            if best is not None and iou(best.box, box) >= self.iou_threshold:
+                unclaimed.remove(best)
+                track_id = best.id
+            else:
+                track_id = next(self._ids)
+            tracks.append(Track(track_id, box, self._crop(gray, box)))
+        self.tracks = tracks
+
+    def _track(self, gray):
+        """Move every track to its best template match; return False if any was lost"""
+        height, width = gray.shape[:2]
+        kept = []
+        for track in self.tracks:
+            x, y, w, h = track.box
+            mx, my = int(w * self.search_margin), int(h * self.search_margin)
+            x0, y0 = max(0, x - mx), max(0, y - my)
+            x1, y1 = min(width, x + w + mx), min(height, y + h + my)
+            window = gray[y0:y1, x0:x1]
+            th, tw = track.template.shape[:2]
+            if window.shape[0] < th or window.shape[1] < tw:
+                continue
+            scores = cv2.matchTemplate(window, track.template, cv2.TM_CCOEFF_NORMED)
+            _, score, _, (bx, by) = cv2.minMaxLoc(scores)
+            if score < self.min_score:
+                continue
+            track.box = (x0 + bx, y0 + by, w, h)
+            kept.append(track)
+        lost = len(kept) < len(self.tracks)
+        self.tracks = kept
+        return not lost
+
+    @staticmethod
+    def _crop(gray, box):
+        x, y, w, h = box
+        return gray[y:y+h, x:x+w].copy()
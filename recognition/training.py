@@ -0,0 +1,366 @@
+"""LBPH model training over the ``dataset/User_<id>`` directories or a packed dataset.
+
+Next to the model file a JSON manifest records which sample files of which
+users the model contains, with their modification times. When a user
+finishes enrollment only the histograms of their new samples are computed
+and appended to the existing model; a full rebuild happens only when the
+model or manifest is missing or when samples that the model contains have
+been removed or rewritten in the dataset.
+
+Models are saved in the binary format of ``recognition.lbph_model`` unless
+the model path has a YAML extension. ``train_model`` writes every update as
+a new version and publishes it atomically (see ``recognition.model_store``),
+so a running recognizer never reads a half-written model. It can also keep
+the gallery index of ``recognition.ann_index`` in step with the model.
+
+Samples of a directory dataset are normalized to the dataset face size
+and their LBP histograms kept in a cache next to them (see
+``recognition.feature_cache``), so even a full rebuild only decodes the
+images that are new or changed since the last training. Images are decoded
+across a process pool.
+"""
+import concurrent.futures
+import json
+import logging
+import os
+
+import cv2
+import numpy as np
+
+from config.setting import FACE_SIZE
+from recognition.ann_index import update_index
+from recognition.feature_cache import FeatureCache, cache_dir, cached_features
+from recognition.lbph_model import LBPHModel, load_model, save_model
+from recognition.model_store import ModelStore
+from recognition.packed_dataset import PackedDataset, is_packed_dataset
+
+_logger = logging.getLogger(__name__)
+
+USER_DIR_PREFIX = 'User_'
+
+# Below this many images decoding in-process beats starting a process pool
+PARALLEL_MIN_IMAGES = 256
+# Samples handed to the recognizer per train/update call
+TRAIN_BATCH_SIZE = 2000
+# Images between two progress callbacks
+PROGRESS_EVERY = 100
+
+# Stages reported to ``progress(stage, done, total)`` callbacks
+STAGE_LOAD = 'load'
+STAGE_HISTOGRAMS = 'histograms'
+STAGE_WRITE = 'write'
+STAGE_INDEX = 'index'
+
+
+def manifest_path(model_path):
+    return os.path.splitext(model_path)[0] + '.manifest.json'
+
+
+def read_manifest(model_path):
+    """Return the raw manifest of a model, or None if the model or manifest is missing"""
+    if model_path is None:
+        return None
+    path = manifest_path(model_path)
+    if not os.path.exists(model_path) or not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_manifest(model_path, data):
+    with open(manifest_path(model_path), 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+
+
+def load_manifest(model_path):
+    """Return {user_id: {file name: mtime_ns}} for the model, or None if unknown"""
+    data = read_manifest(model_path)
+    if data is None or 'users' not in data:
+        return None
+    return {int(user_id): files for user_id, files in data['users'].items()}
+
+
+def save_manifest(model_path, manifest):
+    write_manifest(model_path, {'users': {str(user_id): files for user_id, files in sorted(manifest.items())}})
+
+
+def scan_dataset(dataset_dir):
+    """Return {user_id: {file name: mtime_ns}} for every User_<id> directory"""
+    dataset = {}
+    for user_dir in os.listdir(dataset_dir):
+        if not user_dir.startswith(USER_DIR_PREFIX):
+            continue
+        try:
+            user_id = int(user_dir[len(USER_DIR_PREFIX):])
+        except ValueError:
+            _logger.warning(f"Skipping unexpected dataset directory {user_dir}")
+            continue
+        with os.scandir(os.path.join(dataset_dir, user_dir)) as entries:
+            dataset[user_id] = {entry.name: entry.stat().st_mtime_ns for entry in entries if entry.is_file()}
+    return dataset
+
+
+def is_cropped(img, tolerance=0.15):
+    """Whether an image already looks like a face crop (roughly square) rather than a frame"""
+    height, width = img.shape[:2]
+    return abs(width - height) <= tolerance * max(width, height)
+
+
+_detector = None
+
+
+def _init_worker(cascade_path):
+    global _detector
+    _detector = cv2.CascadeClassifier(cascade_path) if cascade_path else None
+
+
+def _decode(path):
+    """Load one image as grayscale and return its face crops (runs in a pool worker)"""
+    img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return None
+    if _detector is None or is_cropped(img):
+        return [img]
+    return [img[y:y + h, x:x + w] for (x, y, w, h) in _detector.detectMultiScale(img)]
+
+
+def iter_images(paths, cascade_path=None, processes=None, progress=None):
+    """Yield (path, face crops) for every path, in order, decoding across a process pool.
+
+    With ``cascade_path`` images that are not already cropped faces are run
+    through the cascade and every detected face is returned; otherwise each
+    image is returned whole. Unreadable images yield None. ``progress(done,
+    total)`` is called as images complete. Small batches are decoded in
+    process to avoid the pool start-up cost.
+    """
+    total = len(paths)
+    executor = None
+    if total < PARALLEL_MIN_IMAGES or processes == 1:
+        _init_worker(cascade_path)
+        results = map(_decode, paths)
+    else:
+        workers = processes or os.cpu_count() or 1
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(cascade_path,)
+        )
+        results = executor.map(_decode, paths, chunksize=max(1, min(64, total // (4 * workers))))
+    try:
+        for done, (path, crops) in enumerate(zip(paths, results), 1):
+            yield path, crops
+            if progress and (done % PROGRESS_EVERY == 0 or done == total):
+                progress(done, total)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+def train_streaming(recognizer, labeled_paths, update=False, cascade_path=None,
+                    processes=None, progress=None):
+    """Feed (label, path) samples into an LBPH recognizer in batches as they are decoded.
+
+    The first batch calls ``train`` unless ``update`` is set; every other
+    batch is appended with ``update``, so memory stays bounded by the batch
+    size. ``progress(stage, done, total)`` counts images through the
+    STAGE_LOAD and STAGE_HISTOGRAMS stages. Returns (sample count, set of
+    paths that were read).
+    """
+    labels_by_path = {path: label for label, path in labeled_paths}
+    faces = []
+    labels = []
+    count = 0
+    loaded = set()
+    images = 0
+    total = len(labeled_paths)
+
+    def flush():
+        nonlocal update
+        if faces:
+            if update:
+                recognizer.update(faces, np.array(labels))
+            else:
+                recognizer.train(faces, np.array(labels))
+                update = True
+            faces.clear()
+            labels.clear()
+        if progress:
+            progress(STAGE_HISTOGRAMS, images, total)
+
+    def loading(done, total):
+        progress(STAGE_LOAD, done, total)
+
+    for path, crops in iter_images([path for _, path in labeled_paths], cascade_path, processes,
+                                   loading if progress else None):
+        images += 1
+        if crops is None:
+            _logger.warning(f"Error processing image {path}")
+            continue
+        loaded.add(path)
+        for crop in crops:
+            faces.append(crop)
+            labels.append(labels_by_path[path])
+            count += 1
+        if len(faces) >= TRAIN_BATCH_SIZE:
+            flush()
+    flush()
+    return count, loaded
+
+
+def _labeled_paths(dataset_dir, samples):
+    return [(user_id, os.path.join(dataset_dir, f"{USER_DIR_PREFIX}{user_id}", name))
+            for user_id, files in sorted(samples.items()) for name in sorted(files)]
+
+
+def _loaded_samples(dataset_dir, samples, loaded_paths):
+    """Narrow {user_id: {file name: mtime_ns}} down to the files that were read"""
+    loaded = {}
+    for user_id, files in samples.items():
+        user_path = os.path.join(dataset_dir, f"{USER_DIR_PREFIX}{user_id}")
+        for name, mtime in files.items():
+            if os.path.join(user_path, name) in loaded_paths:
+                loaded.setdefault(user_id, {})[name] = mtime
+    return loaded
+
+
+def cached_model(dataset_dir, samples, processes=None, progress=None):
+    """Model of the given {user_id: {file name: mtime_ns}} samples built from cached features.
+
+    Returns (model, set of paths that were read).
+    """
+    cache = FeatureCache(cache_dir(dataset_dir), FACE_SIZE)
+    histograms, labels, loaded_paths = cached_features(cache, _labeled_paths(dataset_dir, samples),
+                                                       processes, progress)
+    if not len(labels):
+        raise ValueError("No valid face images found")
+    return LBPHModel(histograms, labels, face_size=cache.face_size), loaded_paths
+
+
+def train_full(dataset_dir, model_path, dataset=None, processes=None, progress=None):
+    """Rebuild the model from every sample in the dataset"""
+    dataset = dataset if dataset is not None else scan_dataset(dataset_dir)
+    model, loaded_paths = cached_model(dataset_dir, dataset, processes, progress)
+    count = len(model)
+    save_model(model, model_path)
+    loaded = _loaded_samples(dataset_dir, dataset, loaded_paths)
+    save_manifest(model_path, loaded)
+    _logger.info(f"Trained model from scratch on {count} samples of {len(loaded)} users")
+    return count
+
+
+def train_packed(packed_dir, model_path, progress=None, output_path=None):
+    """Bring the model up to date with a packed dataset (see ``recognition.packed_dataset``).
+
+    The store is append-only, so the manifest only has to remember how many
+    samples the model contains; anything after that is new. The updated
+    model is written to ``output_path`` (default: over ``model_path``).
+    """
+    output_path = output_path or model_path
+    store = PackedDataset(packed_dir)
+    total = len(store)
+    data = read_manifest(model_path) or {}
+    packed = data.get('packed', {})
+    start = packed.get('rows', 0) if packed.get('face_size') == list(store.face_size) else 0
+    if start > total:
+        start = 0
+    if start and start == total:
+        return 'unchanged', 0
+
+    recognizer = cv2.face.LBPHFaceRecognizer_create()
+    count = 0
+    for faces, labels in store.iter_shards(start):
+        for i in range(0, len(faces), TRAIN_BATCH_SIZE):
+            batch_labels = labels[i:i + TRAIN_BATCH_SIZE]
+            # Rows of the memory-mapped shard are passed as views, without copying
+            batch = list(faces[i:i + TRAIN_BATCH_SIZE])
+            if count:
+                recognizer.update(batch, batch_labels)
+            else:
+                recognizer.train(batch, batch_labels)
+            count += len(batch)
+            if progress:
+                progress(STAGE_HISTOGRAMS, count, total - start)
+    if not count:
+        raise ValueError("No valid face images found")
+
+    model = LBPHModel.from_recognizer(recognizer, store.face_size)
+    if start:
+        model = load_model(model_path).append(model)
+    save_model(model, output_path)
+    write_manifest(output_path, {'packed': {'rows': total, 'face_size': list(store.face_size)}})
+    _logger.info(f"Trained {count} packed samples ({'incremental' if start else 'full'})")
+    return ('incremental' if start else 'full'), count
+
+
+def train_model(dataset_dir, model_path, processes=None, progress=None, build_index=False):
+    """Bring the model up to date with the dataset, incrementally when possible.
+
+    Returns a (mode, sample count) tuple where mode is 'full', 'incremental'
+    or 'unchanged' and the count is the number of samples trained on.
+    ``processes`` is passed on to ``iter_images``. ``progress(stage, done,
+    total)`` is called as images are loaded and their histograms computed,
+    then once the model (STAGE_WRITE) and its index (STAGE_INDEX) are written.
+    ``dataset_dir`` may also be a packed dataset. With ``build_index`` the
+    approximate nearest-neighbour index is rebuilt after a full training and
+    extended after an incremental one.
+
+    ``model_path`` names the model store: the new model is written as the
+    next version and published once it (and its index) is complete.
+    """
+    store = ModelStore(model_path)
+    _, current_path = store.current()
+    version, output_path = store.new_version()
+    mode, count = _train(dataset_dir, current_path, output_path, processes, progress)
+    if mode == 'unchanged':
+        if build_index and current_path:
+            update_index(current_path)
+        return mode, count
+    if progress:
+        progress(STAGE_WRITE, 1, 1)
+    if build_index:
+        update_index(output_path, rebuild=(mode == 'full'), source_path=current_path)
+        if progress:
+            progress(STAGE_INDEX, 1, 1)
+    store.publish(version)
+    return mode, count
+
+
+def _train(dataset_dir, model_path, output_path, processes=None, progress=None):
+    """Update the model at ``model_path`` (None if there is none yet) into ``output_path``"""
+    if is_packed_dataset(dataset_dir):
+        return train_packed(dataset_dir, model_path, progress, output_path)
+
+    dataset = scan_dataset(dataset_dir)
+    manifest = load_manifest(model_path)
+    if manifest is None:
+        return 'full', train_full(dataset_dir, output_path, dataset, processes, progress)
+    model = load_model(model_path)
+    if model.face_size != tuple(FACE_SIZE):
+        _logger.info(f"Model was trained on {model.face_size or 'unnormalized'} crops, rebuilding it at {FACE_SIZE}")
+        return 'full', train_full(dataset_dir, output_path, dataset, processes, progress)
+
+    # Samples can be added to an LBPH model but not taken out of it
+    removed = [user_id for user_id, files in manifest.items()
+               if any(dataset.get(user_id, {}).get(name) != mtime for name, mtime in files.items())]
+    if removed:
+        _logger.info(f"Samples of users {removed} were removed, rebuilding model")
+        return 'full', train_full(dataset_dir, output_path, dataset, processes, progress)
+
+    new_samples = {}
+    for user_id, files in dataset.items():
+        known = manifest.get(user_id, {})
+        added = {name: mtime for name, mtime in files.items() if name not in known}
+        if added:
+            new_samples[user_id] = added
+    if not new_samples:
+        return 'unchanged', 0
+
+    # Only the histograms of the new samples are computed. The new version is
+    # still a full copy of the model, streamed from the memory-mapped current one
+    added, loaded_paths = cached_model(dataset_dir, new_samples, processes, progress)
+    count = len(added)
+    save_model(model.append(added), output_path)
+    loaded = _loaded_samples(dataset_dir, new_samples, loaded_paths)
+    for user_id, files in loaded.items():
+        manifest.setdefault(user_id, {}).update(files)
+    save_manifest(output_path, manifest)
+    _logger.info(f"Added {count} samples of users {sorted(loaded)} to the model")
+    return 'incremental', count
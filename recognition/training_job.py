@@ -0,0 +1,158 @@
+"""Model training as a background job in a separate process.
+
+``TrainingJob.request`` starts ``train_model`` in a child process and
+returns at once; the GUI keeps running while the dataset is decoded and
+the model rebuilt. The child reports progress through a queue, which a
+monitor thread turns into ``on_progress(stage, done, total)`` calls
+(stages are the ``STAGE_*`` constants of ``recognition.training``),
+followed by ``on_done(mode, count)``, ``on_error(message)`` or
+``on_cancelled()``. The callbacks run on the monitor thread.
+
+Requests that arrive while a job is running are coalesced: one more run
+starts after the current one and picks up every sample enrolled meanwhile,
+so enrolling a whole class triggers a couple of trainings rather than one
+per student.
+
+``cancel`` stops the running job at its next progress report. Training
+publishes a model only once it is complete (see ``recognition.model_store``),
+so a cancelled job leaves the current model in place.
+"""
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+
+from recognition.training import train_model
+
+_logger = logging.getLogger(__name__)
+
+# Seconds to wait for a cancelled job before killing its process
+CANCEL_TIMEOUT = 10.0
+
+
+class TrainingCancelled(Exception):
+    pass
+
+
+def _run(dataset_dir, model_path, options, messages, cancel, log_level):
+    """Child process entry point"""
+    logging.basicConfig(level=log_level)
+
+    def progress(stage, done, total):
+        if cancel.is_set():
+            raise TrainingCancelled()
+        messages.put(('progress', stage, done, total))
+
+    try:
+        mode, count = train_model(dataset_dir, model_path, progress=progress, **options)
+        messages.put(('done', mode, count))
+    except TrainingCancelled:
+        messages.put(('cancelled',))
+    except Exception as e:
+        _logger.error(f"Error training model: {str(e)}")
+        messages.put(('error', str(e)))
+
+
+class TrainingJob:
+    """Runs ``train_model(dataset_dir, model_path, **options)`` in a child process on request"""
+
+    def __init__(self, dataset_dir, model_path, on_progress=None, on_done=None,
+                 on_error=None, on_cancelled=None, **options):
+        self.dataset_dir = dataset_dir
+        self.model_path = model_path
+        self.options = options
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_cancelled = on_cancelled
+        # Spawned rather than forked: the parent runs Qt and database threads
+        self._context = multiprocessing.get_context('spawn')
+        self._lock = threading.Lock()
+        self._process = None
+        self._cancel = None
+        self._pending = False
+        self._monitor = None
+
+    def is_running(self):
+        with self._lock:
+            return self._monitor is not None
+
+    def request(self):
+        """Train now, or once more after the running job if one is in progress"""
+        with self._lock:
+            if self._monitor is not None:
+                self._pending = True
+                return
+            self._start()
+
+    def cancel(self, wait=False):
+        """Stop the running job and drop queued requests"""
+        with self._lock:
+            self._pending = False
+            monitor = self._monitor
+            if self._cancel is not None:
+                self._cancel.set()
+        if wait and monitor is not None:
+            monitor.join(CANCEL_TIMEOUT + 1)
+
+    def _start(self):
+        # Called with the lock held
+        messages = self._context.Queue()
+        self._cancel = self._context.Event()
+        self._process = self._context.Process(
+            target=_run, name='training',
+            args=(self.dataset_dir, self.model_path, self.options, messages, self._cancel,
+                  logging.getLogger().getEffectiveLevel()),
+        )
+        self._process.start()
+        _logger.info(f"Training job started (pid {self._process.pid})")
+        self._monitor = threading.Thread(target=self._watch, args=(self._process, messages, self._cancel),
+                                         name='training-monitor', daemon=True)
+        self._monitor.start()
+
+    def _watch(self, process, messages, cancel):
+        result = None
+        deadline = None
+        while result is None:
+            try:
+                message = messages.get(timeout=0.2)
+            except queue.Empty:
+                if not process.is_alive() and messages.empty():
+                    result = ('error', f"Training process exited with code {process.exitcode}")
+                elif cancel.is_set():
+                    # A cancelled job stops at its next progress report, or is killed
+                    deadline = deadline or time.monotonic() + CANCEL_TIMEOUT
+                    if time.monotonic() > deadline:
+                        _logger.warning("Training job did not stop, terminating it")
+                        process.terminate()
+                continue
+            if message[0] == 'progress':
+                if self.on_progress and not cancel.is_set():
+                    self.on_progress(*message[1:])
+            else:
+                result = message
+        process.join()
+        self._report(result, cancel.is_set())
+
+        with self._lock:
+            self._monitor = None
+            self._process = None
+            if self._pending:
+                self._pending = False
+                self._start()
+
+    def _report(self, result, cancelled):
+        kind = result[0]
+        if kind == 'done':
+            _logger.info(f"Model training done ({result[1]}, {result[2]} samples)")
+            if self.on_done:
+                self.on_done(result[1], result[2])
+        elif kind == 'cancelled' or cancelled:
+            _logger.info("Training job cancelled")
+            if self.on_cancelled:
+                self.on_cancelled()
+        else:
+            _logger.error(f"Training job failed: {result[1]}")
+            if self.on_error:
+                self.on_error(result[1])
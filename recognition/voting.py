@@ -0,0 +1,65 @@
+"""Per-track identity voting.
+
+Single-frame LBPH predictions are noisy, and acting on every one of them
+floods the GUI and the database. ``IdentityVoter`` collects the predictions
+of each tracked face over a sliding window and reports an identity only once
+it wins a clear majority, and only once per person per session.
+"""
+import collections
+
+
+class IdentityVoter:
+    """Majority vote over the last ``window`` predictions of each track.
+
+    A prediction with a confidence (LBPH distance) of ``max_confidence`` or
+    more counts as a vote for "unknown". A label is decided when it holds at
+    least ``min_votes`` votes and ``min_ratio`` of the window; the decision
+    carries the average confidence of its votes. A decided label is not
+    reported again this session, so ``max_confidence`` must be no looser
+    than what the consumer of the decisions accepts (``100 -
+    CONFIDENCE_THRESHOLD``), or a person whose first decision is rejected
+    is never reported again.
+    """
+
+    def __init__(self, window=15, min_votes=8, min_ratio=0.6, max_confidence=100):
+        self.window = window
+        self.min_votes = min_votes
+        self.min_ratio = min_ratio
+        self.max_confidence = max_confidence
+        self.reset()
+
+    def reset(self):
+        """Start a new session: forget all votes and decisions"""
+        self._votes = {}
+        self._decided_tracks = {}
+        self.decided_labels = set()
+
+    def add(self, track_id, label, confidence):
+        """Record a prediction; return (label, average confidence) when it becomes decisive"""
+        if track_id in self._decided_tracks:
+            return None
+        votes = self._votes.setdefault(track_id, collections.deque(maxlen=self.window))
+        votes.append((label if confidence < self.max_confidence else None, confidence))
+
+        counts = collections.Counter(vote for vote, _ in votes)
+        winner, count = counts.most_common(1)[0]
+        if winner is None or count < self.min_votes or count < self.min_ratio * len(votes):
+            return None
+
+        self._decided_tracks[track_id] = winner
+        del self._votes[track_id]
+        if winner in self.decided_labels:
+            return None
+        self.decided_labels.add(winner)
+        average = sum(confidence for vote, confidence in votes if vote == winner) / count
+        return winner, average
+
+    def retain(self, track_ids):
+        """Drop the state of tracks that are no longer being followed"""
+        active = set(track_ids)
+        for track_id in list(self._votes):
+            if track_id not in active:
+                del self._votes[track_id]
+        for track_id in list(self._decided_tracks):
+            if track_id not in active:
+                del self._decided_tracks[track_id]
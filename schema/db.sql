@@ -55,11 +55,14 @@ CREATE TABLE attendance (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
--- Create Face_Data table to store face encoding data
+-- Create Face_Data table to store face samples as compressed grayscale pixels
 CREATE TABLE face_data (
     face_id SERIAL PRIMARY KEY,
     user_id INTEGER NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
-    face_encoding TEXT NOT NULL,
+    face_encoding BYTEA NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    compression VARCHAR(10) NOT NULL DEFAULT 'zlib' CHECK (compression IN ('zlib', 'none')),
     image_path VARCHAR(255),
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
@@ -0,0 +1,35 @@
+-- Description: migrate face_data from hex TEXT to compact binary samples
+-- face_encoding used to hold face_img.tobytes().hex(), which doubles the size and loses the
+-- image dimensions. New samples are stored as zlib-compressed grayscale pixels with their
+-- width and height. Existing rows are decoded from hex in place and marked as uncompressed;
+-- their dimensions are unknown and stay NULL.
+-- Ensure you are connected to the face_recognization database before executing this script.
+
+BEGIN;
+
+-- The migration can be run again: every step is skipped once it has been applied
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM information_schema.columns
+               WHERE table_name = 'face_data' AND column_name = 'face_encoding' AND data_type = 'text') THEN
+        ALTER TABLE face_data
+            ALTER COLUMN face_encoding TYPE BYTEA USING decode(face_encoding, 'hex');
+    END IF;
+END
+$$;
+
+ALTER TABLE face_data ADD COLUMN IF NOT EXISTS width INTEGER;
+ALTER TABLE face_data ADD COLUMN IF NOT EXISTS height INTEGER;
+ALTER TABLE face_data ADD COLUMN IF NOT EXISTS compression VARCHAR(10) NOT NULL DEFAULT 'none';
+ALTER TABLE face_data ALTER COLUMN compression SET DEFAULT 'zlib';
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'face_data_compression_check') THEN
+        ALTER TABLE face_data ADD CONSTRAINT face_data_compression_check CHECK (compression IN ('zlib', 'none'));
+    END IF;
+END
+$$;
+
+COMMIT;
+
+-- End of SQL script
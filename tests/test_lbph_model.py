@@ -0,0 +1,100 @@
+import cv2
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import make_sample, make_user
+from recognition.lbph_model import LBPHModel, chi2_distance
+
+USERS = 8
+SAMPLES = 4
+
+
+@pytest.fixture(scope='module')
+def faces():
+    """(training faces, their labels, query faces with their true labels)"""
+    rng = np.random.default_rng(0)
+    bases = [make_user(rng) for _ in range(USERS)]
+    labels = np.repeat(np.arange(USERS, dtype=np.int32), SAMPLES)
+    training = [make_sample(rng, bases[label]) for label in labels]
+    queries = [make_sample(rng, bases[label]) for label in range(USERS)]
+    # A stranger, nearest to nobody in particular
+    queries.append(make_sample(rng, make_user(rng)))
+    return training, labels, queries
+
+
+def opencv_recognizer(training, labels):
+    recognizer = cv2.face.LBPHFaceRecognizer_create()
+    recognizer.train(training, labels)
+    return recognizer
+
+
+def assert_same_predictions(model, recognizer, queries):
+    for query, matches in zip(queries, model.predict_batch(queries)):
+        label, distance = recognizer.predict(query)
+        assert matches[0][0] == label
+        assert matches[0][1] == pytest.approx(distance, rel=1e-5)
+
+
+def test_predict_matches_opencv(faces):
+    training, labels, queries = faces
+    recognizer = opencv_recognizer(training, labels)
+    model = LBPHModel.from_recognizer(recognizer)
+    assert_same_predictions(model, recognizer, queries)
+    for query in queries:
+        assert model.predict(query)[0] == recognizer.predict(query)[0]
+
+
+def test_save_load_round_trip(faces, tmp_path):
+    training, labels, queries = faces
+    recognizer = opencv_recognizer(training, labels)
+    path = str(tmp_path / 'model.lbph')
+    LBPHModel.from_recognizer(recognizer).save(path)
+    for mmap in (True, False):
+        loaded = LBPHModel.load(path, mmap)
+        assert np.array_equal(loaded.labels, labels)
+        assert loaded.roots is not None
+        assert_same_predictions(loaded, recognizer, queries)
+
+
+def test_appended_model_matches_opencv(faces, tmp_path):
+    training, labels, queries = faces
+    split = USERS // 2 * SAMPLES
+    path = str(tmp_path / 'first.lbph')
+    LBPHModel.from_recognizer(opencv_recognizer(training[:split], labels[:split])).save(path)
+    second = LBPHModel.from_recognizer(opencv_recognizer(training[split:], labels[split:]))
+    model = LBPHModel.load(path).append(second)
+    recognizer = opencv_recognizer(training, labels)
+    assert_same_predictions(model, recognizer, queries)
+
+    # Saving streams both parts into one file
+    model.save(str(tmp_path / 'merged.lbph'))
+    assert_same_predictions(LBPHModel.load(str(tmp_path / 'merged.lbph')), recognizer, queries)
+
+
+def test_subset_matches_opencv_trained_on_the_subset(faces, tmp_path):
+    training, labels, queries = faces
+    members = [1, 2, 5]
+    keep = np.isin(labels, members)
+    path = str(tmp_path / 'model.lbph')
+    LBPHModel.from_recognizer(opencv_recognizer(training, labels)).save(path)
+    subset = LBPHModel.load(path).subset(members)
+    recognizer = opencv_recognizer([face for face, kept in zip(training, keep) if kept], labels[keep])
+    assert sorted(set(subset.labels.tolist())) == members
+    assert_same_predictions(subset, recognizer, queries)
+
+
+def test_top_k_labels_are_distinct_and_nearest_first(faces):
+    training, labels, queries = faces
+    recognizer = opencv_recognizer(training, labels)
+    model = LBPHModel.from_recognizer(recognizer)
+    histograms = [h.reshape(1, -1) for h in recognizer.getHistograms()]
+    for query, matches in zip(queries, model.predict_batch(queries, k=3)):
+        query_histogram = model.histograms_of([query])[0]
+        # Linear scan: the nearest sample of every label
+        nearest = {}
+        for histogram, label in zip(histograms, labels):
+            distance = chi2_distance(histogram.astype(np.float32).ravel(), query_histogram)
+            nearest[int(label)] = min(distance, nearest.get(int(label), np.inf))
+        expected = sorted(nearest.items(), key=lambda item: item[1])[:3]
+        assert [label for label, _ in matches] == [label for label, _ in expected]
+        assert [distance for _, distance in matches] == pytest.approx([d for _, d in expected], rel=1e-5)
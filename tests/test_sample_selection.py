@@ -0,0 +1,24 @@
+import cv2
+import numpy as np
+
+from recognition.sample_selection import select_samples
+
+
+def identical_frames(n):
+    face = cv2.GaussianBlur(np.random.default_rng(0).integers(0, 256, (100, 100), dtype=np.uint8), (3, 3), 0)
+    return [face.copy() for _ in range(n)]
+
+
+def test_min_distance_zero_never_picks_a_face_twice():
+    selected = select_samples(identical_frames(10), count=5, min_distance=0)
+    assert len(selected) == 5
+    assert len(set(selected)) == 5
+
+
+def test_min_distance_zero_stops_when_every_face_is_picked():
+    selected = select_samples(identical_frames(4), count=20, min_distance=0)
+    assert sorted(selected) == [0, 1, 2, 3]
+
+
+def test_identical_faces_are_picked_once():
+    assert len(select_samples(identical_frames(10), count=5, min_distance=1)) == 1
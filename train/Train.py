@@ -1,40 +1,59 @@
-import cv2
 import os
-import numpy as np
-from PIL import Image
-
-# Path for face image database
-path = 'dataset'
-
-recognizer = cv2.face.LBPHFaceRecognizer_create()
-detector = cv2.CascadeClassifier("haarcascade_frontalface_default.xml")
-
-# function to get the images and label data
-def getImagesAndLabels(path):
-    imagePaths = [os.path.join(path, f) for f in os.listdir(path)]
-    faceSamples = []
-    ids = []
+import sys
 
-    for imagePath in imagePaths:
-        PIL_img = Image.open(imagePath).convert('L')  # convert it to grayscale
-        img_numpy = np.array(PIL_img, 'uint8')
-
-        id = int(os.path.split(imagePath)[-1].split(".")[1])
-        faces = detector.detectMultiScale(img_numpy)
-
-        for (x, y, w, h) in faces:
-            faceSamples.append(img_numpy[y:y + h, x:x + w])
-            ids.append(id)
-
-    return faceSamples, ids
+import cv2
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.setting import BASE_DIR, CASCADE_FILE, DATASET_DIR, TRAINER_DIR, TRAINER_FILE
+from recognition.lbph_model import LBPHModel
+from recognition.model_store import ModelStore
+from recognition.training import STAGE_LOAD, train_streaming
 
-print("\n [INFO] Training faces. It will take a few seconds. Wait ...")
-faces, ids = getImagesAndLabels(path)
-recognizer.train(faces, np.array(ids))
+# Path for face image database, the same wherever the script is run from
+path = DATASET_DIR
 
-# Save the model into trainer/trainer.yml
-recognizer.write('trainer/trainer.yml')
+recognizer = cv2.face.LBPHFaceRecognizer_create()
 
-# Print the number of faces trained and end program
-print("\n [INFO] {0} faces trained. Exiting Program".format(len(np.unique(ids))))
\ No newline at end of file
+# function to get the image paths and label data
+def getImagePathsAndLabels(path):
+    labeledPaths = []
+    for f in sorted(os.listdir(path)):
+        imagePath = os.path.join(path, f)
+        if not os.path.isfile(imagePath):
+            continue
+        id = int(f.split(".")[1])
+        labeledPaths.append((id, imagePath))
+    return labeledPaths
+
+
+def showProgress(stage, done, total):
+    if stage == STAGE_LOAD:
+        print("\r [INFO] {0}/{1} images loaded".format(done, total), end="", flush=True)
+
+
+if __name__ == '__main__':
+    print("\n [INFO] Training faces. It will take a few seconds. Wait ...")
+    if not os.path.isdir(path):
+        raise SystemExit(" [ERROR] No dataset directory {0}".format(path))
+    labeledPaths = getImagePathsAndLabels(path)
+
+    # Images are decoded across all cores; faces are only re-detected in
+    # images that are not already cropped
+    count, _ = train_streaming(recognizer, labeledPaths,
+                               cascade_path=os.path.join(BASE_DIR, CASCADE_FILE),
+                               progress=showProgress)
+    # An empty model would replace the running one and recognize nobody
+    if not count:
+        raise SystemExit("\n [ERROR] No faces trained from {0}, model not published".format(path))
+
+    # Publish the model as the next version of the model the app and the
+    # services poll, so they pick it up like a model trained from the GUI
+    os.makedirs(TRAINER_DIR, exist_ok=True)
+    store = ModelStore(os.path.join(TRAINER_DIR, TRAINER_FILE))
+    version, modelPath = store.new_version()
+    LBPHModel.from_recognizer(recognizer).save(modelPath)
+    store.publish(version)
+
+    # Print the number of faces trained and end program
+    print("\n [INFO] {0} faces of {1} users trained into {2}. Exiting Program".format(
+        count, len({id for id, _ in labeledPaths}), modelPath))